@@ -1,4 +1,6 @@
 from .converter import converter
 from .mechanical import MechanicalProperties
 from .mechanical import approximate_elastic_regime_from_hough
+from .mechanical import refined_hough
 from .mechanical import set_elastic
+from .mechanical import elastic_window_search
@@ -2,6 +2,7 @@
 
 from .mechanical import MechanicalProperties, set_elastic
 from pypif import pif
+from json import JSONDecodeError
 import re
 import pandas as pd
 import numpy as np
@@ -44,6 +45,13 @@ def converter(files=[], **kwds):
         Should be one of: {MPa, kip}
     :param interactive, bool: If True, use interactive tools for approximating
         the modulus before using ASTM E111 to finalize the calculation.
+    :param decimate, float or (float, float): tolerance used to decimate the
+        merged stress-strain curve for the Hough approximation (see
+        MechanicalProperties). Default: None (no decimation).
+    All other keywords, e.g. the Hough grid options `nq`, `nr` ("auto"
+    sizes the grid), `precision` and `memory`, are passed through to
+    `set_elastic`. The size of the Hough grid that was used is recorded
+    in the preparation details of the PIF.
 
     Output
     ======
@@ -137,8 +145,12 @@ def converter(files=[], **kwds):
     # TODO: add epsilon/sigma mask to property results
 
     # Calculate the mechanical properties of the object
-    mechprop = MechanicalProperties(epsilon, sigma, interactive=interactive)
-    best = set_elastic(mechprop, interactive=interactive)
+    mechprop = MechanicalProperties(epsilon, sigma, interactive=interactive,
+                                    decimate=kwds.get('decimate', None))
+    options = dict((k, v) for k, v in kwds.items()
+                   if k not in ('units', 'decimate'))
+    options['interactive'] = interactive
+    best = set_elastic(mechprop, **options)
     SE_modulus = best['SE modulus']
     # Create the PIF file
     results = [
@@ -214,20 +226,30 @@ def converter(files=[], **kwds):
     # Wrap in system object
     hough = best['hough']
     resampled = best['resampled']
+    details = [
+        pif.Value(
+            name='hough',
+            vectors=[[col for col in row] for row in hough]
+        ),
+        pif.Value(
+            name='resampled hough',
+            vectors=[[col for col in row] for row in resampled]
+        )]
+    #+ record the Hough grid, which may have been sized automatically
+    if hasattr(hough, 'nq'):
+        details += [
+            pif.Value(name='theta divisions', scalars=int(hough.nq),
+                      tags='nq of the Hough space'),
+            pif.Value(name='radial divisions', scalars=int(hough.nr),
+                      tags='nr of the Hough space'),
+            pif.Value(name='voting points', scalars=int(hough.consumed),
+                      tags='number of points that voted in the Hough space')]
     results = pif.System(
         names='stress-strain curve',
         sub_systems=[subsys['strain'], subsys['stress']],
         preparation=pif.ProcessStep(
             name='approximator',
-            details=[
-                pif.Value(
-                    name='hough',
-                    vectors=[[col for col in row] for row in hough]
-                ),
-                pif.Value(
-                    name='resampled hough',
-                    vectors=[[col for col in row] for row in resampled]
-                )]),
+            details=details),
         properties=results,
         references=pif.Reference(
             url='https://www.astm.org/Standards/E111.htm'),
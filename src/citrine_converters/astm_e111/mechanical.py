@@ -1,15 +1,22 @@
 from __future__ import division
 
+import os
 import numpy as np
 from matplotlib import pyplot as plt
 from scipy.ndimage import gaussian_filter
 from ..tools.interactive import DraggableLine
 from ..tools.interactive import trim
+from ..tools.pool import acquire
+from ..tools.decimate import decimate as decimate_curve
 from ..tools import (
     linear_merge,
     Normalized,
     resample,
-    HoughSpace)
+    interpolate_peak,
+    remove_outliers,
+    HoughSpace,
+    SparseHoughSpace,
+    grid_size)
 
 
 ELASTIC_OFFSET=0.002
@@ -40,8 +47,22 @@ class MechanicalProperties(object):
         contain `time` and `stress` fields.
     :param interactive, bool: Whether to trip the stress and strain data
         using an interactive plot.
+    :param decimate, float or (float, float): If given, the merged curve
+        is decimated (see `tools.decimate`) for the elastic fit: only
+        the points that do not lie within this tolerance (of strain, or
+        of strain and stress) of the curve through their neighbors vote
+        in the Hough approximation, and only those of the elastic region
+        are fit (see `set_elastic`). A tolerance of the order of the
+        strain-gauge error shrinks an oversampled curve many times over.
+        The bounds of the elastic region are still found from the full
+        curve. Default: None (every point is used).
+
+    Attributes
+    ==========
+    :decimated, numpy.ndarray or None: boolean mask of the points kept
+        by decimation, or None if the curve was not decimated.
     """
-    def __init__(self, epsilon, sigma, interactive=False):
+    def __init__(self, epsilon, sigma, interactive=False, decimate=None):
         # ##########
         # merge on time
         time, strain, stress = linear_merge(
@@ -55,6 +76,9 @@ class MechanicalProperties(object):
         self.time   = time
         self.strain = strain
         self.stress = stress
+        self.decimated = None
+        if decimate is not None:
+            self.decimated = decimate_curve(strain, stress, decimate)
 
     @property
     def elastic_modulus(self):
@@ -262,6 +286,96 @@ def approximate_elastic_regime_from_hough(mechprop, **kwds):
         Default: 60 degrees.
     :upper, float: upper angle in which to look for the modulus (in degrees).
         Default: 90 degrees.
+    :nq, int or "auto": number of theta divisions of the Hough space.
+        "auto" sizes the grid from the number of points, `precision`
+        and `memory` (see `tools.grid_size`); the chosen size is that
+        of the returned `hough`. Default: 1801.
+    :nr, int or "auto": number of radial divisions (see `nq`).
+        Default: 1801.
+    :precision, float: target angular precision, in degrees, of an
+        "auto" grid. Default: 0.1.
+    :memory, float: memory budget, in MB, of the accumulator of an
+        "auto" grid. Default: None (unlimited).
+    :banded, bool: If True, only the theta band between `lower` and
+        `upper` (plus enough rows for the smoothing kernel) is allocated,
+        filled and smoothed. Default: False.
+    :sparse, bool: If True, the Hough space is held sparse while the
+        votes are cast (see `tools.SparseHoughSpace`), restricted to
+        the search band as for `banded`, and only that band is made
+        dense for the peak search. This saves memory on fine radial
+        grids with few points (e.g. a decimated curve), where most
+        cells of the band hold no vote. Not available with `pyramid`
+        or `subsample`. Default: False.
+    :pyramid, int: If greater than 1, the Hough space is first built on a
+        grid this many times coarser than `nq` x `nr`, and only the window
+        around the coarse peak is then built at full resolution. See
+        `refined_hough`. Supercedes `banded`. Default: 0 (off).
+    :detector, str: how the peak in the Hough space is found. One of
+        "resample" (resample the Hough space, then smooth it with three
+        gaussian passes and average the positions of the maximum) or
+        "deterministic" (a single, equivalent gaussian pass over the
+        search band only, followed by a local maximum search).
+        Default: "resample".
+    :seed, int: seed used to resample the Hough space, so that the
+        approximation is reproducible. Default: None (unseeded).
+    :rng, numpy.random.Generator: random number generator used to
+        resample the Hough space. Supercedes `seed`.
+    :interpolate, bool: If True, the peak is refined to sub-division
+        accuracy by a parabolic fit through its neighbors (see
+        `tools.interpolate_peak`). Default: True for "linear" voting
+        (see HoughSpace), False otherwise.
+    :roi, str, float or (int, int): region of interest: only the points
+        in it vote. The elastic region lies in the low-strain part of
+        the curve, so the plastic tail can be left out. One of
+        "ultimate" (the points up to the ultimate stress), a fraction
+        of the strain range (the points whose strain lies within that
+        fraction of the range from its lower end) or a window,
+        [first, last), of point indices. The points are normalized,
+        and the radial range set, as for the full curve, so that the
+        result is comparable to that of a full run, and the elastic
+        region is still found from the full curve. Of a decimated
+        curve (see MechanicalProperties), only the points kept by the
+        decimation vote. Default: None (every point votes).
+    :subsample, bool: If True, only a random subsample of the points
+        votes, until the smoothed peak in the search band is stable
+        (see the probabilistic options of HoughSpace: `batch`,
+        `stability`, `patience`, `peak_sigma`; `seed` and `rng` also set
+        the order of the points).
+        The number of points that voted is `hough.consumed`.
+        Default: False.
+    :compliance, bool: If True, look for a compliance (toe) region,
+        i.e. a flatter line, supported by the points at lower strain,
+        that leads into the elastic line. Its candidates are the next
+        strongest peaks of the same Hough space (see
+        `HoughSpace.peaks`). The compliance region is excluded from
+        the elastic region. Default: False.
+    :candidates, int: number of compliance candidates. Default: 4.
+    :compliance_ratio, float: largest ratio of the slope of the
+        compliance line to that of the elastic line. Flatter candidates
+        must also lie more than the width of the smoothing kernel away
+        from the elastic peak, and be supported mostly by points that
+        are not on the elastic line, so that a sidelobe of the elastic
+        peak is not taken for a compliance line. Default: 0.8.
+    :region, str: how the elastic region is found from the elastic line.
+        "offset" (default): every point up to the last point that does
+            not lie below the line offset by ELASTIC_OFFSET strain.
+        "segment": the longest run of consecutive points that lie
+            within ELASTIC_OFFSET strain of the line (see
+            `HoughSpace.segment`; `max_gap` is passed through).
+    :cache, str: directory of an on-disk cache of Hough spaces. A Hough
+        space is stored under its content hash (see `HoughSpace.digest`)
+        and is reused, memory-mapped, whenever the data and the options
+        that determine it are unchanged, e.g. when only `detector` or,
+        unless `pyramid` is used, `lower`/`upper` change. A `subsample`
+        is cached only if it is drawn from an integer `seed`.
+        Default: None (no cache).
+    :pool, BufferPool: pool from which the Hough space, the resampled
+        Hough space and the smoothed search band are drawn (see
+        `tools.BufferPool`), e.g. to keep the memory of a batch run flat.
+        Intermediate arrays are handed back to the pool; the `hough`
+        and `resampled` arrays of the result should be, with
+        `pool.release`, once they are no longer needed.
+        Default: None.
     Passed through to the construction of a HoughSpace object. See
     HoughSpace for a description of these options.
 
@@ -282,12 +396,53 @@ def approximate_elastic_regime_from_hough(mechprop, **kwds):
         the elastic region.
     :elastic stress, array: slice of the stress vector lying inside
         the elastic region.
-    :resampled, 2D numpy.ndarray: resampled hough space
+    :elastic weights, array: only of a decimated curve, the number of
+        points of the elastic region that each of the points kept by
+        decimation (those in `elastic strain`) stands for.
+    :resampled, 2D numpy.ndarray: resampled and smoothed hough space
+        (for the "deterministic" detector, the smoothed search band).
     :hough, HoughSpace: hough transform of stress-strain data.
     """
     # handle keywords
     qlo = kwds.get('lower', 60)
     qhi = kwds.get('upper', 90)
+    detector = kwds.get('detector', 'resample')
+    pool = kwds.get('pool', None)
+    if detector not in ('resample', 'deterministic'):
+        msg = 'Unrecognized peak detector "{}".'.format(detector)
+        raise ValueError(msg)
+    pyramid = int(kwds.get('pyramid', 0))
+    if kwds.get('subsample', False):
+        # track the peak where it is searched for
+        kwds.setdefault('peak_band', (qlo, qhi))
+    roi = _region_of_interest(mechprop.strain, mechprop.stress,
+                              kwds.get('roi', None))
+    decimated = getattr(mechprop, 'decimated', None)
+    if decimated is not None:
+        # only the points kept by decimation vote
+        vote = np.zeros(np.size(mechprop.strain), dtype=bool)
+        vote[roi] = True
+        roi = vote & decimated
+    if 'auto' in (kwds.get('nq', 1801), kwds.get('nr', 1801)):
+        # fix the grid size here, so that the pyramid and the cache see
+        # the same grid as the Hough space
+        nq, nr = grid_size(np.size(np.asarray(mechprop.strain)[roi]), **kwds)
+        if kwds.get('nq', 1801) == 'auto':
+            kwds['nq'] = nq
+        if kwds.get('nr', 1801) == 'auto':
+            kwds['nr'] = nr
+    sparse = kwds.get('sparse', False)
+    if sparse and (pyramid > 1 or kwds.get('subsample', False)):
+        msg = 'A sparse Hough space cannot be built by a pyramid or ' \
+              'subsampled.'
+        raise ValueError(msg)
+    if (kwds.get('banded', False) or sparse) and pyramid < 2:
+        # only the search band is needed, plus a margin wide enough
+        # that the smoothing passes below do not see the band edges.
+        sigma = _smoothing_sigma(kwds.get('nq', 1801), kwds.get('nr', 1801))
+        kwds['band'] = (qlo, qhi)
+        kwds['margin'] = int(max(_smoothing_reach(sigma)[0],
+                                 _smoothing_reach(np.sqrt(3)*sigma, 1)[0]))
 
     # The Hough space will result in a curve that forms a "V" shape
     # near 90 degrees. The stress-strain curve have significantly
@@ -295,26 +450,211 @@ def approximate_elastic_regime_from_hough(mechprop, **kwds):
     # Normalize stress and strain so both are in the range [0-1].
     strain = Normalized(mechprop.strain)
     stress = Normalized(mechprop.stress)
-    hough = HoughSpace(strain, stress, **kwds)
-
-    # resample Hough space
-    resampled = resample(hough)
+    if kwds.get('roi', None) is not None or decimated is not None:
+        # the radial range of the full curve (see HoughSpace `rmax`)
+        rmax = np.sqrt(strain**2 + stress**2).view(np.ndarray).max()
+        kwds['rmax'] = max(rmax, kwds.get('rmax', None) or 0.)
+    # the points that vote keep the scaling of the full curve
+    xvote, yvote = strain[roi], stress[roi]
+    weights = kwds.get('weights', None)
+    if decimated is not None and not isinstance(weights, str):
+        # each point kept by decimation votes for the points it stands
+        # for, so that the votes are balanced as for the full curve
+        counts = _decimation_weights(decimated)
+        weights = counts if weights is None else \
+                  counts*np.asarray(weights, dtype=float)
+        kwds['weights'] = weights
+    if weights is not None and not isinstance(weights, str):
+        kwds['weights'] = np.asarray(weights)[roi]
+    cache = kwds.get('cache', None)
+    if not HoughSpace.reproducible(**kwds):
+        # a subsample that is not drawn from an integer seed differs
+        # from call to call, and so cannot be cached
+        cache = None
+    if cache is not None:
+        # the pyramid window depends on the search band
+        salt = (qlo, qhi, pyramid, kwds.get('halfwidth', None)) \
+               if pyramid > 1 else None
+        fname = os.path.join(cache, HoughSpace.digest(
+            xvote, yvote, salt=salt, **kwds))
+    if cache is not None and os.path.exists(fname + '.npy'):
+        hough = HoughSpace.load(fname)
+    elif pyramid > 1:
+        hough = refined_hough(xvote, yvote, qlo, qhi, pyramid, **kwds)
+    elif sparse:
+        # only the searched band (and the margin of the smoothing
+        # kernel) is stored, and made dense, see `banded`
+        hough = SparseHoughSpace(xvote, yvote, **kwds).todense(pool=pool)
+    else:
+        hough = HoughSpace(xvote, yvote, **kwds)
+    if cache is not None and not os.path.exists(fname + '.npy'):
+        if not os.path.isdir(cache):
+            os.makedirs(cache)
+        hough.save(fname)
 
-    # smooth the resampled data to eliminate noise
-    resampled[:] = gaussian_filter(resampled, 3)
-    resampled[:] = gaussian_filter(resampled, 3)
-    resampled[:] = gaussian_filter(resampled, 3)
+    interpolate = kwds.get('interpolate', hough.voting == 'linear')
+    sigma = _smoothing_sigma(hough.nq, hough.nr)
 
+    band = (qlo, qhi)
     # look in the 60-90 degree range for the elastic region
-    qlo = int(qlo/180*hough.nq)
-    qhi = int(qhi/180*hough.nq)
-    sub = resampled[qlo:qhi]
-    pos = np.mean(np.argwhere(sub == sub.max()), axis=0) + [qlo, 0]
-    theta, distance = hough.theta_distance(*pos)
+    qlo = max(0, int(qlo/180*hough.nq) - hough.qoffset)
+    qhi = min(hough.shape[0], int(qhi/180*hough.nq) - hough.qoffset)
+
+    if detector == 'deterministic':
+        # three gaussian passes of `sigma` are equivalent to a single
+        # pass of sigma*sqrt(3). Smooth only the search band.
+        found = hough.peaks(1, band, sigma=np.sqrt(3)*sigma,
+                            interpolate=interpolate, pool=pool)
+        resampled = found['smoothed']
+        theta, distance = found['theta'][0], found['distance'][0]
+    else:
+        # resample Hough space. A band-limited or windowed Hough space
+        # holds only a fraction of the votes, so it is resampled with
+        # the same fraction of the samples used for the full space.
+        npoints = hough.x.size if hough.weights is None else \
+                  hough.weights.sum()
+        votes = npoints*(hough.nq - 1)
+        num = int(round(hough.nq*hough.nr*float(hough.sum())/max(votes, 1)))
+        resampled = resample(hough, num=num,
+                             seed=kwds.get('seed', None),
+                             rng=kwds.get('rng', None),
+                             pool=pool)
+
+        # smooth the resampled data to eliminate noise. The filter is
+        # applied in place to avoid a full-size temporary on each pass.
+        gaussian_filter(resampled, sigma, output=resampled)
+        gaussian_filter(resampled, sigma, output=resampled)
+        gaussian_filter(resampled, sigma, output=resampled)
+
+        sub = resampled[qlo:qhi]
+        pos = np.mean(np.argwhere(sub == sub.max()), axis=0)
+        if interpolate:
+            pos = interpolate_peak(sub, np.round(pos))
+        pos = pos + [qlo, 0]
+        theta, distance = hough.theta_distance(*pos)
 
     # move from scaled to unscaled coordinates (see doc string)
     x, y = strain.unscaled, stress.unscaled
-    xs, ys = strain, stress
+    m, b = _unscaled_line(theta, distance, x, y)
+
+    region = kwds.get('region', 'offset')
+    if region == 'segment':
+        # the elastic region is the run of points that supports the
+        # elastic line: points within ELASTIC_OFFSET strain of it.
+        width = abs(ELASTIC_OFFSET/(x.max() - x.min())*np.sin(theta))
+        start, end = hough.segment(theta, distance,
+                                   xdata=strain.view(np.ndarray),
+                                   ydata=stress.view(np.ndarray),
+                                   width=width,
+                                   max_gap=kwds.get('max_gap', 0))
+        plastic = np.ones_like(x, dtype=bool)
+        plastic[start:end] = False
+    elif region == 'offset':
+        # find the plastic region (lies below `y = m*(x - ELASTIC_OFFSET) + b`
+        # line): everything after the last point that is not below it.
+        plastic = (y < (m*(x - ELASTIC_OFFSET) + b))
+        elastic = np.flatnonzero(~plastic)
+        if elastic.size:
+            plastic[:elastic[-1]] = False
+    else:
+        msg = '"region" must be one of "offset" or "segment".'
+        raise ValueError(msg)
+
+    # find the compliance region, if it exists
+    compliance = np.zeros_like(plastic, dtype=bool)
+    if kwds.get('compliance', False):
+        # the compliance region, if present, is a flatter line that
+        # leads into the elastic line: its votes are already in the
+        # Hough space, as a weaker peak at a smaller angle.
+        # peaks within the width of the smoothing kernel of the elastic
+        # peak are sidelobes of it, not separate lines.
+        separation = int(np.ceil(2*np.sqrt(3)*sigma.max()))
+        upper = np.degrees(theta) - separation*180/(hough.nq - 2)
+        candidates = hough.peaks(
+            int(kwds.get('candidates', 4)),
+            (0, upper),
+            min_separation=separation,
+            sigma=np.sqrt(3)*sigma,
+            pool=pool)
+        if pool is not None:
+            pool.release(candidates['smoothed'])
+        ratio = kwds.get('compliance_ratio', 0.8)
+        # points within two radial divisions of a line lie on it
+        rlo, rhi = hough.radius
+        tol = 2*(rhi - rlo)/(hough.nr - 1)
+        xs, ys = strain.view(np.ndarray), stress.view(np.ndarray)
+        elastic = np.abs(
+            HoughSpace.distance(xs, ys, np.pi - theta) - distance) < tol
+        for qc, dc in zip(candidates['theta'], candidates['distance']):
+            mc, bc = _unscaled_line(qc, dc, x, y)
+            if not 0 < mc < ratio*m:
+                continue
+            # strain at which the compliance line meets the elastic line
+            xc = (bc - b)/(m - mc)
+            online = np.abs(HoughSpace.distance(xs, ys, np.pi - qc) - dc) < tol
+            # the compliance line must be supported by points at lower
+            # strain than the intersection, i.e. precede the elastic
+            # region, rather than follow it (e.g. a plastic plateau);
+            # most of these points must be off the elastic line; and
+            # some of the elastic region must remain.
+            if xc > x.min() and np.any(online) and \
+                    np.median(x[online]) < xc and \
+                    np.mean(elastic[online]) < 0.5 and \
+                    np.any((x >= xc) & (~plastic)):
+                compliance = (x < xc) & (~plastic)
+                break
+
+    # a first approximation to the elastic region is the region
+    # that is not compliance and not plastic.
+    mask = ((~compliance) & (~plastic))
+    result = {
+        'elastic modulus': m,
+        'elastic onset': -b/m,
+        'resampled': resampled,
+        'hough': hough
+    }
+    if decimated is not None:
+        # like the votes, the fit sees only the points kept, each
+        # weighted by the points of the region it stands for
+        result['elastic weights'] = \
+            _decimation_weights(decimated[mask])[decimated[mask]]
+        mask &= decimated
+    result['elastic strain'] = x[mask]
+    result['elastic stress'] = y[mask]
+    return result
+
+
+def _smoothing_sigma(nq, nr):
+    """
+    Standard deviation, in divisions along theta and distance, of each
+    of the three gaussian passes that smooth the Hough space in
+    `approximate_elastic_regime_from_hough`. The width is set for the
+    default 1801 x 1801 grid and scaled with the grid, so that it spans
+    the same range of angles and distances on any grid.
+    """
+    return np.array([3*(int(nq) - 1)/1800, 3*(int(nr) - 1)/1800])
+
+
+def _smoothing_reach(sigma, passes=3, truncate=4.0):
+    """
+    Divisions, along each axis, over which `passes` gaussian passes of
+    `sigma`, truncated at `truncate` standard deviations (as in
+    `scipy.ndimage.gaussian_filter`), draw on their neighbors.
+    """
+    sigma = np.asarray(sigma, dtype=float)
+    return passes*(truncate*sigma + 0.5).astype(int)
+
+
+def _unscaled_line(theta, distance, x, y):
+    """
+    Slope and intercept, in the units of `x` and `y`, of the line
+    `(theta, distance)` in a Hough space of the normalized x and y
+    (see `approximate_elastic_regime_from_hough`).
+
+    Output
+    ======
+    (m, b) for `y = m*x + b`
+    """
     xmin, xmax = x.min(), x.max()
     ymin, ymax = y.min(), y.max()
     dy = ymax - ymin
@@ -322,33 +662,145 @@ def approximate_elastic_regime_from_hough(mechprop, **kwds):
     dydx = dy/dx
     tanq = np.tan(theta)
     secq = 1./np.cos(theta)
-
     # y = m*x + b
     m = tanq*dydx
     b = -xmin*m - distance*dy*secq + ymin
+    return (m, b)
 
-    # find the plastic region (lies below `y = m*(x - ELASTIC_OFFSET) + b` line)
-    plastic = (y < (m*(x - ELASTIC_OFFSET) + b))
-    for i in reversed(range(plastic.size)):
-        if not plastic[i]:
-            plastic[:i] = False
-            break
 
-    # find the compliance region, if it exists
-    compliance = np.zeros_like(plastic, dtype=bool)
-    #compliance = (strain < -b/m)
+def _decimation_weights(mask):
+    """
+    Number of points of a decimated curve that each kept point stands
+    for: those nearer to it, by index, than to any other kept point.
 
-    # a first approximation to the elastic region is the region
-    # that is not compliance and not plastic.
-    mask = ((~compliance) & (~plastic))
-    return {
-        'elastic modulus': m,
-        'elastic onset': -b/m,
-        'elastic strain': x[mask],
-        'elastic stress': y[mask],
-        'resampled': resampled,
-        'hough': hough
-    }
+    Input
+    =====
+    :mask, array-like of bool: points kept by decimation (see
+        `tools.decimate`).
+
+    Output
+    ======
+    float array, the shape of `mask`: the count of each kept point, and
+    zero for the removed points.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    kept = np.flatnonzero(mask)
+    bounds = np.concatenate(([0], (kept[:-1] + kept[1:] + 1)//2, [mask.size]))
+    weights = np.zeros(mask.size)
+    weights[kept] = np.diff(bounds)
+    return weights
+
+
+def _region_of_interest(strain, stress, roi):
+    """
+    Selects the points of a stress-strain curve that lie in a region of
+    interest (see the `roi` option of
+    `approximate_elastic_regime_from_hough`).
+
+    Input
+    =====
+    :strain, array-like: strain data
+    :stress, array-like: stress data
+    :roi, str, float, (int, int) or None: region of interest.
+
+    Output
+    ======
+    Slice or boolean mask that selects the points in the region.
+    """
+    if roi is None:
+        return slice(None)
+    if isinstance(roi, str):
+        if roi != 'ultimate':
+            msg = 'Unrecognized region of interest: "{}".'.format(roi)
+            raise ValueError(msg)
+        return slice(0, int(np.argmax(np.asarray(stress))) + 1)
+    if np.ndim(roi) == 0:
+        fraction = float(roi)
+        if not 0 < fraction <= 1:
+            msg = 'The region of interest must be a fraction in (0, 1].'
+            raise ValueError(msg)
+        strain = np.asarray(strain)
+        lower = strain.min()
+        return strain <= lower + fraction*(strain.max() - lower)
+    first, last = roi
+    if last - first < 2:
+        msg = 'The region of interest must hold at least two points.'
+        raise ValueError(msg)
+    return slice(int(first), int(last))
+
+
+def refined_hough(xdata, ydata, lower, upper, factor, **kwds):
+    """
+    Coarse-to-fine (pyramid) construction of the Hough space.
+
+    A coarse Hough space, `factor` times smaller than the requested
+    `nq` x `nr` grid along each axis, is built over the theta band
+    between `lower` and `upper`. Its smoothed peak locates the
+    candidate line, and only a window around that line is then built
+    at full resolution.
+
+    Input
+    =====
+    :xdata, array-like: x data (typically normalized strain)
+    :ydata, array-like: y data (typically normalized stress)
+    :lower, float: lower angle of the search band (in degrees).
+    :upper, float: upper angle of the search band (in degrees).
+    :factor, int: coarsening factor of the first pass.
+
+    Options
+    =======
+    :halfwidth, int: half-width, in full resolution divisions, of the
+        window that is refined. Default: 2*factor plus the reach, along
+        each axis, of the smoothing applied in
+        `approximate_elastic_regime_from_hough`.
+    All other keywords are passed through to HoughSpace.
+
+    Output
+    ======
+    HoughSpace windowed (see `HoughSpace.rows`/`columns`) around the peak.
+    """
+    factor = int(factor)
+    nq = int(kwds.get('nq', 1801))
+    nr = int(kwds.get('nr', 1801))
+    # three gaussian passes of sigma are equivalent to a single pass of
+    # sigma*sqrt(3); on the coarse grid, sigma shrinks by `factor`.
+    full = _smoothing_sigma(nq, nr)
+    sigma = np.maximum(1., np.sqrt(3)*full/factor)
+    reach = _smoothing_reach(full)
+    # coarse pass
+    coarse_kwds = dict(kwds)
+    coarse_kwds.pop('rows', None)
+    coarse_kwds.pop('columns', None)
+    coarse_kwds.update(
+        nq=(nq - 1)//factor + 1,
+        nr=(nr - 1)//factor + 1,
+        band=(lower, upper),
+        margin=int(_smoothing_reach(sigma, 1)[0]))
+    coarse = HoughSpace(xdata, ydata, **coarse_kwds)
+    pool = kwds.get('pool', None)
+    smoothed = acquire(pool, coarse.shape, float)
+    gaussian_filter(coarse.view(np.ndarray), sigma, output=smoothed)
+    qlo = max(0, int(lower/180*coarse.nq) - coarse.qoffset)
+    qhi = min(coarse.shape[0], int(upper/180*coarse.nq) - coarse.qoffset)
+    sub = smoothed[qlo:qhi]
+    iq, ir = np.unravel_index(np.argmax(sub), sub.shape)
+    theta, distance = coarse.theta_distance(iq + qlo, ir)
+    # full resolution window around the coarse peak
+    rlo, rhi = coarse.radius
+    iq = int(round(theta/np.pi*(nq - 2)))
+    ir = int((distance - rlo)/(rhi - rlo)*(nr - 1))
+    if 'halfwidth' in kwds:
+        qwidth = rwidth = int(kwds['halfwidth'])
+    else:
+        qwidth, rwidth = 2*factor + reach
+    if pool is not None:
+        pool.release(smoothed)
+        pool.release(coarse)
+    fine_kwds = dict(kwds)
+    fine_kwds.update(
+        rows=(iq - qwidth, iq + qwidth + 1),
+        columns=(ir - rwidth, ir + rwidth + 1))
+    return HoughSpace(xdata, ydata, **fine_kwds)
 
 
 def interactive_approximator(mechprop, **kwds) :
@@ -411,6 +863,12 @@ def interactive_approximator(mechprop, **kwds) :
         mask = np.isclose(stress - m*strain, b, rtol=kwds['rtol'])
     else:
         mask = ((strain >= xlo) & (strain <= xhi))
+    weights = None
+    decimated = getattr(mechprop, 'decimated', None)
+    if decimated is not None:
+        # only the points kept by decimation are fit
+        weights = _decimation_weights(decimated[mask])[decimated[mask]]
+        mask &= decimated
     # a.x = b
     a = np.stack((np.where(mask)[0].astype(float), strain[mask]), axis=-1)
     b = stress[mask]
@@ -420,6 +878,7 @@ def interactive_approximator(mechprop, **kwds) :
         'elastic onset': -b/m,
         'elastic strain': strain[mask],
         'elastic stress': stress[mask],
+        'elastic weights': weights,
         'resampled': np.array([[]]),
         'hough': np.array([[]])
     }
@@ -440,15 +899,35 @@ def set_elastic(mechprop, **kwds):
     :approximator, f(strain, stress): Function to approximate the
         "elastic onset" and "elastic modulus", returned as keys in
         a dictionary.
+    :refine, bool: If True, the elastic region is refined by outlier
+        rejection: points whose residual strain exceeds `error` are
+        dropped from the ends of the region, and the fit and the
+        removal of outliers (see `tools.remove_outliers`) are then
+        repeated until the mask is stable, or for `maxiter`
+        iterations. Default: False.
     :maxiter, int: maximum number of iterations. Default: 20.
+    :search, str: how the elastic region is chosen. One of None (the
+        region returned by the approximator is fit) or "window" (the
+        window of consecutive points with the best fit, see
+        `elastic_window_search`; `bounds`, `minpoints`, `maxpoints` and
+        `stride` are passed through). The approximator is not run by the window
+        search, so `hough` and `resampled` are then empty. Default: None.
     :covariance, bool: optimize on covariance. Default.
     :rsquared, bool: optimize on $R^2$. Supercedes covariance.
     :error, float: strain gage measurement error. Default: 0.00005.
+    All other keywords are passed through to the approximator.
+
+    Of a decimated curve (see `MechanicalProperties`), only the points
+    kept by decimation are searched and fit, each weighted by the
+    number of points it stands for (the `elastic weights` returned by
+    the approximator), so that the fit matches that of the full curve.
 
     Output
     ======
     Returns best performance metrics. Modulus and offset stored in
-    `mechprop`.
+    `mechprop`. The (boolean) mask of the points of the elastic region
+    that were fit is returned as `mask` and the number of refinement iterations
+    as `iterations`.
     """
     # ########################
     # handle keyword arguments
@@ -458,29 +937,51 @@ def set_elastic(mechprop, **kwds):
     else:
         approximator = approximate_elastic_regime_from_hough
 
-    # # maximum number of iterations
-    # maxiter = kwds.get('maxiter', 20)
-    #
-    # # set the target optimization (This is a minimization.)
-    # if 'rsq' in kwds:
-    #     target = lambda cov, rsq : 1. - rsq
-    # else:
-    #     # by default, optimize on the covariance
-    #     target = lambda cov, rsq : cov
-    #
-    # # error in the strain gage measurement
-    # # error = np.abs(kwds.get('error', 0.00005))
-    # error = np.abs(kwds.get('error', 0.00005))
+    search = kwds.get('search', None)
+    if search not in (None, 'window'):
+        msg = '"search" must be one of None or "window".'
+        raise ValueError(msg)
 
     # ########################
-    # strain = mechprop.strain
-    # stress = mechprop.stress
-    approx = approximator(mechprop)
+    if search == 'window':
+        # the best window costs a single pass over the curve (see
+        # `elastic_window_search`) rather than a refit per candidate,
+        # and replaces the approximator, which is not run.
+        strain = np.asarray(mechprop.strain)
+        stress = np.asarray(mechprop.stress)
+        weights = None
+        decimated = getattr(mechprop, 'decimated', None)
+        if decimated is not None:
+            strain, stress = strain[decimated], stress[decimated]
+            weights = _decimation_weights(decimated)[decimated]
+        window = elastic_window_search(strain, stress, **kwds)
+        start, end = window['window']
+        approx = {
+            'elastic strain': strain[start:end],
+            'elastic stress': stress[start:end],
+            'elastic weights': None if weights is None else \
+                               weights[start:end],
+            'resampled': np.array([[]]),
+            'hough': np.array([[]])
+        }
+    else:
+        approx = approximator(mechprop, **kwds)
     epsilon = approx['elastic strain']
     sigma = approx['elastic stress']
+    weights = approx.get('elastic weights', None)
 
     # ########################
-    regression = calculate_modulus(epsilon, sigma)
+    mask = np.ones_like(epsilon, dtype=bool)
+    iterations = 0
+    if kwds.get('refine', False):
+        mask, iterations = _refine_elastic_mask(
+            epsilon, sigma,
+            error=np.abs(kwds.get('error', 0.00005)),
+            maxiter=int(kwds.get('maxiter', 20)),
+            weights=weights)
+    regression = calculate_modulus(
+        epsilon[mask], sigma[mask],
+        weights=None if weights is None else np.asarray(weights)[mask])
 
     modulus = regression['modulus']
     intercept = -regression['elastic onset']*modulus
@@ -503,98 +1004,83 @@ def set_elastic(mechprop, **kwds):
         'residual strain': epsilon - sigma/modulus,
         'elastic strain': epsilon,
         'elastic stress': sigma,
-        'mask': np.ones_like(epsilon),
+        'mask': mask,
+        'iterations': iterations,
         'hough': approx['hough'],
         'resampled': approx['resampled']
     }
 
-    # # ########################
-    # # sigma = E epsilon + offset
-    # # epsilon = e_calc = (sigma - offset)/E
-    # # s.t.
-    # # residual strain = e_measured - e_calc
-    # predicted_strain = lambda s, E, b: (s - b)/E
-    # residual_strain = lambda e, s, E, b: e - predicted_strain(s, E, b)
-    #
-    # # ########################
-    # # use residual strain to minimize RMS residual strain
-    # residual = residual_strain(epsilon, sigma, modulus, intercept)
-    # # residual = residual_strain(epsilon-approx['elastic onset'], sigma, modulus)
-    # # DEBUGGING #
-    # # import sys
-    # # from matplotlib import pyplot as plt
-    # # plt.plot(residual, sigma)
-    # # plt.show(block=True)
-    # # sys.exit(1)
-    # # END DEBUGGING #
-    # mask = (np.abs(residual) < error)
-    # # lower bound (end of compliance region)
-    # for i in range(len(mask)):
-    #     if mask[i]:
-    #         lower = i
-    #         break
-    # # upper bound (end of linear elastic region)
-    # for i in reversed(range(len(mask))):
-    #     if mask[i]:
-    #         upper = i
-    #         break
-    # mask[lower:upper] = True
-    #
-    # # ########################
-    # # exclude outliers (to help with noisy data) using IQR
-    # # this should remove both outliers and the compliance region
-    # # print "Iteration:",
-    # # i = 0
-    # for _ in range(len(epsilon)):
-    #     # i += 1
-    #     # print i,
-    #     previous = mask.copy()
-    #     modulus, intercept, corrcoeff, pvalue, SE_slope = \
-    #         linregress(epsilon[mask], sigma[mask])
-    #     residual = residual_strain(epsilon, sigma, modulus, intercept)
-    #     mask[mask] = remove_outliers(residual[mask])
-    #     # print "({} changed),".format(np.sum(np.logical_xor(mask, previous))),
-    #     if np.all(previous == mask):
-    #         # print ""
-    #         break
-    # print("Number points used in fit: {}/{}".format(np.sum(mask), len(mask)))
-    #
-    # # DEBUGGING #
-    # from matplotlib import pyplot as plt
-    # fig, ax = plt.subplots(1, 1)
-    # colors = [('darkgreen' if b else 'darkblue') for b in mask]
-    # ax.scatter(residual, sigma, c=colors)
-    # ax.axvline(-error, ls='--', color='r')
-    # ax.axvline(error, ls='--', color='r')
-    # plt.show()
-    # # # END DEBUGGING #
-    #
-    # # ########################
-    # # save the best
-    # best = {
-    #     'param': [intercept, modulus],
-    #     'SE modulus': SE_slope,
-    #     'cov': covariance(epsilon[mask], predicted_strain(sigma[mask], modulus, intercept)),
-    #     'rsq': r_squared(epsilon[mask], predicted_strain(sigma[mask], modulus, intercept)),
-    #     'residual strain': residual,
-    #     'elastic strain': epsilon,
-    #     'elastic stress': sigma,
-    #     'mask': mask,
-    #     'hough': approx['hough'],
-    #     'resampled': approx['resampled']
-    # }
-    #
-    # # ########################
-    # # update the modulus of the mechanical properties
-    # intercept, modulus = best['param']
-    # mechprop.elastic_modulus = modulus
-    # mechprop.elastic_onset = -intercept / modulus
-    #
-    # # done -- no iteration
-    # return best
-
-
-def calculate_modulus(strain, stress):
+
+def _refine_elastic_mask(epsilon, sigma, **kwds):
+    """
+    Iterative outlier rejection on the residual strain of a linear fit
+    (see the `refine` option of `set_elastic`).
+
+    The fit is kept as the sums of $x$, $y$, $x^2$, $y^2$ and $xy$ over
+    the points in the mask. Outlier removal only ever drops points, so
+    each iteration downdates these sums by the contributions of the
+    dropped points, rather than refitting every remaining point.
+
+    Input
+    =====
+    :epsilon, array-like: strain data of the elastic region
+    :sigma, array-like: stress data of the elastic region
+
+    Options
+    =======
+    :error, float: strain gage measurement error. Default: 0.00005.
+    :maxiter, int: maximum number of iterations. Default: 20.
+    :weights, array-like: weight of each point in the fit.
+        Default: None (equal weights).
+
+    Output
+    ======
+    Tuple of the (boolean) mask of the points kept, and the number of
+    iterations.
+    """
+    error = kwds.get('error', 0.00005)
+    maxiter = kwds.get('maxiter', 20)
+    x = np.asarray(epsilon, dtype=float)
+    y = np.asarray(sigma, dtype=float)
+    # sums about the means keep the downdates well conditioned
+    x0, y0 = x.mean(), y.mean()
+    xs, ys = x - x0, y - y0
+    terms = np.stack((np.ones_like(xs), xs, ys, xs*xs, ys*ys, xs*ys))
+    weights = kwds.get('weights', None)
+    if weights is not None:
+        terms *= np.asarray(weights, dtype=float)
+
+    def residual_strain(sums):
+        fit = _regression(*_moments_from_sums(*sums))
+        # residual strain = measured - (sigma - offset)/E
+        return xs - fit['elastic onset'] - ys/fit['modulus']
+
+    # initial fit to all points
+    sums = terms.sum(axis=1)
+    residual = residual_strain(sums)
+    mask = (np.abs(residual) < error)
+    if mask.any():
+        # the region runs from the first to the last point that lies
+        # within the measurement error of the line
+        within = np.flatnonzero(mask)
+        mask[within[0]:within[-1] + 1] = True
+    else:
+        mask[:] = True
+    sums = terms[:, mask].sum(axis=1)
+    iterations = 0
+    for iterations in range(1, maxiter + 1):
+        residual = residual_strain(sums)
+        previous = mask.copy()
+        mask[mask] = remove_outliers(residual[mask])
+        dropped = previous & ~mask
+        if not dropped.any():
+            break
+        # rank-1 downdate for each dropped point
+        sums -= terms[:, dropped].sum(axis=1)
+    return (mask, iterations)
+
+
+def calculate_modulus(strain, stress, **kwds):
     """
     Calculates the modulus based on the ASTM E111.
 
@@ -627,29 +1113,114 @@ def calculate_modulus(strain, stress):
 
     :math:`t` is the t-statistic from standard tables at N-2 degrees of freedom.
 
+    All the sums are derived from the count, the means and the centered
+    second moments of the data, which are accumulated in a single,
+    numerically stable pass (see `_centered_moments`). Of weighted
+    data, e.g. a decimated curve, :math:`N` is the sum of the weights
+    and every sum is weighted.
+
     :param strain:
     :param stress:
+    :param weights: (optional) weight of each observation.
+        Default: None (equal weights).
     :return:
     """
     x, y = np.asarray(strain), np.asarray(stress)
     assert x.shape == y.shape, \
         "The number of stress and strain observations must match."
-    N = len(x)
-    xbar, ybar = x.mean(), y.mean()
+    return _regression(*_centered_moments(
+        x, y, weights=kwds.get('weights', None)))
+
+
+def calculate_moduli(strain, stress, **kwds):
+    """
+    Calculates the ASTM E111 modulus (see `calculate_modulus`) of many
+    data sets, e.g. the elastic regions of many specimens, at once.
 
-    a = np.stack((np.ones_like(strain).astype(float), strain), axis=-1)
-    b = stress
-    ((b, m), residuals, rank, SV) = np.linalg.lstsq(a, b, rcond=None)
+    The data sets are given either as the rows of 2-D arrays, optionally
+    masked, or as ragged arrays: the data sets concatenated, plus the
+    `offsets` at which each starts. All data sets are reduced together
+    by segment reductions (`numpy.add.reduceat`), not one at a time.
 
-    modulus = ((x*y).sum() - N*xbar*ybar) / \
-              ((x**2).sum() - N*xbar**2)
-    rsq = ((x*y).sum() - (xbar*ybar)/N) / \
-          (((x**2).sum() - xbar**2/N)*(y**2).sum() - ybar**2/N)
+    Input
+    =====
+    :strain, array-like: 2-D (one data set per row) or 1-D (ragged)
+        strain data.
+    :stress, array-like: stress data, of the same shape as `strain`.
+
+    Options
+    =======
+    :mask, 2-D array-like of bool: points of each row that are used.
+        Default: all points.
+    :offsets, 1-D array-like of int: for ragged data, the index of the
+        first point of each data set, followed by the total number of
+        points, i.e. data set `i` is `[offsets[i], offsets[i+1])`.
+        Required for 1-D data.
 
-    cov = 100*np.sqrt((1/rsq - 1)/(N - 2))
+    Output
+    ======
+    Dictionary of arrays, one value per data set, with the keys of
+    `calculate_modulus`. Data sets with too few points to fit hold
+    NaN (or infinity).
+    """
+    x = np.asarray(strain, dtype=float)
+    y = np.asarray(stress, dtype=float)
+    assert x.shape == y.shape, \
+        "The number of stress and strain observations must match."
+    if x.ndim == 2:
+        mask = np.asarray(kwds.get('mask', np.ones(x.shape, dtype=bool)),
+                          dtype=bool)
+        counts = mask.sum(axis=1)
+        x, y = x[mask], y[mask]
+    elif 'offsets' in kwds:
+        offsets = np.asarray(kwds['offsets'], dtype=int)
+        if offsets[0] != 0 or offsets[-1] != x.size or \
+                np.any(np.diff(offsets) < 0):
+            msg = 'Offsets must increase from 0 to the number of points.'
+            raise ValueError(msg)
+        counts = np.diff(offsets)
+    else:
+        msg = 'Ragged (1-D) data require "offsets".'
+        raise ValueError(msg)
+    N = counts.astype(float)
+    #+ `reduceat` would return the value at the start of an empty data
+    #+ set, so only the nonempty data sets are reduced.
+    full = (counts > 0)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[full]
+
+    def reduce(values):
+        out = np.zeros(counts.size)
+        if starts.size:
+            out[full] = np.add.reduceat(values, starts)
+        return out
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xbar = reduce(x)/N
+        ybar = reduce(y)/N
+        dx = x - np.repeat(xbar, counts)
+        dy = y - np.repeat(ybar, counts)
+        return _regression(N, xbar, ybar,
+                           reduce(dx*dx), reduce(dy*dy), reduce(dx*dy))
+
+
+def _regression(N, xbar, ybar, ssx, ssy, spxy):
+    """
+    ASTM E111 regression (see `calculate_modulus`) from the count, the
+    means and the centered second moments of the data (see
+    `_centered_moments`). Vectorized over any number of data sets.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        modulus = spxy/ssx
+        # least squares intercept
+        b = ybar - modulus*xbar
+        # the ASTM E111 sums about the origin, e.g.
+        # sum XY - sum X sum Y/N, are the centered moments
+        rsq = spxy*spxy/(ssx*ssy)
 
-    ses = np.sqrt((((y - ybar)**2).sum()) / \
-                  (((x - xbar)**2).sum()*(N-2)))
+        cov = 100*np.sqrt((1/rsq - 1)/(N - 2))
+
+        # residual sum of squares, ssy (1 - r^2), over (N-2) ssx
+        ses = np.sqrt((ssy - modulus*spxy)/((N - 2)*ssx))
 
     return {
         'modulus': modulus,
@@ -657,4 +1228,200 @@ def calculate_modulus(strain, stress):
         'coefficient of determination': rsq,
         'coefficient of variation': cov,
         'standard error in the slope': ses
-    }
\ No newline at end of file
+    }
+
+
+def _centered_moments(x, y, chunksize=65536, weights=None):
+    """
+    Count, means and centered second moments of (x, y) data in a single
+    pass.
+
+    The data are taken in chunks of `chunksize` points, small enough to
+    stay in cache while each is reduced. The moments of each chunk are
+    taken about its own mean and merged into the running totals with
+    the pairwise update of Chan et al., so that no sum of squares is
+    formed about a distant origin.
+
+    Input
+    =====
+    :x, array-like: x data
+    :y, array-like: y data
+
+    Options
+    =======
+    :chunksize, int: number of points per chunk. Default: 65536.
+    :weights, array-like: weight of each point. Default: None (equal
+        weights).
+
+    Output
+    ======
+    Tuple `(n, xbar, ybar, ssx, ssy, spxy)`: the number of points (the
+    sum of the weights), the means, the sums of squared deviations from
+    the mean of x and of y, and the sum of the products of the
+    deviations.
+    """
+    x = np.asarray(x, dtype=float).ravel()
+    y = np.asarray(y, dtype=float).ravel()
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float).ravel()
+    n = 0
+    xbar, ybar, ssx, ssy, spxy = np.zeros(5)
+    for start in range(0, x.size, chunksize):
+        xc = x[start:start + chunksize]
+        yc = y[start:start + chunksize]
+        if weights is None:
+            m = xc.size
+            xm, ym = xc.mean(), yc.mean()
+            dx, dy = xc - xm, yc - ym
+            wx, wy = dx, dy
+        else:
+            wc = weights[start:start + chunksize]
+            m = wc.sum()
+            xm, ym = np.dot(wc, xc)/m, np.dot(wc, yc)/m
+            dx, dy = xc - xm, yc - ym
+            wx, wy = wc*dx, wc*dy
+        total = n + m
+        deltax, deltay = xm - xbar, ym - ybar
+        weight = n*m/total
+        ssx += np.dot(wx, dx) + deltax*deltax*weight
+        ssy += np.dot(wy, dy) + deltay*deltay*weight
+        spxy += np.dot(wx, dy) + deltax*deltay*weight
+        xbar += deltax*m/total
+        ybar += deltay*m/total
+        n = total
+    return (n, xbar, ybar, ssx, ssy, spxy)
+
+
+def _moments_from_sums(n, sx, sy, sxx, syy, sxy):
+    """
+    Converts the sums of (x, y) data to the count, the means and the
+    centered second moments taken by `_regression`, vectorized over any
+    number of data sets.
+
+    Input
+    =====
+    :n, array-like: number of points.
+    :sx, sy, array-like: sums of x and of y.
+    :sxx, syy, sxy, array-like: sums of the squares and of the product
+        of x and y.
+
+    Output
+    ======
+    Tuple `(n, xbar, ybar, ssx, ssy, spxy)` (see `_centered_moments`).
+    The sums should be taken about (close to) the mean of the data to
+    avoid cancellation.
+    """
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xbar, ybar = sx/n, sy/n
+        return (n, xbar, ybar,
+                sxx - sx*xbar, syy - sy*ybar, sxy - sx*ybar)
+
+
+def elastic_window_search(strain, stress, **kwds):
+    """
+    Finds the window, [start, end), of consecutive points of a
+    stress-strain curve whose ASTM E111 linear fit is best, i.e. has the
+    lowest coefficient of variation of the slope (or highest $R^2$).
+
+    Cumulative sums of $x$, $y$, $x^2$, $y^2$ and $xy$ are computed once,
+    after which the fit of any window costs O(1). A coarse pass scores
+    the windows whose ends lie on a grid of `stride` points; a fine pass
+    then scores every window whose ends lie within `stride` points of
+    the best coarse window. With the default stride, about `n` windows
+    are scored in each pass.
+
+    This is a coarse-to-fine heuristic, not an exhaustive search: the
+    fine pass only refines the best coarse window, so a better window
+    that scores poorly on the coarse grid may be missed. Nor is the
+    best fit always the elastic region. The coefficient of variation
+    falls with the length of a window, so a long, straight stretch of
+    linear hardening can fit better than a short elastic line; windows
+    are therefore no longer than `maxpoints`, which compares windows of
+    similar length, where the steeper, elastic, line fits best.
+
+    Input
+    =====
+    :strain, array-like: strain data
+    :stress, array-like: stress data
+
+    Options
+    =======
+    :bounds, (int, int): range of points, [first, last), searched.
+        Default: the points up to the ultimate stress.
+    :minpoints, int: smallest number of points in a window.
+        Default: 2% of the points searched (at least 5).
+    :maxpoints, int: largest number of points in a window.
+        Default: a quarter of the points searched (at least
+        `minpoints`).
+    :stride, int: spacing of the coarse grid of window ends.
+        Default: the square root of the number of points searched.
+    :rsquared, bool: If True, maximize $R^2$ rather than minimize the
+        coefficient of variation. Default: False.
+
+    Output
+    ======
+    Dictionary of the best window:
+        {
+            'window'                       : (start, end),
+            'modulus'                      : slope,
+            'elastic onset'                : strain intercept,
+            'coefficient of determination' : R^2,
+            'coefficient of variation'     : V_1,
+            'standard error in the slope'  : SE }
+    The statistics are those of `calculate_modulus` for the window.
+    """
+    x = np.asarray(strain, dtype=float)
+    y = np.asarray(stress, dtype=float)
+    first, last = kwds.get('bounds', (0, int(np.argmax(y)) + 1))
+    first, last = max(0, int(first)), min(x.size, int(last))
+    npoints = last - first
+    minpoints = max(3, int(kwds.get('minpoints', max(5, npoints//50))))
+    if npoints < minpoints:
+        msg = 'The elastic window search needs at least {} points.'.format(
+            minpoints)
+        raise ValueError(msg)
+    maxpoints = max(minpoints, int(kwds.get('maxpoints', npoints//4)))
+    stride = max(1, int(kwds.get('stride', np.sqrt(npoints))))
+    rsquared = kwds.get('rsquared', False)
+    # moments about the mean of the search range, which keeps the
+    # differences of the cumulative sums well conditioned
+    x0, y0 = x[first:last].mean(), y[first:last].mean()
+    xs, ys = x[first:last] - x0, y[first:last] - y0
+    sums = np.zeros((5, npoints + 1))
+    for row, values in enumerate((xs, ys, xs*xs, ys*ys, xs*ys)):
+        np.cumsum(values, out=sums[row, 1:])
+
+    def score(start, end):
+        #+ all windows (start[i], end[j]) of minpoints to maxpoints points
+        start, end = np.meshgrid(start, end, indexing='ij')
+        keep = (end - start >= minpoints) & (end - start <= maxpoints)
+        start, end = start[keep], end[keep]
+        n, xbar, ybar, ssx, ssy, spxy = _moments_from_sums(
+            end - start, *(sums[:, end] - sums[:, start]))
+        # means in the original (unshifted) coordinates
+        stats = _regression(n, x0 + xbar, y0 + ybar, ssx, ssy, spxy)
+        target = -stats['coefficient of determination'] if rsquared \
+            else stats['coefficient of variation']
+        # degenerate windows: too few points, or no spread in strain or
+        # stress
+        target = np.where((n > 2) & (ssx > 0) & (ssy > 0) &
+                          np.isfinite(target), target, np.inf)
+        best = np.argmin(target) if target.size else None
+        return (start, end, stats, best)
+
+    # coarse pass over a grid of window ends
+    grid = np.unique(np.append(np.arange(0, npoints + 1, stride), npoints))
+    start, end, stats, best = score(grid, grid)
+    if best is not None:
+        # fine pass around the best coarse window
+        lo, hi = start[best], end[best]
+        start, end, stats, best = score(
+            np.arange(max(0, lo - stride), min(npoints, lo + stride) + 1),
+            np.arange(max(0, hi - stride), min(npoints, hi + stride) + 1))
+    if best is None:
+        start, end, stats, best = score(np.array([0]),
+                                        np.array([min(npoints, maxpoints)]))
+    result = {'window': (first + int(start[best]), first + int(end[best]))}
+    result.update((key, float(value[best])) for key, value in stats.items())
+    return result
@@ -1,7 +1,15 @@
 from .linear_merge import linear_merge
+from .decimate import decimate
 from .normalized import Normalized
 from .resample import resample
-from .hough import HoughSpace
+from .hough import (
+    HoughSpace,
+    SparseHoughSpace,
+    accumulator_dtype,
+    density_weights,
+    grid_size)
 from .outliers import remove_outliers
+from .peaks import smooth, local_maxima, interpolate_peak
+from .pool import BufferPool
 from .replace_if_present_else_append import replace_if_present_else_append
 from .statistics import r_squared, covariance
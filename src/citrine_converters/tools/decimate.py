@@ -0,0 +1,96 @@
+from __future__ import division
+
+import numpy as np
+
+
+def decimate(xdata, ydata, tolerance, **kwds):
+    """
+    Decimates an oversampled curve while preserving its shape
+    (Ramer-Douglas-Peucker).
+
+    A run of points is replaced by the chord between its end points
+    if no point of the run deviates from that chord by more than the
+    tolerance. Otherwise the run is split at the point of largest
+    deviation and each half is decimated in turn. Linear segments of
+    the curve, e.g. the elastic region, therefore shrink to a handful of
+    points, while every feature larger than the tolerance is kept.
+
+    Deviations are measured in units of the tolerance along each axis,
+    i.e. a point is kept if it lies outside the ellipse of semi-axes
+    `tolerance` about the chord.
+
+    Input
+    =====
+    :xdata, array-like: x data, e.g. strain, ordered along the curve.
+    :ydata, array-like: y data, e.g. stress.
+    :tolerance, float or (float, float): largest deviation, along x
+        and y, of a point that can be removed. A single value applies
+        to x, and the y tolerance is the same fraction of the range of
+        y, e.g. the strain-gauge error.
+
+    Options
+    =======
+    :minpoints, int: runs with fewer points than this are never split,
+        i.e. at least one point in `minpoints` - 1 is kept. Default: 0
+        (no limit).
+    :max_gap, float: largest span of x between kept points. Longer runs
+        are split in half, even if they are straight, so that linear
+        segments, e.g. the elastic region, keep enough points to vote
+        for, and be fit by, their line. Default: 1/1000 of the range of
+        x. None or 0 for no limit.
+
+    Output
+    ======
+    Boolean mask of the points that are kept. The first and last points
+    are always kept.
+    """
+    x = np.asarray(xdata, dtype=float)
+    y = np.asarray(ydata, dtype=float)
+    npoints = x.size
+    keep = np.zeros(npoints, dtype=bool)
+    if npoints < 3:
+        keep[:] = True
+        return keep
+    xspan = np.ptp(x)
+    if np.ndim(tolerance) == 0:
+        xtol = float(tolerance)
+        ytol = xtol*np.ptp(y)/xspan if xspan > 0 else xtol
+    else:
+        xtol, ytol = tolerance
+    if xtol <= 0 or ytol <= 0:
+        msg = 'The decimation tolerance must be positive.'
+        raise ValueError(msg)
+    minpoints = int(kwds.get('minpoints', 0))
+    max_gap = kwds.get('max_gap', xspan/1000)
+    max_gap = float(max_gap)/xtol if max_gap else np.inf
+    # measure in units of the tolerance
+    x = x/xtol
+    y = y/ytol
+    keep[0] = keep[-1] = True
+    #+ runs, [first, last], still to be decimated
+    stack = [(0, npoints - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        xs = x[first + 1:last] - x[first]
+        ys = y[first + 1:last] - y[first]
+        chord = np.hypot(dx, dy)
+        if chord > 0:
+            deviation = np.abs(dx*ys - dy*xs)/chord
+        else:
+            deviation = np.hypot(xs, ys)
+        i = int(np.argmax(deviation))
+        if deviation[i] <= 1:
+            if abs(dx) > max_gap:
+                # straight, but too long: split in half
+                i = (last - first)//2 - 1
+            elif not (minpoints > 0 and last - first >= minpoints):
+                continue
+        i += first + 1
+        keep[i] = True
+        stack.append((first, i))
+        stack.append((i, last))
+    return keep
@@ -1,6 +1,160 @@
 from __future__ import division
 
+import os
+import json
+import hashlib
 import numpy as np
+from functools import lru_cache
+from .normalized import Normalized
+from .pool import acquire
+from .peaks import smooth, local_maxima, interpolate_peak
+
+
+def accumulator_dtype(count, dtype=None):
+    """
+    Chooses the data type of an accumulator that must hold counts
+    as large as `count` without overflow.
+
+    Input
+    =====
+    :count, int: largest count the accumulator must hold, e.g. the
+        number of points voting in a Hough space.
+
+    Options
+    =======
+    :dtype, numpy.dtype: requested data type. If this type cannot
+        hold `count` exactly, it is promoted to one that can (uint16
+        -> uint32 -> uint64, float32 -> float64). Default: the
+        smallest unsigned integer type that holds `count`.
+
+    Output
+    ======
+    numpy.dtype
+    """
+    count = int(count)
+    if dtype is None or dtype == 'auto':
+        dtype = np.uint16
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        # floats count exactly up to 2**(mantissa bits + 1)
+        while dtype != np.float64 and count > 2**(np.finfo(dtype).nmant + 1):
+            dtype = np.dtype(np.float64)
+        return dtype
+    if dtype.kind not in 'ui':
+        msg = 'Accumulators must be integer or floating point types.'
+        raise ValueError(msg)
+    for promoted in (dtype, np.uint16, np.uint32, np.uint64):
+        promoted = np.dtype(promoted)
+        if promoted.itemsize >= dtype.itemsize and \
+                count <= np.iinfo(promoted).max:
+            return promoted
+    msg = 'No integer accumulator can hold {} counts.'.format(count)
+    raise OverflowError(msg)
+
+
+def density_weights(xdata, ydata):
+    """
+    Weighs each point of an ordered curve by the length of curve it
+    stands for: half the distance to each of its neighbors. Used as
+    Hough weights, every stretch of the curve then votes in proportion
+    to its length, not to the number of points sampled along it.
+
+    Input
+    =====
+    :xdata, array-like: x data, ordered along the curve, in the
+        coordinates of the Hough space (e.g. `Normalized`).
+    :ydata, array-like: y data.
+
+    Output
+    ======
+    float array of weights, scaled so that their mean is 1, i.e. the
+    total number of votes is unchanged.
+    """
+    x = np.asarray(xdata, dtype=float).ravel()
+    y = np.asarray(ydata, dtype=float).ravel()
+    weights = np.zeros(x.size)
+    step = np.hypot(np.diff(x), np.diff(y))/2
+    weights[:-1] += step
+    weights[1:] += step
+    mean = weights.mean() if weights.size else 0.
+    if mean > 0:
+        weights /= mean
+    else:
+        weights[:] = 1
+    return weights
+
+
+def grid_size(npoints, **kwds):
+    """
+    Chooses the number of theta and radial divisions of a Hough space
+    (the "auto" sizing policy of `HoughSpace`).
+
+    - The theta divisions are set by the angular precision, about
+      `180/precision` rows over 180 degrees.
+    - The radial divisions follow the number of points, one division
+      per point, but no fewer than 181 (coarser grids cannot locate a
+      line) and no more than `nq` (finer than the angular resolution).
+    - If the accumulator, together with the temporaries of the batches
+      of votes that fill it, would exceed the memory budget, both are
+      reduced by the same factor until they fit. A batch holds one vote
+      per 16 stored cells, at about 32 bytes per vote (64 for linear or
+      weighted votes).
+
+    Input
+    =====
+    :npoints, int: number of points that will vote.
+
+    Options
+    =======
+    :precision, float: target angular precision, in degrees.
+        Default: 0.1 (1801 theta divisions).
+    :memory, float: memory budget, in MB, of the accumulator and of
+        the vote batches that fill it. Default: None (unlimited).
+    :dtype, numpy.dtype: requested accumulator type (see
+        `accumulator_dtype`). Default: None (smallest unsigned integer).
+    :voting, str: voting scheme (see `HoughSpace`). Linear voting
+        accumulates in floating point. Default: "nearest".
+    :weights, array-like or str: weights of the votes (see
+        `HoughSpace`). Weighted votes accumulate in floating point.
+        Default: None.
+    :band, (float, float): theta band (in degrees) that will be stored,
+        see `HoughSpace`. Only the stored rows count toward `memory`.
+        Default: None (all rows).
+    :margin, int: rows stored on either side of `band`. Default: 0.
+
+    Output
+    ======
+    (nq, nr) as ints.
+    """
+    precision = float(kwds.get('precision', 0.1))
+    memory = kwds.get('memory', None)
+    dtype = kwds.get('dtype', None)
+    weighted = kwds.get('voting', 'nearest') == 'linear' or \
+        kwds.get('weights', None) is not None
+    if weighted and dtype in (None, 'auto'):
+        dtype = np.float32
+    if precision <= 0:
+        msg = 'The angular precision must be positive.'
+        raise ValueError(msg)
+    nq = int(round(180/precision)) + 1
+    nr = int(min(nq, max(181, npoints)))
+    if memory is not None:
+        # number of cells that fit in the budget: each costs its count
+        # and a 16th of a vote of the batch (see `HoughSpace._options`)
+        cellbytes = accumulator_dtype(npoints, dtype).itemsize + \
+            (64 if weighted else 32)/16
+        budget = float(memory)*2**20/cellbytes
+        band = kwds.get('band', None)
+        fraction = 1. if band is None else min(1., (band[1] - band[0])/180)
+        margin = 2*int(kwds.get('margin', 0))
+        # shrink both axes by `scale`, where the stored cells,
+        # (fraction*nq*scale + margin)*nr*scale, just fit the budget
+        a, b = fraction*nq*nr, margin*nr
+        if a + b > budget:
+            scale = (-b + np.sqrt(b*b + 4*a*budget))/(2*a)
+            nq = max(3, int(nq*scale))
+            nr = max(3, int(nr*scale))
+    return (nq, nr)
 
 
 class HoughSpace(np.ndarray):
@@ -52,12 +206,156 @@ class HoughSpace(np.ndarray):
 
     Options
     =======
-    :nq, int (optional): number of theta divisions.
-        Default: 1801.
-    :nq, int (optional): number of radial divisions.
-        Default: 1801.
+    :nq, int or "auto" (optional): number of theta divisions. "auto"
+        chooses it from the number of points, `precision` and `memory`
+        (see `grid_size`). Default: 1801.
+    :nr, int or "auto" (optional): number of radial divisions (see
+        `nq`). Default: 1801.
+    :precision, float (optional): target angular precision, in degrees,
+        of an "auto" grid. Default: 0.1.
+    :memory, float (optional): memory budget, in MB, of the accumulator
+        of an "auto" grid and of the vote batches that fill it (see
+        `grid_size`). Unless `chunksize` is given, the batches are then
+        one vote per 16 stored cells, with no lower bound.
+        Default: None (unlimited).
+    :engine, str (optional): how the votes are accumulated. One of
+        "vectorized" (all votes computed in chunked batches and
+        accumulated with `np.bincount`) or "loop" (one point at a
+        time; kept as a reference implementation).
+        Default: "vectorized".
+    :chunksize, int (optional): number of votes computed together by
+        the vectorized engine, i.e. the size of its temporary arrays.
+        Default: one vote per 16 stored cells, so that the temporaries
+        (about 32 bytes per vote) are no larger than the accumulator,
+        but no fewer than 2**12 and no more than 2**18 votes.
+    :nprocs, int (optional): number of processes across which the points
+        are split by the vectorized engine. Each process accumulates a
+        partial Hough space in shared memory; the partials are summed.
+        Only whole builds (`construct`) are split: the votes of
+        streamed points (`add_points`, `remove_points`) and of the
+        batches of a `subsample` are cast in this process, since a new
+        pool of processes per call would cost more than it saves.
+        `None` uses every available core. Default: 1 (serial).
+    :band, (float, float) (optional): lower and upper angle (in
+        degrees) of the theta band that is to be allocated and filled.
+        Only the rows of the full `nq` x `nr` Hough space that fall
+        inside this band are kept; theta indices into the result are
+        offset by `qoffset` rows. Default: the full 0-180 degrees.
+    :dtype, numpy.dtype (optional): data type of the accumulator, e.g.
+        uint16, uint32 or float32. No cell can receive more votes than
+        there are points, so a type too narrow for the number of points
+        is promoted (see `accumulator_dtype`). Default: the smallest
+        unsigned integer type that can hold the number of points.
+    :margin, int (optional): number of additional theta rows kept on
+        either side of `band`, e.g. to leave room for a smoothing
+        kernel. Default: 0.
+    :rows, (int, int) (optional): window, [first, last), of theta rows
+        of the full Hough space to allocate and fill. Supercedes `band`.
+    :columns, (int, int) (optional): window, [first, last), of radial
+        columns of the full Hough space to allocate and fill. Votes
+        that fall outside this window are discarded. Radial indices
+        into the result are offset by `roffset` columns.
+        Default: all `nr` columns.
+    :voting, str (optional): how a vote is binned along the radial
+        axis. One of "nearest" (the whole vote goes to the division
+        that holds the distance) or "linear" (the vote is split
+        between the two nearest grid points in proportion to their
+        proximity, which preserves the sub-division position of a
+        line and allows far coarser grids for the same accuracy).
+        Linear voting requires a floating point `dtype`.
+        Default: "nearest".
+    :rmax, float (optional): upper bound of the radial range. The range
+        always reaches the most distant point; a larger `rmax` leaves
+        headroom for points added later (see `add_points`).
+        Default: the distance to the most distant point.
+    :subsample, bool (optional): If True, vote with a random subsample
+        of the points (probabilistic Hough transform): the points vote
+        in random order, in batches, until the (smoothed) peak of the
+        accumulator is stable. `x`, `y` then hold the points that
+        voted, `consumed` their number, and `rmax` the radial extent of
+        all the points.
+        Default: False (every point votes).
+    :seed, int (optional): seed of the random order of a subsample.
+        Default: None (unseeded).
+    :rng, numpy.random.Generator (optional): random number generator of
+        the order of a subsample. Supercedes `seed`.
+    :batch, int (optional): number of points that vote between checks
+        of the peak. Default: 1% of the points (at least 100).
+    :stability, int (optional): largest move of the peak, in divisions
+        along either axis, since half as many points had voted that
+        counts as stable. Default: 1.
+    :patience, int (optional): number of consecutive stable batches
+        after which voting stops. Default: 3.
+    :peak_band, (float, float) (optional): theta band (in degrees) in
+        which the peak is tracked. Default: all stored rows.
+    :peak_sigma, float or (float, float) (optional): standard
+        deviation, in divisions, of the gaussian smoothing applied to
+        the band before the peak is located, so that the tracked peak
+        is that of the line rather than of a noise spike. Default:
+        3*sqrt(3)*(n - 1)/1800 along each axis of n divisions, the
+        smoothing of `approximate_elastic_regime_from_hough`.
+    :weights, array-like or "density" (optional): weight of the votes
+        of each point, e.g. the inverse of its measurement uncertainty.
+        "density" weighs each point by the length of curve it stands
+        for (see `density_weights`), so that densely sampled regions
+        of a curve do not outvote sparsely sampled ones. Weighted
+        voting requires a floating point `dtype`. Default: None (every
+        vote counts once).
+    :pool, BufferPool (optional): pool from which the accumulator is
+        drawn (see `tools.BufferPool`). Hand it back with
+        `pool.release(hough)` once the Hough space is no longer needed.
+        The buffers of the batches of votes cast in this process are
+        drawn from, and released to, the pool too. Default: None (new
+        arrays).
+
+    Streaming
+    =========
+    Points can be added (`add_points`) to, or removed (`remove_points`)
+    from, an existing Hough space. The accumulator is updated in place
+    and, as long as the geometry of the Hough space (its radial range
+    and, for `Normalized` data, the scaling) is unchanged, it is
+    identical to a Hough space built from all the points at once.
+
+    If the stored points are `Normalized`, new points are given in the
+    original (unscaled) units and are scaled in the same way. New
+    points change the geometry if they lie beyond the radial range
+    (see `rmax`) or extend the range of `Normalized` data. All points
+    must then be re-binned, which costs a full `construct`. While data
+    are still arriving, `add_points(..., defer=True)` stores the points
+    and marks the Hough space `stale` instead; the re-binning is done
+    once, by `refresh`.
+
+    The accumulator type is fixed, so a Hough space that is to grow
+    should be created with a `dtype` wide enough for the final number
+    of points, e.g. `dtype=numpy.uint32`.
+
+    Persistence
+    ===========
+    `save` writes the accumulator to `<fname>.npy`, which `load` can
+    memory-map, and the points and metadata (`theta`, `radius`, `nq`,
+    `nr`, offsets, options and a hash of the source data, `source`)
+    to `<fname>.npz`. `HoughSpace.digest` combines the source hash
+    with the options that determine the accumulator, and so names a
+    Hough space by its content, e.g. for an on-disk cache.
     """
 
+    GEOMETRY = {
+        'nq': 1801,
+        'nr': 1801,
+        'band': None,
+        'margin': 0,
+        'rows': None,
+        'columns': None,
+        'rmax': None,
+        'dtype': None,
+        'voting': 'nearest',
+        'precision': 0.1,
+        'memory': None
+    }
+
+    ENGINES = ('vectorized', 'loop')
+    VOTING = ('nearest', 'linear')
+
     @staticmethod
     def distance(x, y, phi):
         """
@@ -74,10 +372,29 @@ class HoughSpace(np.ndarray):
         """
         return np.abs(x*np.sin(phi) + y*np.cos(phi))
 
-    def __new__(cls, xdata, ydata, **kwds):
+    @staticmethod
+    def _options(npoints, **kwds):
+        """
+        Validates the construction options shared by `HoughSpace` and
+        `SparseHoughSpace` (see the HoughSpace doc string).
+
+        Input
+        =====
+        :npoints, int: number of points that will vote.
+
+        Output
+        ======
+        dict of the options `nq`, `nr`, `engine`, `chunksize`, `nprocs`,
+        `voting`, `dtype` and `rmax`, and the windows of stored `rows`
+        and `columns`, each as `(first, last)`.
+        """
         # handle options
         nq = kwds.get('nq', 1801)
         nr = kwds.get('nr', 1801)
+        if 'auto' in (nq, nr):
+            auto = grid_size(npoints, **kwds)
+            nq = auto[0] if nq == 'auto' else nq
+            nr = auto[1] if nr == 'auto' else nr
         # set number of theta divisions
         try:
             nq = int(nq)
@@ -90,12 +407,91 @@ class HoughSpace(np.ndarray):
         except ValueError:
             msg = 'The number of radial divisions must be an integer.'
             raise ValueError(msg)
+        # set the accumulation engine
+        engine = kwds.get('engine', 'vectorized')
+        if engine not in HoughSpace.ENGINES:
+            msg = 'Unrecognized Hough engine "{}". Must be one of {}.'.format(
+                engine, HoughSpace.ENGINES)
+            raise ValueError(msg)
+        chunksize = kwds.get('chunksize', None)
+        nprocs = kwds.get('nprocs', 1)
+        nprocs = int(nprocs or os.cpu_count() or 1)
+        # set the window of theta rows that are stored
+        band = kwds.get('band', None)
+        if 'rows' in kwds:
+            q0, q1 = [int(q) for q in kwds['rows']]
+        elif band is not None:
+            lower, upper = band
+            margin = int(kwds.get('margin', 0))
+            q0 = int(lower/180*nq) - margin
+            q1 = int(upper/180*nq) + margin
+        else:
+            q0, q1 = 0, nq
+        q0, q1 = max(0, q0), min(nq, q1)
+        if q1 <= q0:
+            msg = 'The theta band must span at least one division.'
+            raise ValueError(msg)
+        # set the window of radial columns that are stored
+        r0, r1 = [int(r) for r in kwds.get('columns', (0, nr))]
+        r0, r1 = max(0, r0), min(nr, r1)
+        if r1 <= r0:
+            msg = 'The radial window must span at least one division.'
+            raise ValueError(msg)
+        if chunksize is None and kwds.get('memory', None) is not None:
+            # the batches `grid_size` counted in the budget
+            chunksize = max(1, min(1 << 18, (q1 - q0)*(r1 - r0)//16))
+        # set the voting scheme
+        voting = kwds.get('voting', 'nearest')
+        if voting not in HoughSpace.VOTING:
+            msg = 'Unrecognized voting scheme "{}". Must be one of {}.'.format(
+                voting, HoughSpace.VOTING)
+            raise ValueError(msg)
+        dtype = kwds.get('dtype', None)
+        weighted = kwds.get('weights', None) is not None
+        if voting == 'linear' or weighted:
+            if dtype in (None, 'auto'):
+                dtype = np.float32
+            if np.dtype(dtype).kind != 'f':
+                msg = '{} voting requires a floating point ' \
+                      'accumulator.'.format(
+                          'Linear' if voting == 'linear' else 'Weighted')
+                raise ValueError(msg)
+        # every point votes at most once per cell
+        dtype = accumulator_dtype(npoints, dtype)
+        return {
+            'nq': nq,
+            'nr': nr,
+            'engine': engine,
+            'chunksize': chunksize,
+            'nprocs': nprocs,
+            'rows': (q0, q1),
+            'columns': (r0, r1),
+            'voting': voting,
+            'dtype': dtype,
+            'rmax': kwds.get('rmax', None)
+        }
+
+    def __new__(cls, xdata, ydata, **kwds):
+        # handle options
+        opts = HoughSpace._options(np.size(xdata), **kwds)
+        q0, q1 = opts['rows']
+        r0, r1 = opts['columns']
         # initialize the hough space
-        obj = np.zeros((nq, nr), dtype=int).view(cls)
+        #+ `construct` zeros the accumulator before voting
+        obj = acquire(kwds.get('pool', None), (q1 - q0, r1 - r0),
+                      opts['dtype']).view(cls)
         obj.theta = (0, np.pi)
         obj.radius = (0, 1)
-        obj.nq = nq
-        obj.nr = nr
+        obj.nq = opts['nq']
+        obj.nr = opts['nr']
+        obj.engine = opts['engine']
+        obj.voting = opts['voting']
+        obj.chunksize = opts['chunksize']
+        obj.nprocs = opts['nprocs']
+        obj.qoffset = q0
+        obj.roffset = r0
+        obj.rmax = opts['rmax']
+        obj.stale = False
         # build conditions based on options
         if not isinstance(xdata, np.ndarray):
             # why not just use asarray? in case xdata is a subclass of
@@ -109,8 +505,13 @@ class HoughSpace(np.ndarray):
             obj.y = np.asarray(ydata)
         else:
             obj.y = ydata
+        obj.weights = _point_weights(obj.x, obj.y, kwds.get('weights', None))
+        obj.consumed = np.size(obj.x)
         # construct the hough space
-        obj.construct()
+        if kwds.get('subsample', False):
+            obj._subsample(**kwds)
+        else:
+            obj.construct(pool=kwds.get('pool', None))
         return obj
 
     def __array_finalize__(self, obj):
@@ -125,6 +526,16 @@ class HoughSpace(np.ndarray):
             self.nr = 0
         self.x  = getattr(obj, 'x', np.array([], dtype=float))
         self.y  = getattr(obj, 'y', np.array([], dtype=float))
+        self.weights = getattr(obj, 'weights', None)
+        self.engine = getattr(obj, 'engine', 'vectorized')
+        self.voting = getattr(obj, 'voting', 'nearest')
+        self.chunksize = getattr(obj, 'chunksize', None)
+        self.nprocs = getattr(obj, 'nprocs', 1)
+        self.qoffset = getattr(obj, 'qoffset', 0)
+        self.roffset = getattr(obj, 'roffset', 0)
+        self.rmax = getattr(obj, 'rmax', None)
+        self.stale = getattr(obj, 'stale', False)
+        self.consumed = getattr(obj, 'consumed', np.size(self.x))
         return obj
 
     def theta_distance(self, iq, ir):
@@ -132,10 +543,17 @@ class HoughSpace(np.ndarray):
         Returns the theta and distance values for a given coordinate
         in the Hough space.
 
+        The indices may be fractional, e.g. a peak position refined to
+        sub-division accuracy (see `tools.interpolate_peak`).
+
         Input
         =====
-        :iq, int: theta index for the point in the Hough space
-        :ir, int: radius/distance index for the point in the Hough space.
+        :iq, float: theta index for the point in the Hough space. For a
+            band-limited Hough space, this is the row in the band,
+            i.e. relative to `qoffset`.
+        :ir, float: radius/distance index for the point in the Hough
+            space, relative to `roffset` for a radially windowed Hough
+            space.
 
         Output
         ======
@@ -143,11 +561,142 @@ class HoughSpace(np.ndarray):
         """
         qlo, qhi = self.theta
         rlo, rhi = self.radius
-        theta = iq/self.nq * (qhi - qlo) + qlo
-        distance = ir/self.nr * (rhi - rlo) + rlo
+        # the nq-1 theta samples are binned into rows 0..nq-3 and
+        # nq-1 (see `_trig_table`), i.e. a row spacing of pi/(nq-2).
+        iq = np.minimum(iq + self.qoffset, self.nq - 2)
+        theta = iq/(self.nq - 2) * (qhi - qlo) + qlo
+        # a "nearest" division holds the distances in [ir, ir+1), so
+        # its best estimate is the center of the division. "linear"
+        # votes are binned at the grid points themselves.
+        ir = ir + self.roffset + (0.5 if self.voting == 'nearest' else 0.)
+        distance = ir/(self.nr - 1) * (rhi - rlo) + rlo
         return (theta, distance)
 
-    def construct(self):
+    def peaks(self, k=1, band=None, min_separation=1, **kwds):
+        """
+        Finds the `k` strongest lines in the Hough space.
+
+        The band is smoothed (optionally) and searched for local maxima
+        once; all candidates are then converted to lines together.
+
+        Input
+        =====
+        :k, int: maximum number of lines. Default: 1.
+        :band, (float, float): theta band (in degrees) to search.
+            Default: all stored rows.
+        :min_separation, int: smallest separation, in divisions along
+            either axis, between two peaks (see `tools.local_maxima`).
+            Default: 1.
+
+        Options
+        =======
+        :sigma, float or (float, float): standard deviation, in
+            divisions, of the gaussian smoothing applied to the band
+            before the search. Default: 0 (no smoothing).
+        :interpolate, bool: If True, refine each peak to sub-division
+            accuracy (see `tools.interpolate_peak`). Default: False.
+        :pool, BufferPool: pool from which the smoothed band is drawn
+            (see `tools.smooth`). Default: None.
+        :segments, bool: If True, also find the run of stored points
+            that supports each line (see `segment`; `width` and
+            `max_gap` are passed through). Default: False.
+
+        Output
+        ======
+        Dictionary, strongest line first:
+            {
+                'index'    : (k', 2) float array of the (row, column) of
+                             each peak, as for `theta_distance`,
+                'theta'    : (k',) array of angles,
+                'distance' : (k',) array of distances,
+                'votes'    : (k',) array of the (smoothed) votes at
+                             each peak,
+                'smoothed' : the (smoothed) band that was searched,
+                'rows'     : (first, last) rows of the band,
+                'start'    : (k',) array of the first point of each
+                             supporting run (`segments` only),
+                'end'      : (k',) array of the point after the last
+                             point of each run (`segments` only) }
+        """
+        sigma = kwds.get('sigma', 0)
+        interpolate = kwds.get('interpolate', False)
+        lo, hi = (0, 180) if band is None else band
+        lo = max(0, int(lo/180*self.nq) - self.qoffset)
+        hi = min(self.shape[0], int(hi/180*self.nq) - self.qoffset)
+        if np.any(np.asarray(sigma) > 0):
+            smoothed = smooth(self, sigma, rows=(lo, hi),
+                              pool=kwds.get('pool', None))
+        else:
+            smoothed = np.asarray(self[lo:hi])
+        found = local_maxima(smoothed, k=k, min_separation=min_separation)
+        votes = smoothed[found[:, 0], found[:, 1]] if found.size else \
+                np.zeros(0, dtype=smoothed.dtype)
+        index = found.astype(float)
+        if interpolate:
+            for i, peak in enumerate(found):
+                index[i] = interpolate_peak(smoothed, peak)
+        index[:, 0] += lo
+        theta, distance = self.theta_distance(index[:, 0], index[:, 1])
+        result = {
+            'index': index,
+            'theta': np.asarray(theta, dtype=float),
+            'distance': np.asarray(distance, dtype=float),
+            'votes': votes,
+            'smoothed': smoothed,
+            'rows': (lo, hi)
+        }
+        if kwds.get('segments', False):
+            runs = [self.segment(q, d, **kwds)
+                    for q, d in zip(result['theta'], result['distance'])]
+            runs = np.array(runs, dtype=int).reshape(-1, 2)
+            result['start'], result['end'] = runs[:, 0], runs[:, 1]
+        return result
+
+    def segment(self, theta, distance, **kwds):
+        """
+        Finds the longest run of consecutive points that lie on the
+        line `(theta, distance)`, e.g. the elastic region of a
+        stress-strain curve, without a further pass over the curve.
+
+        Input
+        =====
+        :theta, float: angle of the line (see `theta_distance`).
+        :distance, float: distance of the line from the origin.
+
+        Options
+        =======
+        :xdata, array-like: x data of the (ordered) points to search, in
+            the coordinates of this Hough space. Default: `x`.
+        :ydata, array-like: y data of the points. Default: `y`.
+        :width, float: largest distance from the line of a point that
+            lies on it. Default: two radial divisions.
+        :max_gap, int: largest number of consecutive points off the
+            line that does not end a run. Default: 0.
+
+        Output
+        ======
+        (start, end) such that points[start:end] is the run. (0, 0) if
+        no point lies on the line.
+        """
+        xdata = np.asarray(kwds.get('xdata', self.x))
+        ydata = np.asarray(kwds.get('ydata', self.y))
+        rlo, rhi = self.radius
+        width = kwds.get('width', 2*(rhi - rlo)/(self.nr - 1))
+        max_gap = int(kwds.get('max_gap', 0))
+        # see the HoughSpace doc string for the role of phi
+        offline = np.abs(HoughSpace.distance(xdata, ydata, np.pi - theta) -
+                         distance)
+        online = np.flatnonzero(offline <= width)
+        if online.size == 0:
+            return (0, 0)
+        # runs are broken where more than `max_gap` points are skipped
+        breaks = np.flatnonzero(np.diff(online) > max_gap + 1)
+        first = np.concatenate(([0], breaks + 1))
+        last = np.concatenate((breaks, [online.size - 1]))
+        longest = np.argmax(online[last] - online[first])
+        return (int(online[first[longest]]), int(online[last[longest]]) + 1)
+
+    def construct(self, **kwds):
         """
         Constructs the Hough space from the x and y point data
         stored as part of `self`.
@@ -155,6 +704,8 @@ class HoughSpace(np.ndarray):
         IN
         ==
         :self: this instance
+        :pool, BufferPool (optional): pool from which the buffers of the
+            batches of votes are drawn. Default: None (new arrays).
 
         OUT
         ===
@@ -162,7 +713,6 @@ class HoughSpace(np.ndarray):
         """
         assert self.x.shape == self.y.shape, \
             "The shapes of the x and y vectors must match."
-        nq = self.nq
         nr = self.nr
         # construct the Hough space
         #+ what range of theta and r are appropriate?
@@ -170,34 +720,964 @@ class HoughSpace(np.ndarray):
         #+ farther away from the origin that the distance to the
         #+ point itself.
         radius = np.linspace(0,
-            np.sqrt(self.x**2 + self.y**2).max(),
+            self._rmax(),
             num=nr-1)
-        self.radius = (radius.min(), radius.max())
+        self.radius = (radius[0], radius[-1])
         #+ since each line extends in both directions from the point
         #+ there is only need to explore 180 degrees (pi radians)
-        theta = np.linspace(0,
-            np.pi,
-            num=nq-1)
-        self.theta = (theta.min(), theta.max())
-        # see the doc string for the HoughSpace class for a detailed
-        # description of the role of phi. In short, the theta from
-        # the theta -> phi conversion is what one would expect from
-        # $y = mx + b$ where $m = \tan \theta$ for $+\theta$
-        # counterclockwise.
-        phi = np.pi - theta
-        # with what indices do the theta values correspond?
-        qlo, qhi = theta[0], theta[-1]
-        iq = ((theta - qlo)/(qhi - qlo)*(nq-1)).astype(int)
-        # range of the radial values
-        rlo, rhi = radius[0], radius[-1]
+        self.theta = (0., np.pi)
         # populate the Hough space
         self.fill(0)
-        for x,y in zip(self.x, self.y):
-            # vectorized calculation of all distances. Note the
-            # use of $\phi$, not $\theta$ in this equation. The
-            # reason can be found in the HoughSpace doc string.
-            d = (HoughSpace.distance(x, y, phi) - rlo)/(rhi - rlo)
-            # To which index does each distance correspond
-            ir = (d*(nr-1)).astype(int)
-            self[iq, ir] += 1
+        self.stale = False
+        self._vote(self.x, self.y, weights=self.weights, parallel=True,
+                   pool=kwds.get('pool', None))
+
+    def _subsample(self, **kwds):
+        """
+        Probabilistic construction of the Hough space: the points vote
+        in random order, in batches of `batch`, until the position of
+        the maximum of the smoothed `peak_band` is within `stability`
+        divisions of its position when half as many points had voted,
+        for `patience` consecutive batches. See the HoughSpace doc
+        string for the options.
+
+        Output
+        ======
+        None. The Hough space is constructed in place; `x`, `y` and
+        `consumed` describe the points that voted.
+        """
+        rng = kwds.get('rng', None)
+        if rng is None:
+            rng = np.random.default_rng(kwds.get('seed', None))
+        xdata, ydata = self.x, self.y
+        npoints = xdata.size
+        batch = max(1, int(kwds.get('batch', max(100, npoints//100))))
+        stability = kwds.get('stability', 1)
+        patience = int(kwds.get('patience', 3))
+        # rows in which the peak is tracked
+        lo, hi = kwds.get('peak_band', (0, 180))
+        lo = max(0, int(lo/180*self.nq) - self.qoffset)
+        hi = min(self.shape[0], int(hi/180*self.nq) - self.qoffset)
+        if hi <= lo:
+            lo, hi = 0, self.shape[0]
+        sigma = kwds.get('peak_sigma', None)
+        if sigma is None:
+            sigma = 3*np.sqrt(3)*(np.array([self.nq, self.nr]) - 1)/1800
+        pool = kwds.get('pool', None)
+        # the geometry is that of all the points, whichever vote
+        self.rmax = self._rmax()
+        weights = self.weights
+        self.x, self.y = xdata[:0], ydata[:0]
+        self.weights = None
+        self.construct(pool=pool)
+        order = rng.permutation(npoints)
+        # the peak after each batch. A peak that drifts by less than
+        # `stability` per batch can still drift far; it is compared
+        # with the peak when half as many points had voted instead.
+        history, stable, consumed = [], 0, 0
+        for start in range(0, npoints, batch):
+            chosen = order[start:start + batch]
+            self._vote(xdata[chosen], ydata[chosen],
+                       weights=None if weights is None else weights[chosen],
+                       pool=pool)
+            consumed += chosen.size
+            if np.any(np.asarray(sigma) > 0):
+                band = smooth(self.view(np.ndarray), sigma, rows=(lo, hi),
+                              pool=pool)
+                peak = np.unravel_index(np.argmax(band), band.shape)
+                if pool is not None:
+                    pool.release(band)
+            else:
+                band = self[lo:hi].view(np.ndarray)
+                peak = np.unravel_index(np.argmax(band), band.shape)
+            history.append(np.array(peak))
+            half = len(history)//2 - 1
+            if half >= 0 and \
+                    np.abs(history[-1] - history[half]).max() <= stability:
+                stable += 1
+            else:
+                stable = 0
+            if stable >= patience:
+                break
+        self.x = xdata[order[:consumed]]
+        self.y = ydata[order[:consumed]]
+        if weights is not None:
+            self.weights = weights[order[:consumed]]
+        self.consumed = consumed
+
+    def _rmax(self):
+        """
+        Upper bound of the radial range needed by the stored points.
+        """
+        rmax = np.sqrt(self.x**2 + self.y**2).max() if self.x.size else 0.
+        if self.rmax is not None:
+            rmax = max(rmax, self.rmax)
+        return float(rmax)
+
+    def _geometry(self):
+        """
+        Returns the rows (`iq`), angles (`phi`) and their sines and
+        cosines (`trig`) at which points vote, the radial range (`rlo`,
+        `rhi`) and the window of radial columns (`r0`, `r1`) stored in
+        this Hough space as `(iq, phi, trig, rlo, rhi, (r0, r1))`.
+
+        The angular arrays are shared, read-only tables (see
+        `_trig_table`).
+        """
+        q0 = self.qoffset
+        q1 = q0 + self.shape[0]
+        iq, phi, sinphi, cosphi = _trig_table(self.nq, q0, q1)
+        # range of the radial values
+        rlo, rhi = self.radius
+        # window of radial columns stored in this Hough space
+        r0 = self.roffset
+        r1 = r0 + self.shape[1]
+        return (iq, phi, (sinphi, cosphi), rlo, rhi, (r0, r1))
+
+    def _vote(self, xdata, ydata, subtract=False, weights=None,
+              parallel=False, pool=None):
+        """
+        Adds the votes cast by the points (xdata, ydata), each with its
+        weight in `weights` (if given), to the accumulator or, if
+        `subtract`, removes them. The votes are cast on the current
+        geometry of the Hough space, across `nprocs` processes if
+        `parallel`, or else with batch buffers drawn from `pool`.
+        """
+        if np.size(xdata) == 0:
+            return
+        nr = self.nr
+        iq, phi, trig, rlo, rhi, (r0, r1) = self._geometry()
+        if self.engine == 'loop':
+            for i, (x,y) in enumerate(zip(xdata, ydata)):
+                w = 1 if weights is None else weights[i]
+                # vectorized calculation of all distances. Note the
+                # use of $\phi$, not $\theta$ in this equation. The
+                # reason can be found in the HoughSpace doc string.
+                d = (HoughSpace.distance(x, y, phi) - rlo)/(rhi - rlo)
+                # To which index does each distance correspond
+                ir = (d*(nr-1)).astype(int)
+                if self.voting == 'linear':
+                    # split the vote between ir and ir+1
+                    upper = d*(nr-1) - ir
+                    step = -1 if subtract else 1
+                    for cols, weight in ((ir, 1 - upper), (ir + 1, upper)):
+                        keep = (cols >= r0) & (cols < r1)
+                        np.add.at(self.view(np.ndarray),
+                                  (iq[keep], cols[keep] - r0),
+                                  step*w*weight[keep])
+                    continue
+                keep = (ir >= r0) & (ir < r1)
+                if subtract:
+                    self[iq[keep], ir[keep] - r0] -= w
+                else:
+                    self[iq[keep], ir[keep] - r0] += w
+        elif parallel and self.nprocs > 1 and np.size(xdata) > 1:
+            _parallel_accumulate(self.view(np.ndarray),
+                                 xdata, ydata, iq, phi, rlo, rhi, nr,
+                                 columns=(r0, r1),
+                                 voting=self.voting,
+                                 trig=trig,
+                                 chunksize=self.chunksize,
+                                 nprocs=self.nprocs,
+                                 subtract=subtract,
+                                 weights=weights)
+        else:
+            _accumulate(self.view(np.ndarray),
+                        xdata, ydata, iq, phi, rlo, rhi, nr,
+                        columns=(r0, r1),
+                        voting=self.voting,
+                        trig=trig,
+                        chunksize=self.chunksize,
+                        subtract=subtract,
+                        weights=weights,
+                        pool=pool)
+
+    def add_points(self, xdata, ydata, **kwds):
+        """
+        Adds points to the Hough space, updating the accumulator in
+        place (see "Streaming" in the HoughSpace doc string).
+
+        Input
+        =====
+        :xdata, array-like: x data of the new points. Unscaled if the
+            stored x data are `Normalized`.
+        :ydata, array-like: y data of the new points. Unscaled if the
+            stored y data are `Normalized`.
+
+        Options
+        =======
+        :defer, bool: If the new points change the geometry of the
+            Hough space, store them and mark the Hough space `stale`
+            rather than re-binning all points now. Default: False.
+        :weights, array-like: weights of the new points, for a weighted
+            Hough space (see the `weights` option of HoughSpace; the
+            weights of the stored points are not recomputed).
+            Default: 1 for every new point.
+
+        Output
+        ======
+        None. The Hough space is updated in place.
+        """
+        defer = kwds.get('defer', False)
+        xdata = np.asarray(xdata, dtype=float).ravel()
+        ydata = np.asarray(ydata, dtype=float).ravel()
+        assert xdata.shape == ydata.shape, \
+            "The shapes of the x and y vectors must match."
+        count = self.x.size + xdata.size
+        if accumulator_dtype(count, self.dtype) != self.dtype:
+            msg = 'A {} accumulator cannot hold the votes of {} points. ' \
+                  'Construct the Hough space with a wider dtype.'.format(
+                      self.dtype, count)
+            raise OverflowError(msg)
+        weights = kwds.get('weights', None)
+        if self.weights is None and weights is not None:
+            msg = 'Weighted points cannot be added to an unweighted ' \
+                  'Hough space.'
+            raise ValueError(msg)
+        if self.weights is not None:
+            weights = np.ones(xdata.size) if weights is None else \
+                      _point_weights(xdata, ydata, weights)
+            self.weights = np.concatenate((self.weights, weights))
+        self.x, xnew, xscaled = _extend(self.x, xdata)
+        self.y, ynew, yscaled = _extend(self.y, ydata)
+        self.consumed += xdata.size
+        rnew = np.sqrt(xnew**2 + ynew**2).max() if xnew.size else 0.
+        if self.stale or xscaled or yscaled or rnew > self.radius[1]:
+            if defer:
+                self.stale = True
+            else:
+                self.construct()
+        else:
+            self._vote(xnew, ynew, weights=weights)
+
+    def remove_points(self, index):
+        """
+        Removes points from the Hough space, updating the accumulator in
+        place. The geometry of the Hough space is unchanged; call
+        `refresh` to fit it to the remaining points.
+
+        Input
+        =====
+        :index, int, slice or array-like: index, or boolean mask, of
+            the stored points (`x`, `y`) to remove.
+
+        Output
+        ======
+        None. The Hough space is updated in place.
+        """
+        keep = np.ones(self.x.size, dtype=bool)
+        keep[index] = False
+        weights = self.weights
+        if not self.stale:
+            self._vote(self.x[~keep], self.y[~keep], subtract=True,
+                       weights=None if weights is None else weights[~keep])
+        self.x = self.x[keep]
+        self.y = self.y[keep]
+        self.consumed -= keep.size - np.count_nonzero(keep)
+        if weights is not None:
+            self.weights = weights[keep]
+
+    def refresh(self):
+        """
+        Re-bins all stored points if the Hough space is `stale` or its
+        radial range no longer fits the stored points.
+
+        Output
+        ======
+        None. The Hough space is updated in place.
+        """
+        if self.stale or self._rmax() != self.radius[1]:
+            self.construct()
+
+    @property
+    def source(self):
+        """SHA-1 digest of the stored points (`x`, `y`, `weights`)."""
+        return _source_hash(self.x, self.y, self.weights)
+
+    @staticmethod
+    def reproducible(**kwds):
+        """
+        Whether the options `kwds` construct the same Hough space every
+        time, i.e. whether it can be named by `digest`: always, unless
+        it is a `subsample` that is not drawn from an integer `seed`.
+        """
+        if not kwds.get('subsample', False):
+            return True
+        seed = kwds.get('seed', None)
+        return kwds.get('rng', None) is None and \
+            isinstance(seed, (int, np.integer)) and \
+            not isinstance(seed, bool)
+
+    @staticmethod
+    def digest(xdata, ydata, **kwds):
+        """
+        Content hash of the Hough space that `HoughSpace(xdata, ydata,
+        **kwds)` would construct.
+
+        Input
+        =====
+        :xdata, array-like: x data
+        :ydata, array-like: y data
+
+        Options
+        =======
+        Those that determine the accumulator (see `GEOMETRY`; options
+        left out take their default values), the `weights` and, for a
+        `subsample`, the options of the subsample. A subsample is only
+        reproducible from an integer `seed`: a subsample drawn from an
+        `rng`, or without a seed, has no content hash, and raises a
+        ValueError. All other options are ignored, save
+        :salt, object: additional state to hash, e.g. the parameters of
+            the algorithm that chose `rows` and `columns`, given as
+            a value with a reproducible `repr`.
+
+        Output
+        ======
+        Hexadecimal SHA-1 digest, as a str.
+        """
+        geometry = [(key, kwds.get(key, default))
+                    for key, default in sorted(HoughSpace.GEOMETRY.items())]
+        geometry = [(key, np.dtype(value).str if key == 'dtype' and
+                     value not in (None, 'auto') else value)
+                    for key, value in geometry]
+        if kwds.get('subsample', False):
+            # a subsample depends on the random order of the points,
+            # which only an integer seed reproduces: neither the repr
+            # of a generator (its address) nor an unseeded draw names
+            # the points that voted.
+            if not HoughSpace.reproducible(**kwds):
+                msg = 'A subsample has a content hash only if it is ' \
+                      'drawn from an integer "seed".'
+                raise ValueError(msg)
+            geometry += [('subsample', True), ('seed', int(kwds['seed']))]
+            geometry += [(key, kwds.get(key, None)) for key in (
+                'batch', 'stability', 'patience', 'peak_band', 'peak_sigma')]
+        weights = kwds.get('weights', None)
+        if isinstance(weights, str):
+            geometry += [('weights', weights)]
+            weights = None
+        sha = hashlib.sha1(_source_hash(xdata, ydata, weights).encode())
+        sha.update(repr(geometry).encode())
+        sha.update(repr(kwds.get('salt', None)).encode())
+        return sha.hexdigest()
+
+    def save(self, fname):
+        """
+        Saves the Hough space as `<fname>.npy` (the accumulator) and
+        `<fname>.npz` (the points and metadata). Each file is written
+        under a temporary name and then moved into place, so a reader
+        never sees a partially written file.
+
+        Input
+        =====
+        :fname, str: path of the files, without extension.
+
+        Output
+        ======
+        None
+        """
+        meta = {
+            'nq': self.nq,
+            'nr': self.nr,
+            'theta': [float(q) for q in self.theta],
+            'radius': [float(r) for r in self.radius],
+            'qoffset': self.qoffset,
+            'roffset': self.roffset,
+            'rmax': None if self.rmax is None else float(self.rmax),
+            'engine': self.engine,
+            'voting': self.voting,
+            'chunksize': None if self.chunksize is None else \
+                int(self.chunksize),
+            'nprocs': self.nprocs,
+            'stale': self.stale,
+            'consumed': int(self.consumed),
+            'source': self.source
+        }
+        arrays = {'meta': np.array(json.dumps(meta))}
+        if self.weights is not None:
+            arrays['weights'] = np.asarray(self.weights)
+        for name, data in (('x', self.x), ('y', self.y)):
+            arrays[name] = np.asarray(data)
+            if isinstance(data, Normalized):
+                arrays[name + 'scale'] = np.array([data.lower, data.range])
+        # the metadata are moved into place first: a cache reader
+        # treats the accumulator as the mark of a complete entry.
+        with open(fname + '.npz.tmp', 'wb') as ofs:
+            np.savez(ofs, **arrays)
+        os.replace(fname + '.npz.tmp', fname + '.npz')
+        with open(fname + '.npy.tmp', 'wb') as ofs:
+            np.save(ofs, self.view(np.ndarray))
+        os.replace(fname + '.npy.tmp', fname + '.npy')
+
+    @classmethod
+    def load(cls, fname, **kwds):
+        """
+        Loads a Hough space written by `save`.
+
+        Input
+        =====
+        :fname, str: path of the files, without extension.
+
+        Options
+        =======
+        :mmap_mode, str: memory-map mode of the accumulator (see
+            `numpy.load`). A read-only ("r") Hough space cannot be
+            updated, e.g. by `add_points`; use "c" (copy-on-write) or
+            None (read into memory) for that. Default: "r".
+
+        Output
+        ======
+        HoughSpace
+        """
+        mmap_mode = kwds.get('mmap_mode', 'r')
+        with np.load(fname + '.npz') as npz:
+            meta = json.loads(str(npz['meta']))
+            points = {}
+            for name in ('x', 'y'):
+                data = npz[name]
+                if name + 'scale' in npz.files:
+                    lower, range_ = npz[name + 'scale']
+                    # a view would renormalize the points (see
+                    # `Normalized`), which, e.g. for a subsample, need
+                    # not span [0, 1]
+                    data = np.ndarray.__new__(Normalized, data.shape,
+                                              data.dtype, buffer=data)
+                    data.lower, data.range = lower, range_
+                points[name] = data
+            weights = npz['weights'] if 'weights' in npz.files else None
+        accumulator = np.load(fname + '.npy', mmap_mode=mmap_mode)
+        obj = accumulator.view(cls)
+        obj.x = points['x']
+        obj.y = points['y']
+        obj.weights = weights
+        obj.nq = meta['nq']
+        obj.nr = meta['nr']
+        obj.theta = tuple(meta['theta'])
+        obj.radius = tuple(meta['radius'])
+        obj.qoffset = meta['qoffset']
+        obj.roffset = meta['roffset']
+        obj.rmax = meta['rmax']
+        obj.engine = meta['engine']
+        obj.voting = meta.get('voting', 'nearest')
+        obj.chunksize = meta['chunksize']
+        obj.nprocs = meta['nprocs']
+        obj.stale = meta['stale']
+        obj.consumed = meta.get('consumed', obj.x.size)
+        if obj.source != meta['source']:
+            msg = 'The points stored in "{}.npz" do not match their ' \
+                  'source hash.'.format(fname)
+            raise IOError(msg)
+        return obj
 #end 'class HoughSpace(object):'
+
+
+class SparseHoughSpace(object):
+    """
+    Hough transform space of the `xdata` and `ydata` held in a sparse
+    (CSR) matrix.
+
+    Each point votes once in every theta row, so a row holds at most
+    as many nonzero cells as there are points (twice as many for
+    "linear" voting), however fine the radial grid. The CSR matrix
+    costs about 4 + itemsize bytes per nonzero cell, against itemsize
+    bytes per cell for a dense accumulator. Only some data sparsify:
+
+    - few points on a fine radial grid, e.g. a decimated curve, or any
+      curve with `nr` several times the number of points: each row then
+      holds far fewer votes than cells;
+    - a theta band near the angle of a line (see `band` and `rows`),
+      where the votes of the points on the line fall in the same few
+      cells.
+
+    A full (0-180 degree) Hough space of a densely sampled curve, with
+    about as many radial divisions as points, does not sparsify: most
+    cells of each row hold a vote, and the sparse accumulator is then
+    larger than the dense one. Store only the band or window that is
+    searched.
+
+    The interface follows `HoughSpace`: the options, the attributes
+    (`nq`, `nr`, `theta`, `radius`, `x`, `y`, `qoffset`, `roffset`,
+    `shape`, `dtype`, ...) and `theta_distance` are the same. Votes are
+    cast by the "vectorized" engine in a single process. Operations on
+    the accumulator itself, such as smoothing, need a dense array: use
+    `todense` to extract a band of rows as a HoughSpace.
+
+    Input
+    =====
+    :xdata, array-like: x data
+    :ydata, array-like: y data
+
+    Options
+    =======
+    See HoughSpace (`engine`, `nprocs`, `subsample` and `pool` are
+    ignored).
+    """
+
+    def __init__(self, xdata, ydata, **kwds):
+        opts = HoughSpace._options(np.size(xdata), **kwds)
+        q0, q1 = opts['rows']
+        r0, r1 = opts['columns']
+        self.shape = (q1 - q0, r1 - r0)
+        self.dtype = opts['dtype']
+        self.theta = (0, np.pi)
+        self.radius = (0, 1)
+        self.nq = opts['nq']
+        self.nr = opts['nr']
+        self.engine = 'vectorized'
+        self.voting = opts['voting']
+        self.chunksize = opts['chunksize']
+        self.nprocs = 1
+        self.qoffset = q0
+        self.roffset = r0
+        self.rmax = opts['rmax']
+        self.stale = False
+        self.x = np.asarray(xdata) if not isinstance(xdata, np.ndarray) \
+                 else xdata
+        self.y = np.asarray(ydata) if not isinstance(ydata, np.ndarray) \
+                 else ydata
+        self.weights = _point_weights(self.x, self.y,
+                                      kwds.get('weights', None))
+        self.consumed = np.size(self.x)
+        self.construct()
+
+    # the geometry of a sparse Hough space is that of a dense one
+    _rmax = HoughSpace._rmax
+    _geometry = HoughSpace._geometry
+    theta_distance = HoughSpace.theta_distance
+
+    @property
+    def nnz(self):
+        """Number of nonzero cells."""
+        return self.matrix.nnz
+
+    @property
+    def nbytes(self):
+        """Bytes held by the sparse accumulator."""
+        return self.matrix.data.nbytes + self.matrix.indices.nbytes + \
+               self.matrix.indptr.nbytes
+
+    def sum(self, *args, **kwds):
+        """Sum of the votes, see `numpy.sum`."""
+        return self.matrix.sum(*args, **kwds)
+
+    def construct(self):
+        """
+        Constructs the sparse Hough space from the x and y point data
+        stored as part of `self`.
+
+        The rows are filled a block at a time: the votes of every point
+        in a block of rows are binned into a dense histogram of the
+        block, whose nonzero cells are appended to the CSR arrays. The
+        matrix is assembled once, and no more than a block is ever
+        dense.
+
+        Output
+        ======
+        None. `self.matrix` is created/updated on this call.
+        """
+        from scipy import sparse
+        assert self.x.shape == self.y.shape, \
+            "The shapes of the x and y vectors must match."
+        radius = np.linspace(0,
+            self._rmax(),
+            num=self.nr-1)
+        self.radius = (radius[0], radius[-1])
+        self.theta = (0., np.pi)
+        iq, phi, (sinphi, cosphi), rlo, rhi, (r0, r1) = self._geometry()
+        nrows, ncols = self.shape
+        weighted = self.voting == 'linear' or self.weights is not None
+        chunksize = self.chunksize or (1 << 18)
+        # rows per block: a dense block of about `chunksize` cells
+        block = max(1, int(chunksize)//ncols)
+        indptr = np.zeros(nrows + 1, dtype=np.int64)
+        indices, data = [], []
+        for first in range(0, nrows, block):
+            last = min(nrows, first + block)
+            # the angles that vote in the rows [first, last)
+            angles = slice(*np.searchsorted(iq, (first, last)))
+            if self.x.size == 0 or angles.start == angles.stop:
+                continue
+            counts = np.zeros((last - first)*ncols,
+                              dtype=float if weighted else np.int64)
+            for flat, weights in _flat_votes(self.x, self.y,
+                                             iq[angles] - first,
+                                             phi[angles], rlo, rhi, self.nr,
+                                             columns=(r0, r1),
+                                             voting=self.voting,
+                                             trig=(sinphi[angles],
+                                                   cosphi[angles]),
+                                             chunksize=chunksize,
+                                             weights=self.weights):
+                counts += np.bincount(flat, weights=weights,
+                                      minlength=counts.size)
+            cells = np.flatnonzero(counts)
+            # the row of each nonzero cell, and its column within it
+            rows, cols = np.divmod(cells, ncols)
+            indptr[first + 1:last + 1] = np.bincount(
+                rows, minlength=last - first)
+            indices.append(cols.astype(np.int32))
+            data.append(counts[cells].astype(self.dtype))
+        np.cumsum(indptr, out=indptr)
+        indices = np.concatenate(indices) if indices else \
+                  np.zeros(0, dtype=np.int32)
+        data = np.concatenate(data) if data else np.zeros(0, self.dtype)
+        self.matrix = sparse.csr_matrix((data, indices, indptr),
+                                        shape=self.shape)
+
+    def todense(self, **kwds):
+        """
+        Extracts a band of rows as a dense Hough space.
+
+        Options
+        =======
+        :rows, (int, int): window, [first, last), of rows of this Hough
+            space, i.e. relative to `qoffset`. Default: all rows.
+        :pool, BufferPool: pool from which the dense band is drawn (see
+            `tools.BufferPool`). Default: None (a new array).
+
+        Output
+        ======
+        HoughSpace holding the rows. Its `qoffset` is that of the rows
+        in the full Hough space, so that `theta_distance` and the other
+        HoughSpace operations apply unchanged.
+        """
+        lo, hi = kwds.get('rows', (0, self.shape[0]))
+        lo, hi = max(0, int(lo)), min(self.shape[0], int(hi))
+        dense = acquire(kwds.get('pool', None), (hi - lo, self.shape[1]),
+                        self.dtype, zero=True)
+        self.matrix[lo:hi].toarray(out=dense)
+        dense = dense.view(HoughSpace)
+        for attr in ('theta', 'radius', 'nq', 'nr', 'engine', 'voting',
+                     'chunksize', 'nprocs', 'roffset', 'rmax', 'stale',
+                     'x', 'y', 'weights', 'consumed'):
+            setattr(dense, attr, getattr(self, attr))
+        dense.qoffset = self.qoffset + lo
+        return dense
+#end 'class SparseHoughSpace(object):'
+
+
+@lru_cache(maxsize=64)
+def _trig_table(nq, q0, q1):
+    """
+    Angular table of the rows [q0, q1) of a Hough space with `nq`
+    theta divisions.
+
+    Every Hough space with the same theta grid votes at the same
+    angles, so the tables are cached (least recently used first out)
+    and shared. They are read-only.
+
+    Output
+    ======
+    (iq, phi, sin(phi), cos(phi)), where `iq` is the row of each
+    angle `phi`, relative to `q0`.
+    """
+    theta = np.linspace(0,
+        np.pi,
+        num=nq-1)
+    # see the doc string for the HoughSpace class for a detailed
+    # description of the role of phi. In short, the theta from
+    # the theta -> phi conversion is what one would expect from
+    # $y = mx + b$ where $m = \tan \theta$ for $+\theta$
+    # counterclockwise.
+    phi = np.pi - theta
+    # with what indices do the theta values correspond?
+    qlo, qhi = theta[0], theta[-1]
+    iq = ((theta - qlo)/(qhi - qlo)*(nq-1)).astype(int)
+    # keep only those rows that are stored in this (possibly
+    # band-limited) Hough space
+    inband = (iq >= q0) & (iq < q1)
+    iq = iq[inband] - q0
+    phi = phi[inband]
+    table = (iq, phi, np.sin(phi), np.cos(phi))
+    for arr in table:
+        arr.setflags(write=False)
+    return table
+
+
+def _point_weights(xdata, ydata, weights):
+    """
+    Validates the `weights` option of a Hough space of the points
+    (xdata, ydata): None, "density" or one weight per point.
+
+    Output
+    ======
+    float array of the weight of each point, or None.
+    """
+    if weights is None:
+        return None
+    if isinstance(weights, str):
+        if weights != 'density':
+            msg = 'Unrecognized weights "{}".'.format(weights)
+            raise ValueError(msg)
+        return density_weights(xdata, ydata)
+    weights = np.asarray(weights, dtype=float).ravel()
+    if weights.size != np.size(xdata):
+        msg = 'There must be one weight per point.'
+        raise ValueError(msg)
+    if np.any(weights < 0):
+        msg = 'Weights must not be negative.'
+        raise ValueError(msg)
+    return weights
+
+
+def _source_hash(xdata, ydata, weights=None):
+    """
+    SHA-1 digest of the values, type and shape of the point data and,
+    if given, of their weights.
+    """
+    sha = hashlib.sha1()
+    for data in (xdata, ydata) if weights is None else \
+            (xdata, ydata, weights):
+        data = np.ascontiguousarray(data)
+        sha.update('{}{}'.format(data.dtype.str, data.shape).encode())
+        sha.update(data.view(np.ndarray).tobytes())
+    return sha.hexdigest()
+
+
+def _extend(stored, new):
+    """
+    Appends the `new` points to the `stored` points. If `stored` is
+    `Normalized`, `new` is unscaled data and is scaled to match; if
+    it extends the range of `stored`, all the points are renormalized.
+
+    Output
+    ======
+    (all points, scaled new points, whether the stored points were
+    rescaled)
+    """
+    if not isinstance(stored, Normalized):
+        merged = np.concatenate((np.asarray(stored).ravel(), new))
+        return (merged, new, False)
+    lower, upper = stored.lower, stored.lower + stored.range
+    if new.size and (new.min() < lower or new.max() > upper):
+        merged = Normalized(np.concatenate((stored.unscaled.ravel(), new)))
+        return (merged, merged[stored.size:], True)
+    # same arithmetic as `Normalized`, so the new points are scaled
+    # exactly as if they had been normalized with the stored points
+    scaled = new - lower
+    scaled /= stored.range
+    merged = np.concatenate((np.asarray(stored).ravel(), scaled))
+    # renormalizing data that span [0, 1] is exact (0 - 0 = 0,
+    # x/1 = x), so the view only needs the original scaling restored.
+    merged = merged.view(Normalized)
+    merged.lower, merged.range = stored.lower, stored.range
+    return (merged, scaled, False)
+
+
+def _accumulate(out, xdata, ydata, iq, phi, rlo, rhi, nr, **kwds):
+    """
+    Adds the votes cast by the points in (xdata, ydata) to the
+    accumulator `out` or, with the `subtract` option, removes them.
+    See `_flat_votes` for the remaining arguments and for the other
+    options (`columns`, `voting`, `chunksize`, `pool`).
+    """
+    add = np.subtract if kwds.pop('subtract', False) else np.add
+    # every point votes exactly once in each theta row, so no
+    # (iq, ir) pair is repeated for a single point and the
+    # fancy-indexed increment of the "loop" engine is equivalent
+    # to a histogram of the flattened (row-major) bin indices.
+    counts = out.reshape(-1)
+    for flat, weights in _flat_votes(xdata, ydata, iq, phi, rlo, rhi, nr,
+                                     **kwds):
+        if flat.size == 0:
+            continue
+        # a batch votes in a narrow band of rows (see `_flat_votes`),
+        # so only the cells it touches are binned, never the whole grid
+        lo, hi = flat.min(), flat.max() + 1
+        flat -= lo
+        # the accumulator dtype is wide enough for the number of
+        # points (see `accumulator_dtype`), so the cast of the
+        # (int64, or float64 for weighted votes) histogram is safe.
+        cells = counts[lo:hi]
+        add(cells, np.bincount(flat, weights=weights, minlength=hi - lo),
+            out=cells, casting='unsafe')
+
+
+def _shared_partial(name, shape, dtype, slot, xdata, ydata, *args, **kwds):
+    """
+    Worker for `_parallel_accumulate`: accumulates the votes of its
+    share of the points into slot `slot` of the partial accumulators
+    held in the shared memory block `name`.
+    """
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        partials = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        _accumulate(partials[slot], xdata, ydata, *args, **kwds)
+        del partials
+    finally:
+        shm.close()
+
+
+def _parallel_accumulate(out, xdata, ydata, *args, **kwds):
+    """
+    Adds the votes cast by the points in (xdata, ydata) to the
+    accumulator `out` using a pool of processes.
+
+    The points are split evenly across `nprocs` workers. Each worker
+    builds a partial accumulator in a block of shared memory, so that
+    no accumulator is pickled back to this process, and the partial
+    accumulators are then summed into `out`.
+
+    Options
+    =======
+    :nprocs, int: number of worker processes. Default: os.cpu_count().
+    :subtract, bool: remove, rather than add, the votes. Default: False.
+    :weights, ndarray: weight of each point. Default: None.
+    All other arguments and options are those of `_accumulate`.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+    nprocs = int(kwds.pop('nprocs', None) or os.cpu_count() or 1)
+    subtract = kwds.pop('subtract', False)
+    weights = kwds.pop('weights', None)
+    xdata = np.asarray(xdata).ravel()
+    ydata = np.asarray(ydata).ravel()
+    nprocs = max(1, min(nprocs, xdata.size))
+    shape = (nprocs,) + out.shape
+    nbytes = int(np.prod(shape))*out.dtype.itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+    try:
+        partials = np.ndarray(shape, dtype=out.dtype, buffer=shm.buf)
+        partials.fill(0)
+        bounds = np.linspace(0, xdata.size, nprocs + 1).astype(int)
+        with ProcessPoolExecutor(max_workers=nprocs) as pool:
+            futures = [
+                pool.submit(_shared_partial, shm.name, shape, out.dtype.str,
+                            slot, xdata[lo:hi], ydata[lo:hi], *args,
+                            weights=None if weights is None else
+                            weights[lo:hi], **kwds)
+                for slot, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))]
+            for future in futures:
+                future.result()
+        # no cell holds more votes than there are points, so the sum
+        # fits in the accumulator dtype.
+        if subtract:
+            out -= partials.sum(axis=0, dtype=out.dtype)
+        else:
+            out += partials.sum(axis=0, dtype=out.dtype)
+        del partials
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _flat_votes(xdata, ydata, iq, phi, rlo, rhi, nr,
+                columns=None, voting='nearest', trig=None, chunksize=None,
+                weights=None, pool=None):
+    """
+    Generates the votes cast by the points in (xdata, ydata) as
+    indices into the flattened (row-major) Hough space.
+
+    Input
+    =====
+    :xdata, ndarray: x coordinates of the points.
+    :ydata, ndarray: y coordinates of the points.
+    :iq, ndarray of int: theta (row) index of each angle in `phi`.
+    :phi, ndarray: angles at which each point votes.
+    :rlo, float: lower bound of the radial range.
+    :rhi, float: upper bound of the radial range.
+    :nr, int: number of radial divisions.
+
+    Options
+    =======
+    :columns, (int, int): window, [first, last), of radial columns
+        that are kept. Votes outside this window are dropped.
+        Default: all `nr` columns.
+    :voting, str: "nearest" or "linear" (see `HoughSpace`).
+        Default: "nearest".
+    :trig, (ndarray, ndarray): precomputed sine and cosine of `phi`.
+        Default: computed here.
+    :chunksize, int: number of votes computed per batch. A batch is a
+        tile of points by consecutive angles, so that its votes fall in
+        a narrow band of rows. Default: one vote per 16 stored cells,
+        but no fewer than 2**12 and no more than 2**18 votes.
+    :weights, ndarray: weight of the votes of each point.
+        Default: None (every point votes with weight 1).
+    :pool, BufferPool: pool from which the buffers of a batch are
+        drawn, once for all batches, and to which they are released
+        when the generator is done. Default: None (new arrays).
+
+    Output
+    ======
+    Generator of `(indices, weights)`, one per batch of points, where
+    `indices` is a 1D int array of flattened bin indices and `weights`
+    the weight of each vote (None for unweighted "nearest" voting, in
+    which every vote counts once). The arrays may be buffers reused by
+    the next batch, and may be modified by the caller.
+    """
+    xdata = np.asarray(xdata).ravel()
+    ydata = np.asarray(ydata).ravel()
+    r0, r1 = (0, nr) if columns is None else columns
+    windowed = (r0, r1) != (0, nr)
+    if chunksize is None:
+        # about 32 bytes of temporaries per vote: a few MB at most,
+        # whatever the number of points, and no more than a compact
+        # accumulator for smaller Hough spaces
+        chunksize = min(1 << 18, max(1 << 12, phi.size*(r1 - r0)//16))
+    chunksize = max(1, int(chunksize))
+    # each batch is a tile of `npts` points by `nangles` angles
+    npts = max(1, min(xdata.size, chunksize))
+    nangles = max(1, min(chunksize//npts, chunksize//(r1 - r0)))
+    # row offsets into the flattened Hough space
+    offset = (iq*(r1 - r0))[np.newaxis, :]
+    sinphi, cosphi = (np.sin(phi), np.cos(phi)) if trig is None else trig
+    sinphi = sinphi[np.newaxis, :]
+    cosphi = cosphi[np.newaxis, :]
+    # buffers of the distances, grid points and scratch of a tile
+    dbuf, irbuf, scratch = [acquire(pool, npts*nangles, dtype)
+                            for dtype in (float, int, float)]
+    try:
+        for start in range(0, xdata.size, npts):
+            x = xdata[start:start+npts, np.newaxis]
+            y = ydata[start:start+npts, np.newaxis]
+            w = None if weights is None else \
+                weights[start:start+npts, np.newaxis]
+            for angle in range(0, phi.size, nangles):
+                tile = slice(angle, angle + nangles)
+                shape = (x.shape[0], sinphi[:, tile].shape[1])
+                size = shape[0]*shape[1]
+                d = dbuf[:size].reshape(shape)
+                ir = irbuf[:size].reshape(shape)
+                t = scratch[:size].reshape(shape)
+                # identical arithmetic to `HoughSpace.distance`, broadcast
+                # over the points (rows) and the angles (columns) of the
+                # tile, done in place in the buffers of the tile.
+                np.multiply(x, sinphi[:, tile], out=d)
+                np.multiply(y, cosphi[:, tile], out=t)
+                d += t
+                np.abs(d, out=d)
+                d -= rlo
+                d /= (rhi - rlo)
+                d *= (nr-1)
+                # To which index does each distance correspond
+                np.copyto(ir, d, casting='unsafe')
+                if voting == 'linear':
+                    # the vote is shared by the grid points ir and ir+1, in
+                    # proportion to the proximity of the distance to each
+                    d -= ir
+                    np.subtract(1, d, out=t)
+                    if w is not None:
+                        t *= w
+                        d *= w
+                    lower = (ir >= r0) & (ir < r1)
+                    upper = (ir >= r0 - 1) & (ir < r1 - 1)
+                    ir -= r0
+                    ir += offset[:, tile]
+                    yield (ir[lower], t[lower])
+                    ir += 1
+                    yield (ir[upper], d[upper])
+                elif windowed:
+                    keep = (ir >= r0) & (ir < r1)
+                    ir -= r0
+                    ir += offset[:, tile]
+                    yield (ir[keep], None if w is None else
+                           np.broadcast_to(w, ir.shape)[keep])
+                else:
+                    ir += offset[:, tile]
+                    yield (ir.ravel(), None if w is None else
+                           np.broadcast_to(w, ir.shape).ravel())
+    finally:
+        if pool is not None:
+            for buf in (dbuf, irbuf, scratch):
+                pool.release(buf)
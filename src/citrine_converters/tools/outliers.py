@@ -1,12 +1,111 @@
+from __future__ import division
+
 import numpy as np
 from scipy.stats import iqr
 
-def remove_outliers(vec):
+ENGINES = ('sorted', 'loop')
+
+
+def remove_outliers(vec, **kwds):
     """
     Removes outliers based on 1.5*IQR
 
-    :param vec:
-    :return:
+    The point farthest from the mean of the remaining points is removed,
+    one at a time, for as long as its distance from the mean exceeds
+    1.5 times the interquartile range of the remaining points.
+
+    :param vec: 1D array-like of values.
+
+    Options
+    =======
+    :engine, str: One of "sorted" (the values are sorted once; the
+        point farthest from the mean is always the smallest or the
+        largest remaining value, so the remaining points are a
+        contiguous run of the sorted values, whose mean and quartiles
+        are updated in O(1) per point removed: O(n log n) overall) or
+        "loop" (the mean and IQR are recomputed from all remaining
+        points after each removal: O(n^2); kept as a reference
+        implementation). Default: "sorted".
+
+    :return: boolean mask of the points that are kept.
+    """
+    engine = kwds.get('engine', 'sorted')
+    if engine not in ENGINES:
+        msg = 'Unrecognized outlier engine "{}". Must be one of {}.'.format(
+            engine, ENGINES)
+        raise ValueError(msg)
+    if engine == 'loop':
+        return _remove_outliers_loop(vec)
+    vec = np.asarray(vec)
+    mask = np.ones_like(vec, dtype=bool)
+    n = vec.size
+    if n == 0:
+        return mask
+    index = np.arange(n)
+    # ascending and descending values; ties in order of index, as the
+    # reference implementation removes the first of equally distant
+    # points.
+    ascending = np.lexsort((index, vec))
+    descending = np.lexsort((index, -vec))
+    values = vec[ascending].astype(float)
+    # remaining points: values[lo:hi]
+    lo, hi = 0, n
+    nlow = nhigh = 0
+    total = values.sum()
+    while hi - lo > 0:
+        m = hi - lo
+        mean = total/m
+        inner_quartile = _percentile(values, lo, hi, 0.75) - \
+                         _percentile(values, lo, hi, 0.25)
+        below = abs(values[lo] - mean)
+        above = abs(values[hi - 1] - mean)
+        #+ the running mean and the quartiles can differ from those of
+        #+ `np.mean` and `iqr` in the last bits. Where that could change
+        #+ a decision, i.e. for a near tie, they are recomputed as the
+        #+ reference implementation does.
+        tol = 8*np.finfo(float).eps*max(abs(values[lo]),
+                                        abs(values[hi - 1]), abs(mean))
+        if abs(below - above) <= tol or \
+                abs(max(below, above) - 1.5*inner_quartile) <= tol:
+            mean = np.mean(vec[mask])
+            inner_quartile = iqr(vec[mask])
+            below = abs(values[lo] - mean)
+            above = abs(values[hi - 1] - mean)
+        if max(below, above) <= 1.5*inner_quartile:
+            break
+        if below > above or (below == above and
+                             ascending[nlow] < descending[nhigh]):
+            mask[ascending[nlow]] = False
+            total -= values[lo]
+            lo += 1
+            nlow += 1
+        else:
+            mask[descending[nhigh]] = False
+            total -= values[hi - 1]
+            hi -= 1
+            nhigh += 1
+    return mask
+
+
+def _percentile(values, lo, hi, q):
+    """
+    Percentile `q` (a fraction) of the sorted `values[lo:hi]`, with the
+    linear interpolation (and arithmetic) of `numpy.percentile`.
+    """
+    position = q*(hi - lo - 1)
+    below = int(np.floor(position))
+    t = position - below
+    a = values[lo + below]
+    b = values[min(lo + below + 1, hi - 1)]
+    diff = b - a
+    if t >= 0.5:
+        return b - diff*(1 - t)
+    return a + diff*t
+
+
+def _remove_outliers_loop(vec):
+    """
+    Reference implementation of `remove_outliers`.
     """
     mask = np.ones_like(vec, dtype=bool)
     for _ in range(len(vec)):
@@ -19,4 +118,4 @@ def remove_outliers(vec):
             tmp[index] = False
             mask[mask] = tmp
         else:
-            return mask
\ No newline at end of file
+            return mask
@@ -0,0 +1,136 @@
+from __future__ import division
+
+import numpy as np
+from scipy.ndimage import gaussian_filter, maximum_filter
+from .pool import acquire
+
+
+def smooth(arr, sigma, **kwds):
+    """
+    Gaussian smoothing of a 2D array, optionally restricted to a band
+    of rows.
+
+    Only the requested rows, plus enough rows on either side to hold
+    the gaussian kernel, are filtered, so the result matches the same
+    rows of the fully smoothed array.
+
+    Input
+    =====
+    :arr, 2D array-like: array to be smoothed
+    :sigma, float or sequence of floats: standard deviation of the
+        gaussian kernel (in array divisions), for all axes or per axis.
+
+    Options
+    =======
+    :rows, (int, int): band of rows, [first, last), to smooth.
+        Default: all rows.
+    :truncate, float: truncate the kernel at this many standard
+        deviations. Default: 4.0.
+    :dtype, numpy.dtype: floating point type of the result.
+        Default: float32.
+    :pool, BufferPool: pool from which the result is drawn (see
+        `tools.BufferPool`). Default: None (a new array).
+
+    Output
+    ======
+    Smoothed rows of `arr`, as a new array of type `dtype`.
+    """
+    arr = np.asarray(arr)
+    truncate = kwds.get('truncate', 4.0)
+    dtype = kwds.get('dtype', np.float32)
+    lo, hi = kwds.get('rows', (0, arr.shape[0]))
+    lo, hi = max(0, int(lo)), min(arr.shape[0], int(hi))
+    # rows of context needed by the kernel on either side of the band
+    reach = int(truncate*np.atleast_1d(sigma)[0] + 0.5)
+    first = max(0, lo - reach)
+    last = min(arr.shape[0], hi + reach)
+    smoothed = acquire(kwds.get('pool', None),
+                       (last - first,) + arr.shape[1:], dtype)
+    gaussian_filter(arr[first:last], sigma, output=smoothed,
+                    truncate=truncate)
+    return smoothed[lo - first:hi - first]
+
+
+def local_maxima(arr, **kwds):
+    """
+    Finds the largest local maxima in a 2D array.
+
+    A local maximum is an element that is not exceeded by any element
+    within `min_separation` divisions of it (along either axis).
+
+    Input
+    =====
+    :arr, 2D array-like: array in which to find the maxima
+
+    Options
+    =======
+    :k, int: maximum number of maxima to return. Default: 1.
+    :min_separation, int: half-width of the neighborhood over which an
+        element must be the maximum. Default: 1.
+
+    Output
+    ======
+    (k', 2) int array of the (row, column) indices of the maxima,
+    ordered from the largest to the smallest value (ties in order of
+    their position in `arr`). `k' <= k`.
+    """
+    arr = np.asarray(arr)
+    k = int(kwds.get('k', 1))
+    separation = int(kwds.get('min_separation', 1))
+    size = 2*separation + 1
+    peaks = (arr == maximum_filter(arr, size=size, mode='nearest'))
+    # a plateau of equal values yields several neighboring maxima. The
+    # greedy pass below keeps only the first of any maxima that lie
+    # within `min_separation` of a larger (or earlier) one.
+    flat = np.flatnonzero(peaks)
+    values = arr.ravel()[flat].astype(float)
+    # stable sort from largest to smallest value
+    order = np.argsort(-values, kind='mergesort')
+    flat = flat[order]
+    if separation > 0:
+        chosen = []
+        rows, cols = np.unravel_index(flat, arr.shape)
+        for i in range(flat.size):
+            if len(chosen) >= k:
+                break
+            if all(abs(rows[i] - rows[j]) > separation or
+                   abs(cols[i] - cols[j]) > separation for j in chosen):
+                chosen.append(i)
+        flat = flat[chosen]
+    else:
+        flat = flat[:k]
+    return np.stack(np.unravel_index(flat, arr.shape), axis=-1)
+
+
+def interpolate_peak(arr, index):
+    """
+    Refines the position of a peak in an N-D array to sub-division
+    accuracy by fitting a parabola, along each axis, through the peak
+    and its two neighbors.
+
+    Input
+    =====
+    :arr, array-like: array that holds the peak, e.g. a smoothed Hough
+        space.
+    :index, sequence of int: index of the peak in `arr`.
+
+    Output
+    ======
+    Fractional index of the vertex, as a float array. Along an axis on
+    which the peak lies at the edge of `arr`, or is not a strict
+    maximum, the index is left unchanged.
+    """
+    arr = np.asarray(arr)
+    index = tuple(int(i) for i in index)
+    refined = np.array(index, dtype=float)
+    for axis, i in enumerate(index):
+        if i < 1 or i > arr.shape[axis] - 2:
+            continue
+        lo, hi = list(index), list(index)
+        lo[axis], hi[axis] = i - 1, i + 1
+        fm, f0, fp = [float(arr[tuple(j)]) for j in (lo, index, hi)]
+        curvature = fm - 2*f0 + fp
+        if curvature < 0:
+            shift = 0.5*(fm - fp)/curvature
+            refined[axis] += min(0.5, max(-0.5, shift))
+    return refined
@@ -0,0 +1,147 @@
+from __future__ import division
+
+import numpy as np
+
+
+class BufferPool(object):
+    """
+    Pool of reusable array buffers.
+
+    Batch runs, e.g. the Hough approximation of thousands of specimens,
+    need the same large arrays (accumulator, resampled accumulator,
+    smoothed band) over and over. Arrays drawn from a pool (`acquire`)
+    and handed back when they are no longer needed (`release`) reuse
+    the same memory, so that the memory held by a batch run stays flat
+    and the allocator is not asked for, and made to free, several
+    large blocks per specimen.
+
+    Buffers are raw blocks of bytes, so a block released by an array
+    of one type and shape can be reused by an array of any other type
+    and shape of the same size in bytes.
+
+    An array must not be used once it has been released: its memory
+    will be handed to the next array of the same size.
+
+    Options
+    =======
+    :maxbytes, int: largest number of bytes held in released (free)
+        buffers. Buffers released beyond this are dropped, i.e. left to
+        the garbage collector. Default: None (no limit).
+
+    Attributes
+    ==========
+    :nbytes, int: bytes held by the pool, in use or free.
+    :in_use, int: bytes held by arrays that have not been released.
+    :peak_bytes, int: largest `nbytes` since the pool was created (or
+        `reset`).
+    :hits, int: number of `acquire` calls served by a free buffer.
+    :misses, int: number of `acquire` calls that allocated a buffer.
+    """
+    def __init__(self, **kwds):
+        self.maxbytes = kwds.get('maxbytes', None)
+        # free buffers, by size in bytes
+        self._free = {}
+        # buffers handed out, by id
+        self._used = {}
+        self.nbytes = 0
+        self.in_use = 0
+        self.peak_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, shape, dtype=float, **kwds):
+        """
+        Draws an array from the pool.
+
+        Input
+        =====
+        :shape, int or tuple of int: shape of the array.
+        :dtype, numpy.dtype: data type of the array. Default: float.
+
+        Options
+        =======
+        :zero, bool: If True, the array is filled with zeros. Otherwise
+            its contents are undefined (as for `numpy.empty`).
+            Default: False.
+
+        Output
+        ======
+        numpy.ndarray of the requested shape and type. Hand it back with
+        `release`.
+        """
+        dtype = np.dtype(dtype)
+        shape = tuple(np.atleast_1d(shape).astype(int))
+        size = int(np.prod(shape, dtype=np.int64))*dtype.itemsize
+        free = self._free.get(size, [])
+        if free:
+            buf = free.pop()
+            self.hits += 1
+        else:
+            buf = np.empty(size, dtype=np.uint8)
+            self.nbytes += size
+            self.peak_bytes = max(self.peak_bytes, self.nbytes)
+            self.misses += 1
+        self._used[id(buf)] = buf
+        self.in_use += size
+        arr = buf.view(dtype).reshape(shape)
+        if kwds.get('zero', False):
+            arr.fill(0)
+        return arr
+
+    def release(self, arr):
+        """
+        Hands an array drawn from the pool (or any view of it) back to
+        the pool.
+
+        Input
+        =====
+        :arr, numpy.ndarray: array returned by `acquire`, or a view of
+            one, e.g. a HoughSpace built on a pooled buffer.
+
+        Output
+        ======
+        True if the buffer was returned to the pool, False if `arr` does
+        not hold a buffer that is in use.
+        """
+        buf = arr
+        while buf is not None and id(buf) not in self._used:
+            buf = getattr(buf, 'base', None)
+        if buf is None:
+            return False
+        del self._used[id(buf)]
+        self.in_use -= buf.nbytes
+        free = sum(b.nbytes for bufs in self._free.values() for b in bufs)
+        if self.maxbytes is not None and free + buf.nbytes > self.maxbytes:
+            self.nbytes -= buf.nbytes
+        else:
+            self._free.setdefault(buf.nbytes, []).append(buf)
+        return True
+
+    def clear(self):
+        """
+        Drops every free buffer. Buffers in use are unaffected.
+        """
+        for bufs in self._free.values():
+            for buf in bufs:
+                self.nbytes -= buf.nbytes
+        self._free = {}
+
+    def reset(self):
+        """
+        Restarts the `peak_bytes`, `hits` and `misses` metrics.
+        """
+        self.peak_bytes = self.nbytes
+        self.hits = 0
+        self.misses = 0
+
+
+def acquire(pool, shape, dtype=float, **kwds):
+    """
+    Draws an array from `pool` or, if `pool` is None, allocates it. See
+    `BufferPool.acquire`.
+    """
+    if pool is None:
+        if kwds.get('zero', False):
+            return np.zeros(shape, dtype=dtype)
+        return np.empty(shape, dtype=dtype)
+    return pool.acquire(shape, dtype, **kwds)
@@ -1,7 +1,8 @@
 from __future__ import division
 
 import numpy as np
-from bisect import bisect_left as bisect
+from .hough import accumulator_dtype
+from .pool import acquire
 
 def resample(arr, **kwds):
     """
@@ -14,20 +15,100 @@ def resample(arr, **kwds):
     Options
     =======
     :num, int: number of samples to use in resampling `arr`
+    :seed, int: seed for the random number generator, so that the
+        resampling is reproducible. Ignored if `rng` is given.
+        Default: None (unseeded).
+    :rng, numpy.random.Generator: random number generator from which
+        the samples are drawn. Default: `numpy.random.default_rng(seed)`.
+    :chunksize, int: number of samples drawn at a time.
+        Default: 65536.
+    :blocksize, int: number of elements of `arr` per block of the
+        cumulative distribution (see below). Default: 4096.
+    :pool, BufferPool: pool from which the resampled array, and the
+        cumulative distributions and sample bins it is built from, are
+        drawn (see `tools.BufferPool`). The temporaries are released to
+        the pool before returning. Default: None (new arrays).
+
+    The cumulative distribution is never formed over the whole array:
+    a sample first picks a block of `blocksize` elements from the
+    cumulative sum of the block totals, then an element from the
+    cumulative sum of that block. The samples are those of a single,
+    whole-array cumulative distribution.
 
     Output
     ======
-    Resampled array
+    Resampled array. The counts are stored in the smallest unsigned
+    integer type that can hold `num` samples.
     """
     arr = np.asarray(arr)
-    num = kwds.get('num', arr.size)
+    num = int(kwds.get('num', arr.size))
+    rng = kwds.get('rng', None)
+    if rng is None:
+        rng = np.random.default_rng(kwds.get('seed', None))
+    chunksize = int(kwds.get('chunksize', 1 << 16))
+    blocksize = max(1, int(kwds.get('blocksize', 1 << 12)))
+    pool = kwds.get('pool', None)
     # resample
-    resampled = np.zeros_like(arr)
-    resampled_r = resampled.ravel()
-    # construct continuous distribution function
-    cdf = np.cumsum(arr.ravel())
-    cdf = (cdf - cdf.min())/(cdf.max() - cdf.min())
-    for _ in xrange(arr.size):
-        i = bisect(cdf, np.random.random())
-        resampled_r[i] += 1
+    resampled = acquire(pool, arr.shape, accumulator_dtype(num), zero=True)
+    resampled_r = resampled.reshape(-1)
+    flat = arr.reshape(-1)
+    if flat.size == 0:
+        return resampled
+    # Counts, e.g. Hough votes, are summed in the narrowest integer
+    # type that holds the total, so that no sum is upcast to float64.
+    # Weighted (floating point) counts are summed as floats.
+    if arr.dtype.kind in 'ub':
+        dtype = accumulator_dtype(arr.sum(dtype=np.uint64))
+    elif arr.dtype.kind == 'i':
+        dtype = np.dtype(np.int64)
+    else:
+        dtype = np.dtype(np.float64)
+    # cumulative distribution of the block totals
+    #+ summed block by block: `np.add.reduceat(..., dtype=)` would
+    #+ hold a cast copy of the whole array.
+    starts = np.arange(0, flat.size, blocksize)
+    full = flat.size//blocksize*blocksize
+    blocks = acquire(pool, starts.size, dtype)
+    flat[:full].reshape(-1, blocksize).sum(axis=1, dtype=dtype,
+                                           out=blocks[:full//blocksize])
+    blocks[full//blocksize:] = flat[full:].sum(dtype=dtype)
+    cdf = np.cumsum(blocks, out=acquire(pool, starts.size, dtype))
+    total = cdf[-1]
+    if total <= 0:
+        # nothing to draw from
+        num = 0
+    # cumulative distribution within a block, and the bins of a batch
+    local = acquire(pool, blocksize, dtype)
+    bins = acquire(pool, max(1, min(chunksize, num)), np.intp)
+    # bin i holds the targets in [cdf[i-1], cdf[i]), so each sample
+    # lands in bin i with probability arr[i]/total. Targets are drawn
+    # as integers for integer counts.
+    for start in range(0, num, chunksize):
+        size = min(chunksize, num - start)
+        if dtype.kind == 'f':
+            targets = total*rng.random(size)
+        else:
+            targets = rng.integers(0, total, size=size, dtype=dtype)
+        block = np.searchsorted(cdf, targets, side='right')
+        # a target past the last block (float round off) is clipped
+        block = np.minimum(block, starts.size - 1)
+        # target relative to the start of its block
+        targets -= cdf[block] - blocks[block]
+        order = np.argsort(block, kind='stable')
+        block, targets = block[order], targets[order]
+        bounds = np.flatnonzero(np.diff(block)) + 1
+        bounds = np.concatenate(([0], bounds, [block.size]))
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            first = starts[block[lo]]
+            values = flat[first:first + blocksize]
+            np.cumsum(values, dtype=dtype, out=local[:values.size])
+            bins[lo:hi] = first + np.minimum(
+                np.searchsorted(local[:values.size], targets[lo:hi],
+                                side='right'),
+                values.size - 1)
+        found, counts = np.unique(bins[:size], return_counts=True)
+        resampled_r[found] += counts.astype(resampled_r.dtype)
+    if pool is not None:
+        for buf in (bins, local, cdf, blocks):
+            pool.release(buf)
     return resampled
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the Hough transform approximation of the elastic regime.
+
+These are not collected by py.test. Run them directly, e.g.
+
+    python test/benchmark_hough.py peaks
+
+and use `--help` for the list of benchmarks and their options.
+"""
+from __future__ import division, print_function
+
+import os, sys
+HERE=os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, '..'))
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import matplotlib as mpl
+mpl.use('Agg')
+from citrine_converters.astm_e111 import (
+    MechanicalProperties,
+    approximate_elastic_regime_from_hough)
+from citrine_converters.tools import HoughSpace, Normalized
+
+
+def synthetic_curve(npoints, **kwds):
+    """
+    Constructs a MechanicalProperties object from a synthetic, noisy
+    stress-strain curve with a linear elastic region followed by
+    power-law hardening.
+
+    Input
+    =====
+    :npoints, int: number of points in the curve.
+
+    Options
+    =======
+    :modulus, float: elastic modulus (MPa). Default: 70000.
+    :yield_stress, float: stress at the end of the elastic region (MPa).
+        Default: 300.
+    :strain, float: maximum strain. Default: 0.05.
+    :noise, float: standard deviation of the stress noise (MPa).
+        Default: 1.5.
+    :seed, int: seed for the noise. Default: 0.
+
+    Output
+    ======
+    MechanicalProperties
+    """
+    modulus = kwds.get('modulus', 70000.)
+    yield_stress = kwds.get('yield_stress', 300.)
+    maxstrain = kwds.get('strain', 0.05)
+    noise = kwds.get('noise', 1.5)
+    rng = np.random.default_rng(kwds.get('seed', 0))
+    time_ = np.linspace(0, 100, npoints)
+    strain = time_/time_.max()*maxstrain
+    plastic = np.maximum(strain - yield_stress/modulus, 0)
+    stress = np.where(plastic > 0,
+                      yield_stress + 1000*plastic**0.5,
+                      modulus*strain)
+    stress = stress + rng.normal(0, noise, npoints)
+    epsilon = pd.DataFrame({'time': time_, 'strain': strain})
+    sigma = pd.DataFrame({'time': time_, 'stress': stress})
+    return MechanicalProperties(epsilon, sigma)
+
+
+def timed(func, *args, **kwds):
+    """
+    Calls `func(*args, **kwds)` `repeat` times (a keyword consumed
+    here, default 3) and returns `(result, best time in seconds)`.
+    """
+    repeat = kwds.pop('repeat', 3)
+    best = np.inf
+    for _ in range(repeat):
+        start = time.time()
+        result = func(*args, **kwds)
+        best = min(best, time.time() - start)
+    return result, best
+
+
+def theta_bin(mechprop, modulus, nq=1801):
+    """
+    Theta division of the (scaled) Hough space that corresponds to
+    `modulus`.
+    """
+    dx = mechprop.strain.max() - mechprop.strain.min()
+    dy = mechprop.stress.max() - mechprop.stress.min()
+    return np.arctan(modulus*dx/dy)/np.pi*nq
+
+
+def benchmark_peaks(args):
+    """
+    Compares the peak location and runtime of the resampling peak
+    detector to the deterministic detector.
+    """
+    print('{:>6s} {:>13s} {:>12s} {:>12s} {:>10s} {:>8s}'.format(
+        'seed', 'detector', 'modulus', 'onset', 'theta bin', 'time (s)'))
+    for seed in range(args.seeds):
+        mechprop = synthetic_curve(args.npoints, seed=seed)
+        for detector in ('resample', 'deterministic'):
+            approx, seconds = timed(
+                approximate_elastic_regime_from_hough, mechprop,
+                detector=detector, seed=seed, banded=args.banded,
+                repeat=args.repeat)
+            modulus = float(approx['elastic modulus'])
+            print('{:6d} {:>13s} {:12.1f} {:12.4g} {:10.2f} {:8.3f}'.format(
+                seed, detector, modulus, float(approx['elastic onset']),
+                theta_bin(mechprop, modulus), seconds))
+
+
+def benchmark_parallel(args):
+    """
+    Reports how the construction of a Hough space from a long curve
+    scales with the number of worker processes.
+    """
+    mechprop = synthetic_curve(args.npoints)
+    strain = Normalized(mechprop.strain)
+    stress = Normalized(mechprop.stress)
+    nmax = args.nprocs or os.cpu_count() or 1
+    print('{} points, {} x {} Hough space, {} cores'.format(
+        args.npoints, args.nq, args.nr, os.cpu_count()))
+    print('{:>6s} {:>8s} {:>8s}'.format('nprocs', 'time (s)', 'speedup'))
+    serial = None
+    for nprocs in range(1, nmax + 1):
+        _, seconds = timed(HoughSpace, strain, stress,
+                           nq=args.nq, nr=args.nr, nprocs=nprocs,
+                           repeat=args.repeat)
+        serial = serial or seconds
+        print('{:6d} {:8.3f} {:8.2f}'.format(nprocs, seconds, serial/seconds))
+
+
+def benchmark_grid(args):
+    """
+    Reports the accuracy of the approximate elastic modulus, and the
+    runtime and size of the Hough space, for a range of grid sizes and
+    both voting schemes.
+    """
+    modulus = 70000.
+    print('{:>6s} {:>8s} {:>13s} {:>10s} {:>10s} {:>8s} {:>10s}'.format(
+        'grid', 'voting', 'detector', 'mean err %', 'max err %',
+        'time (s)', 'size (MB)'))
+    curves = [synthetic_curve(args.npoints, modulus=modulus, seed=seed)
+              for seed in range(args.seeds)]
+    for n in args.grids:
+        for voting in ('nearest', 'linear'):
+            for detector in ('deterministic', 'resample'):
+                errors, seconds, nbytes = [], [], 0
+                for seed, mechprop in enumerate(curves):
+                    approx, best = timed(
+                        approximate_elastic_regime_from_hough, mechprop,
+                        nq=n, nr=n, voting=voting, detector=detector,
+                        seed=seed, repeat=args.repeat)
+                    errors.append(
+                        100*(float(approx['elastic modulus'])/modulus - 1))
+                    seconds.append(best)
+                    nbytes = approx['hough'].nbytes
+                print('{:6d} {:>8s} {:>13s} {:10.2f} {:10.2f} '
+                      '{:8.3f} {:10.2f}'.format(
+                          n, voting, detector, np.mean(errors),
+                          np.abs(errors).max(), np.mean(seconds),
+                          nbytes/2**20))
+
+
+def benchmark_subsample(args):
+    """
+    Reports the number of points consumed, the runtime and the modulus
+    of the probabilistic (subsampled) Hough transform for a range of
+    batch sizes, against voting with every point.
+    """
+    mechprop = synthetic_curve(args.npoints)
+    print('{} points'.format(mechprop.strain.size))
+    print('{:>8s} {:>8s} {:>10s} {:>8s} {:>12s}'.format(
+        'batch', 'patience', 'consumed', 'time (s)', 'modulus'))
+    approx, seconds = timed(approximate_elastic_regime_from_hough, mechprop,
+                            detector='deterministic', repeat=args.repeat)
+    print('{:>8s} {:>8s} {:10d} {:8.3f} {:12.1f}'.format(
+        'all', '-', approx['hough'].consumed, seconds,
+        float(approx['elastic modulus'])))
+    for batch in args.batches:
+        approx, seconds = timed(approximate_elastic_regime_from_hough,
+                                mechprop, detector='deterministic',
+                                subsample=True, seed=0, batch=batch,
+                                patience=args.patience, repeat=args.repeat)
+        print('{:8d} {:8d} {:10d} {:8.3f} {:12.1f}'.format(
+            batch, args.patience, approx['hough'].consumed, seconds,
+            float(approx['elastic modulus'])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark')
+    # peak detection
+    peaks = subparsers.add_parser('peaks', help=benchmark_peaks.__doc__)
+    peaks.add_argument('--npoints', type=int, default=5000)
+    peaks.add_argument('--seeds', type=int, default=5)
+    peaks.add_argument('--repeat', type=int, default=3)
+    peaks.add_argument('--banded', action='store_true')
+    peaks.set_defaults(func=benchmark_peaks)
+    # parallel scaling
+    parallel = subparsers.add_parser('parallel',
+                                     help=benchmark_parallel.__doc__)
+    parallel.add_argument('--npoints', type=int, default=1000000)
+    parallel.add_argument('--nprocs', type=int, default=None,
+                          help='largest number of processes (default: all)')
+    parallel.add_argument('--nq', type=int, default=1801)
+    parallel.add_argument('--nr', type=int, default=1801)
+    parallel.add_argument('--repeat', type=int, default=1)
+    parallel.set_defaults(func=benchmark_parallel)
+    # accuracy vs. grid size
+    grid = subparsers.add_parser('grid', help=benchmark_grid.__doc__)
+    grid.add_argument('--npoints', type=int, default=5000)
+    grid.add_argument('--seeds', type=int, default=5)
+    grid.add_argument('--grids', type=int, nargs='+',
+                      default=[151, 301, 601, 1801])
+    grid.add_argument('--repeat', type=int, default=1)
+    grid.set_defaults(func=benchmark_grid)
+    # probabilistic Hough transform
+    subsample = subparsers.add_parser('subsample',
+                                      help=benchmark_subsample.__doc__)
+    subsample.add_argument('--npoints', type=int, default=200000)
+    subsample.add_argument('--batches', type=int, nargs='+',
+                           default=[500, 2000, 8000])
+    subsample.add_argument('--patience', type=int, default=3)
+    subsample.add_argument('--repeat', type=int, default=1)
+    subsample.set_defaults(func=benchmark_subsample)
+    args = parser.parse_args(argv)
+    if args.benchmark is None:
+        parser.print_help()
+        return
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ HERE=os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(HERE, '..'))
 
 import json
+import tracemalloc
 import pytest
 import numpy as np
 import pandas as pd
@@ -14,16 +15,34 @@ mpl.use('Agg')
 from matplotlib import pyplot as plt
 from scipy.ndimage.filters import gaussian_filter
 from bisect import bisect_left as bisect
+from bisect import bisect_right
 from pypif import pif
 from citrine_converters.astm_e111 import (
     MechanicalProperties,
     approximate_elastic_regime_from_hough,
-    set_elastic)
+    refined_hough,
+    set_elastic,
+    elastic_window_search)
+from citrine_converters.astm_e111.mechanical import (
+    calculate_modulus,
+    calculate_moduli)
 from citrine_converters.astm_e111 import converter as astm_converter
+from citrine_converters.tools.hough import _trig_table
 from citrine_converters.tools import (
+    BufferPool,
     HoughSpace,
+    SparseHoughSpace,
     Normalized,
+    accumulator_dtype,
+    decimate,
+    density_weights,
+    grid_size,
     linear_merge,
+    resample,
+    smooth,
+    local_maxima,
+    interpolate_peak,
+    remove_outliers,
     covariance,
     r_squared)
 
@@ -81,10 +100,10 @@ def expected_output(generate_output):
             with open(EXPECTED, 'w') as ofs:
                 json.dump(exdata, ofs)
     except:
-        print "Expected Output"
-        print "---------------"
-        for k,v in exdata.iteritems():
-            print "  {}: {}".format(k, v)
+        print("Expected Output")
+        print("---------------")
+        for k,v in exdata.items():
+            print("  {}: {}".format(k, v))
         raise
 
 
@@ -147,6 +166,79 @@ def test_linear_merge():
         "Output shapes for linear merge do not match."
 
 
+def test_decimate(mechanical_properties):
+    # a straight line, with a kink, keeps only its end points and kink
+    x = np.linspace(0, 1, 101)
+    y = np.where(x < 0.5, x, 0.5)
+    keep = decimate(x, y, 1.e-6, max_gap=None)
+    assert np.array_equal(np.flatnonzero(keep), [0, 50, 100]), \
+        'Decimated line should keep its ends and kink ({})'.format(
+            np.flatnonzero(keep))
+    with pytest.raises(ValueError):
+        decimate(x, y, 0)
+    # straight runs keep a point at least every `max_gap`
+    x = np.linspace(0, 1, 10001)
+    keep = decimate(x, np.where(x < 0.5, x, 0.5), 1.e-6, max_gap=0.01)
+    assert np.diff(x[keep]).max() <= 0.01, \
+        'Decimation left a gap of {:.4g} (should be at most 0.01)'.format(
+            np.diff(x[keep]).max())
+    # an oversampled curve shrinks without moving the modulus
+    mechprop = mechanical_properties
+    epsilon = pd.DataFrame({'time': mechprop.time, 'strain': mechprop.strain})
+    sigma = pd.DataFrame({'time': mechprop.time, 'stress': mechprop.stress})
+    decimated = MechanicalProperties(epsilon, sigma, decimate=2.e-5)
+    assert decimated.decimated.sum() < mechprop.strain.size//2, \
+        'Decimation kept {} of {} points'.format(
+            decimated.decimated.sum(), mechprop.strain.size)
+    full = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic')
+    approx = approximate_elastic_regime_from_hough(
+        decimated, detector='deterministic')
+    assert np.isclose(approx['elastic modulus'], full['elastic modulus'],
+                      rtol=2.e-2), \
+        'Decimated elastic modulus ({:.3f}) does not match the full ' \
+        'curve ({:.3f})'.format(approx['elastic modulus'],
+                                full['elastic modulus'])
+
+
+def test_decimated_modulus():
+    # oversampled, low noise curves: the linear elastic segment must
+    # keep enough points for the Hough approximation and the fit
+    strain = np.linspace(0, 0.05, 20000)
+    for noise in (0, 0.2):
+        rng = np.random.default_rng(0)
+        stress = np.minimum(70000*strain, 300) + \
+            1000*np.maximum(strain - 300/70000, 0)**0.6 + \
+            rng.normal(0, noise, strain.size)
+        epsilon = pd.DataFrame({'time': 100*strain, 'strain': strain})
+        sigma = pd.DataFrame({'time': 100*strain, 'stress': stress})
+        full = MechanicalProperties(epsilon, sigma)
+        decimated = MechanicalProperties(epsilon, sigma, decimate=2.e-5)
+        assert decimated.decimated.sum() < full.strain.size//4, \
+            'Decimation kept {} of {} points'.format(
+                decimated.decimated.sum(), full.strain.size)
+        # the fit sees only the points kept, weighted by the points
+        # they stand for
+        for kwds in ({}, {'refine': True}):
+            fits = [set_elastic(mechprop, interactive=False,
+                                detector='deterministic', **kwds)
+                    for mechprop in (full, decimated)]
+            kept = fits[1]['elastic strain'].size
+            assert kept <= decimated.decimated.sum() and \
+                kept < fits[0]['elastic strain'].size//4, \
+                'The decimated fit used {} points'.format(kept)
+            assert np.isclose(decimated.elastic_modulus,
+                              full.elastic_modulus, rtol=1.e-3), \
+                'Decimated elastic modulus ({:.1f}) does not match the ' \
+                'full curve ({:.1f}) with {} MPa noise ({})'.format(
+                    decimated.elastic_modulus, full.elastic_modulus,
+                    noise, kwds)
+        set_elastic(decimated, interactive=False, search='window')
+        assert np.isclose(decimated.elastic_modulus, 70000, rtol=1.e-3), \
+            'Decimated window modulus ({:.1f}) with {} MPa noise'.format(
+                decimated.elastic_modulus, noise)
+
+
 def test_mechanical_constructor(generate_output,
                                 expected_output,
                                 strain_dataframe,
@@ -170,12 +262,12 @@ def test_mechanical_constructor(generate_output,
         expected_output['stress_time_min'] = stress['time'].values.min()
         expected_output['stress_time_max'] = stress['time'].values.max()
         # report output to stdout
-        print "time(min, max) = ({:.3f}, {:.3f})".format(mechprop.time.min(),
-                                                         mechprop.time.max())
-        print "strain time(min, max) = ({:.3f}, {:.3f})".format(
-            strain['time'].values.min(), strain['time'].values.max())
-        print "stress time(min, max) = ({:.3f}, {:.3f})".format(
-            stress['time'].values.min(), stress['time'].values.max())
+        print("time(min, max) = ({:.3f}, {:.3f})".format(mechprop.time.min(),
+                                                         mechprop.time.max()))
+        print("strain time(min, max) = ({:.3f}, {:.3f})".format(
+            strain['time'].values.min(), strain['time'].values.max()))
+        print("stress time(min, max) = ({:.3f}, {:.3f})".format(
+            stress['time'].values.min(), stress['time'].values.max()))
         plt.style.use('ggplot')
         fig = plt.figure(figsize=(16,9))
         ax = fig.add_subplot(111)
@@ -204,8 +296,8 @@ def test_normalize(generate_output, expected_output, mechanical_properties):
         expected_output['nstrain_min'] = float(mechprop.strain.min())
         expected_output['nstrain_max'] = float(mechprop.strain.max())
         # report
-        print "strain(min, max) = ({:.6f}, {:.6f})".format(
-            mechprop.strain.min(), mechprop.strain.max())
+        print("strain(min, max) = ({:.6f}, {:.6f})".format(
+            mechprop.strain.min(), mechprop.strain.max()))
 
 
 def test_default_hough_constructor(generate_output,
@@ -266,6 +358,698 @@ def test_custom_hough_constructor(generate_output, mechanical_properties):
                     dpi=300, bbox_inches='tight')
 
 
+def test_vectorized_hough_matches_loop(mechanical_properties):
+    mechprop = mechanical_properties
+    strain = Normalized(np.copy(mechprop.strain))
+    stress = Normalized(np.copy(mechprop.stress))
+    reference = HoughSpace(strain, stress, nq=361, nr=401, engine='loop')
+    h = HoughSpace(strain, stress, nq=361, nr=401)
+    assert h.engine == 'vectorized', \
+        'Default Hough engine should be "vectorized" ({})'.format(h.engine)
+    assert np.array_equal(h, reference), \
+        'Vectorized Hough accumulator does not match the reference loop.'
+    # tiles of a single row, and of several rows, of points
+    for chunksize in (1009, 4099):
+        h = HoughSpace(strain, stress, nq=361, nr=401, chunksize=chunksize)
+        assert np.array_equal(h, reference), \
+            'Chunked ({}) Hough accumulator does not match the ' \
+            'reference loop.'.format(chunksize)
+
+
+def test_linear_voting(mechanical_properties):
+    mechprop = mechanical_properties
+    strain = Normalized(np.copy(mechprop.strain))
+    stress = Normalized(np.copy(mechprop.stress))
+    reference = HoughSpace(strain, stress, nq=181, nr=201,
+                           voting='linear', engine='loop')
+    h = HoughSpace(strain, stress, nq=181, nr=201, voting='linear')
+    assert h.dtype == np.float32, \
+        'Linear votes should be accumulated as float32 ({})'.format(h.dtype)
+    assert np.allclose(h, reference, atol=1.e-3), \
+        'Vectorized linear votes do not match the reference loop.'
+    # every point casts one whole vote per theta sample
+    votes = strain.size*(h.nq - 1)
+    assert np.isclose(h.sum(dtype=float), votes), \
+        'Linear votes sum to {}, should be {}'.format(h.sum(), votes)
+    with pytest.raises(ValueError):
+        HoughSpace(strain, stress, voting='linear', dtype=np.uint32)
+    # a line through the origin at 75 degrees peaks at 75 degrees
+    x = np.linspace(0, 1, 200)
+    h = HoughSpace(x, np.tan(np.radians(75))*x, nq=301, nr=301,
+                   voting='linear')
+    iq, ir = np.unravel_index(np.argmax(h), h.shape)
+    theta, distance = h.theta_distance(iq, ir)
+    assert abs(np.degrees(theta) - 75) < 180/299, \
+        'Peak at {:.2f} degrees, should be 75'.format(np.degrees(theta))
+    assert distance < 2*h.radius[1]/300, \
+        'Peak at distance {:.4g}, should be 0'.format(distance)
+
+
+def test_weighted_hough(mechanical_properties):
+    rng = np.random.default_rng(0)
+    x, y, w = rng.random(300), rng.random(300), rng.random(300)
+    for voting in HoughSpace.VOTING:
+        loop = HoughSpace(x, y, nq=181, nr=201, voting=voting, weights=w,
+                          engine='loop')
+        vectorized = HoughSpace(x, y, nq=181, nr=201, voting=voting,
+                                weights=w)
+        assert np.allclose(loop, vectorized, atol=1.e-5), \
+            'Weighted {} votes do not match the loop engine.'.format(voting)
+    unweighted = HoughSpace(x, y, nq=181, nr=201)
+    ones = HoughSpace(x, y, nq=181, nr=201, weights=np.ones(x.size))
+    assert np.array_equal(ones, unweighted), \
+        'Unit weights should reproduce the unweighted Hough space.'
+    with pytest.raises(ValueError):
+        HoughSpace(x, y, weights=w, dtype=np.uint16)
+    # a sparsely sampled long line (y = x/2) and a densely sampled short
+    # one (y = 1 - x): only density weights find the long line
+    xa = np.linspace(0, 1, 40)
+    xb = np.linspace(0.4, 0.6, 400)
+    x = np.concatenate((xa, xb))
+    y = np.concatenate((xa/2, 1 - xb))
+    assert np.isclose(density_weights(x, y).mean(), 1), \
+        'Density weights should not change the number of votes.'
+    slope = np.degrees(np.arctan(0.5))
+    for weights, expected in ((None, 45), ('density', slope)):
+        h = HoughSpace(x, y, nq=181, nr=201, weights=weights)
+        found = h.peaks(1)
+        angle = np.degrees(found['theta'][0])
+        angle = min(angle, 180 - angle)
+        assert abs(angle - expected) < 2, \
+            'Peak at {:.1f}, not {:.1f}, degrees ({} weights)'.format(
+                angle, expected, weights)
+
+
+def test_subsample_hough(mechanical_properties):
+    mechprop = mechanical_properties
+    strain = Normalized(np.copy(mechprop.strain))
+    stress = Normalized(np.copy(mechprop.stress))
+    h = HoughSpace(strain, stress, nq=361, nr=361,
+                   subsample=True, seed=0, batch=50, peak_band=(60, 90))
+    assert 0 < h.consumed <= strain.size, \
+        'Consumed {} of {} points.'.format(h.consumed, strain.size)
+    assert h.x.size == h.consumed, \
+        'The stored points should be those that voted.'
+    reference = HoughSpace(h.x, h.y, nq=361, nr=361, rmax=h.rmax)
+    assert np.array_equal(h, reference), \
+        'Subsampled Hough space does not match the votes of its points.'
+    again = HoughSpace(strain, stress, nq=361, nr=361,
+                       subsample=True, seed=0, batch=50, peak_band=(60, 90))
+    assert again.consumed == h.consumed and np.array_equal(again, h), \
+        'Seeded subsamples should be reproducible.'
+    full = HoughSpace(strain, stress, nq=361, nr=361)
+    assert full.consumed == strain.size, \
+        'Every point should vote without a subsample.'
+    # toe (slope 15000) to 0.001 strain, then elastic (slope 70000):
+    # the peak drifts from the toe to the elastic line as points vote
+    toe = toe_curve(0.001, 15000)
+    full = approximate_elastic_regime_from_hough(
+        toe, detector='deterministic')
+    for seed in range(4):
+        approx = approximate_elastic_regime_from_hough(
+            toe, detector='deterministic', subsample=True, seed=seed)
+        assert np.isclose(approx['elastic modulus'],
+                          full['elastic modulus'], rtol=3.e-2), \
+            'Subsampled elastic modulus ({:.1f}, {} points) does not ' \
+            'match the full vote ({:.1f})'.format(
+                approx['elastic modulus'], approx['hough'].consumed,
+                full['elastic modulus'])
+
+
+def test_sparse_hough(mechanical_properties):
+    mechprop = mechanical_properties
+    strain = Normalized(np.copy(mechprop.strain))
+    stress = Normalized(np.copy(mechprop.stress))
+    for kwds in ({}, {'voting': 'linear'},
+                 {'band': (60, 90), 'margin': 36, 'columns': (10, 1500)}):
+        dense = HoughSpace(strain, stress, nq=721, nr=1801, **kwds)
+        sparse = SparseHoughSpace(strain, stress, nq=721, nr=1801, **kwds)
+        assert sparse.shape == dense.shape, \
+            'Sparse Hough space has shape {}, should be {}'.format(
+                sparse.shape, dense.shape)
+        assert np.allclose(sparse.todense(), dense), \
+            'Sparse Hough space does not match the dense Hough space.'
+        assert sparse.theta_distance(5, 7) == dense.theta_distance(5, 7), \
+            'Sparse Hough space does not report the same theta/distance.'
+    band = sparse.todense(rows=(40, 80))
+    assert band.qoffset == dense.qoffset + 40, \
+        'Dense band should be offset by {} rows ({})'.format(
+            dense.qoffset + 40, band.qoffset)
+    assert np.array_equal(band, dense[40:80]), \
+        'Dense band does not match the rows of the dense Hough space.'
+    # a row holds no more nonzero cells than there are points, so few
+    # points (e.g. a decimated curve) on a fine radial grid sparsify.
+    # A densely sampled curve, with about one radial division per
+    # point, does not (see SparseHoughSpace).
+    few = slice(None, None, max(1, strain.size//500))
+    sparse = SparseHoughSpace(strain[few], stress[few], nq=181, nr=18001)
+    assert sparse.nnz <= strain[few].size*sparse.shape[0], \
+        'Sparse Hough space holds {} cells, more than one vote per ' \
+        'point per row.'.format(sparse.nnz)
+    nbytes = 181*18001*sparse.dtype.itemsize
+    assert sparse.nbytes < nbytes/4, \
+        'Sparse accumulator ({} B) should be much smaller than the ' \
+        'dense accumulator ({} B).'.format(sparse.nbytes, nbytes)
+    # the approximation holds only the search band, sparse
+    banded = approximate_elastic_regime_from_hough(
+        mechprop, banded=True, detector='deterministic')
+    approx = approximate_elastic_regime_from_hough(
+        mechprop, sparse=True, detector='deterministic')
+    assert np.array_equal(approx['hough'], banded['hough']) and \
+           approx['hough'].qoffset == banded['hough'].qoffset, \
+        'The sparse band does not match the dense band.'
+    assert approx['elastic modulus'] == banded['elastic modulus'], \
+        'The sparse band gives a different modulus.'
+    with pytest.raises(ValueError):
+        approximate_elastic_regime_from_hough(mechprop, sparse=True,
+                                              pyramid=4)
+
+
+def test_trig_table():
+    iq, phi, sinphi, cosphi = _trig_table(181, 60, 90)
+    assert _trig_table(181, 60, 90)[2] is sinphi, \
+        'Trig tables should be cached and shared.'
+    assert not sinphi.flags.writeable, 'Trig tables should be read-only.'
+    assert np.array_equal(sinphi, np.sin(phi)), \
+        'Cached sine table does not match sin(phi).'
+    assert iq.min() == 0 and iq.max() == 29, \
+        'Trig table rows should be relative to the band.'
+
+
+def test_parallel_hough(mechanical_properties, monkeypatch):
+    mechprop = mechanical_properties
+    strain = Normalized(np.copy(mechprop.strain))
+    stress = Normalized(np.copy(mechprop.stress))
+    serial = HoughSpace(strain, stress, nq=361, nr=401)
+    parallel = HoughSpace(strain, stress, nq=361, nr=401, nprocs=2)
+    assert np.array_equal(serial, parallel), \
+        'Parallel Hough accumulator does not match the serial accumulator.'
+    # streamed and subsampled votes are cast in this process
+    import concurrent.futures
+    executor = concurrent.futures.ProcessPoolExecutor
+    pools = []
+
+    def counted(*args, **kwds):
+        pools.append(args)
+        return executor(*args, **kwds)
+
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', counted)
+    parallel.remove_points(np.arange(0, strain.size, 2))
+    parallel.add_points(strain.unscaled[::2], stress.unscaled[::2])
+    assert np.array_equal(serial, parallel), \
+        'Streamed votes do not restore the parallel accumulator.'
+    HoughSpace(strain, stress, nq=361, nr=401, nprocs=2,
+               subsample=True, seed=0)
+    assert not pools, \
+        'Streamed or subsampled votes started {} process pools.'.format(
+            len(pools))
+
+
+def test_banded_hough(mechanical_properties):
+    mechprop = mechanical_properties
+    strain = Normalized(np.copy(mechprop.strain))
+    stress = Normalized(np.copy(mechprop.stress))
+    full = HoughSpace(strain, stress)
+    h = HoughSpace(strain, stress, band=(60, 90), margin=36)
+    q0 = int(60/180*full.nq) - 36
+    q1 = int(90/180*full.nq) + 36
+    assert h.qoffset == q0, \
+        'Band starts at row {}, should be {}'.format(h.qoffset, q0)
+    assert h.shape == (q1 - q0, full.nr), \
+        'Banded Hough has shape {}, should be {}'.format(
+            h.shape, (q1 - q0, full.nr))
+    assert np.array_equal(h, full[q0:q1]), \
+        'Banded Hough rows do not match the full Hough space.'
+    assert np.allclose(h.theta_distance(10, 20),
+                       full.theta_distance(q0 + 10, 20)), \
+        'Banded Hough does not report the same theta/distance.'
+
+
+def test_streaming_hough(mechanical_properties):
+    mechprop = mechanical_properties
+    strain = np.copy(mechprop.strain)
+    stress = np.copy(mechprop.stress)
+    half = strain.size//2
+    full = HoughSpace(Normalized(strain), Normalized(stress), nq=361, nr=361)
+    # the first half spans the data range, so no re-binning is needed
+    ends = np.unique([strain.argmin(), strain.argmax(),
+                      stress.argmin(), stress.argmax()])
+    order = np.concatenate((ends, np.setdiff1d(np.arange(strain.size), ends)))
+    first, second = order[:half], order[half:]
+    h = HoughSpace(Normalized(strain[first]), Normalized(stress[first]),
+                   nq=361, nr=361, rmax=full.radius[1], dtype=np.uint32)
+    h.add_points(strain[second], stress[second])
+    ref = HoughSpace(Normalized(strain[order]), Normalized(stress[order]),
+                     nq=361, nr=361, dtype=np.uint32)
+    assert np.array_equal(h, ref), \
+        'Streamed Hough space does not match the full Hough space.'
+    assert h.consumed == strain.size, \
+        'Consumed {} of {} streamed points.'.format(h.consumed, strain.size)
+    # removing the points restores the original votes
+    h.remove_points(slice(half, None))
+    ref = HoughSpace(Normalized(strain[first]), Normalized(stress[first]),
+                     nq=361, nr=361, rmax=full.radius[1])
+    assert np.array_equal(h, ref), \
+        'Removing points did not remove their votes.'
+    assert h.consumed == first.size, \
+        'Consumed {} points, should be {}.'.format(h.consumed, first.size)
+    # deferred re-binning
+    h = HoughSpace(strain[:half], stress[:half], nq=361, nr=361,
+                   dtype=np.uint32)
+    h.add_points(2*strain[half:], 2*stress[half:], defer=True)
+    assert h.stale, 'Hough space should be stale until refreshed.'
+    h.refresh()
+    ref = HoughSpace(np.concatenate((strain[:half], 2*strain[half:])),
+                     np.concatenate((stress[:half], 2*stress[half:])),
+                     nq=361, nr=361)
+    assert np.array_equal(h, ref), \
+        'Refreshed Hough space does not match the full Hough space.'
+
+
+def test_save_load_hough(mechanical_properties, tmpdir):
+    mechprop = mechanical_properties
+    strain = Normalized(np.copy(mechprop.strain))
+    stress = Normalized(np.copy(mechprop.stress))
+    h = HoughSpace(strain, stress, band=(60, 90), margin=36)
+    fname = str(tmpdir.join('hough'))
+    h.save(fname)
+    loaded = HoughSpace.load(fname)
+    assert isinstance(loaded.base, np.memmap), \
+        'Loaded Hough space should be memory-mapped.'
+    assert np.array_equal(loaded, h), \
+        'Loaded Hough space does not match the saved Hough space.'
+    assert loaded.theta_distance(10, 20) == h.theta_distance(10, 20), \
+        'Loaded Hough space does not report the same theta/distance.'
+    assert loaded.source == h.source, \
+        'Loaded Hough space has a different source hash.'
+    assert np.isclose(loaded.x.unscaled, strain.unscaled).all(), \
+        'Loaded x data are not normalized as the saved x data.'
+    # the cache reuses the Hough space when only the detector changes
+    cache = str(tmpdir.join('cache'))
+    expected = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic')
+    approx = approximate_elastic_regime_from_hough(
+        mechprop, cache=cache)
+    assert len(os.listdir(cache)) == 2, \
+        'Expected one cached Hough space (.npy/.npz pair).'
+    approx = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic', cache=cache)
+    assert isinstance(approx['hough'].base, np.memmap), \
+        'Hough space was not loaded from the cache.'
+    assert approx['elastic modulus'] == expected['elastic modulus'], \
+        'Cached Hough space gives a different modulus.'
+    # a subsample is cached only if it is drawn from an integer seed
+    moduli = []
+    for kwds in ({'seed': 3}, {'seed': np.int64(3)}):
+        approx = approximate_elastic_regime_from_hough(
+            mechprop, subsample=True, cache=cache, **kwds)
+        moduli.append(approx['elastic modulus'])
+        assert len(os.listdir(cache)) == 4, \
+            'Expected one cached subsample ({}).'.format(kwds)
+    assert isinstance(approx['hough'].base, np.memmap) and \
+           moduli[0] == moduli[1], \
+        'The cached subsample was not reused.'
+    for kwds in ({}, {'rng': np.random.default_rng(3)}):
+        approximate_elastic_regime_from_hough(
+            mechprop, subsample=True, cache=cache, **kwds)
+        assert len(os.listdir(cache)) == 4, \
+            'A subsample without an integer seed was cached.'
+        with pytest.raises(ValueError):
+            HoughSpace.digest(strain, stress, subsample=True, **kwds)
+
+
+def test_accumulator_dtype():
+    assert accumulator_dtype(100) == np.uint16, \
+        'Small counts should be stored as uint16.'
+    assert accumulator_dtype(70000) == np.uint32, \
+        'Counts above 65535 should be stored as uint32.'
+    assert accumulator_dtype(70000, np.uint16) == np.uint32, \
+        'uint16 should be promoted when it cannot hold the counts.'
+    assert accumulator_dtype(100, np.float32) == np.float32, \
+        'float32 holds small counts exactly.'
+    assert accumulator_dtype(2**25, np.float32) == np.float64, \
+        'float32 should be promoted when it cannot hold the counts exactly.'
+
+
+def test_grid_size(mechanical_properties):
+    assert grid_size(100000) == (1801, 1801), \
+        'Default precision should give a 1801 x 1801 grid ({})'.format(
+            grid_size(100000))
+    assert grid_size(200) == (1801, 200), \
+        'Few points should give one radial division per point ({})'.format(
+            grid_size(200))
+    assert grid_size(5000, precision=0.5) == (361, 361), \
+        'A 0.5 degree precision should give 361 divisions ({})'.format(
+            grid_size(5000, precision=0.5))
+    nq, nr = grid_size(5000, memory=1)
+    assert nq*nr*2 <= 2**20, \
+        'A {} x {} grid exceeds the 1 MB budget.'.format(nq, nr)
+    mechprop = mechanical_properties
+    strain = Normalized(np.copy(mechprop.strain))
+    stress = Normalized(np.copy(mechprop.stress))
+    h = HoughSpace(strain, stress, nq='auto', nr='auto', memory=0.5)
+    assert h.nbytes <= 0.5*2**20, \
+        'Auto-sized Hough space uses {} B, more than 0.5 MB'.format(h.nbytes)
+    approx = approximate_elastic_regime_from_hough(
+        mechprop, nq='auto', nr='auto', memory=0.5)
+    assert approx['hough'].shape == h.shape, \
+        'Approximation should use the auto-sized grid.'
+    # the budget covers the vote batches too, not only the accumulator
+    for kwds in ({}, {'voting': 'linear'}):
+        tracemalloc.start()
+        try:
+            h = HoughSpace(strain, stress, nq='auto', nr='auto', memory=2,
+                           **kwds)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert peak <= 1.25*2*2**20, \
+            'A build under a 2 MB budget peaked at {} B ({})'.format(
+                peak, kwds)
+
+
+def test_compact_hough_dtype(mechanical_properties):
+    mechprop = mechanical_properties
+    strain = Normalized(np.copy(mechprop.strain))
+    stress = Normalized(np.copy(mechprop.stress))
+    reference = HoughSpace(strain, stress, nq=361, nr=401, dtype=int)
+    for dtype in (None, np.uint32, np.float32):
+        h = HoughSpace(strain, stress, nq=361, nr=401, dtype=dtype)
+        expected = accumulator_dtype(strain.size, dtype)
+        assert h.dtype == expected, \
+            'Hough accumulator is {}, should be {}'.format(h.dtype, expected)
+        assert np.array_equal(h, reference), \
+            'The {} Hough accumulator does not match.'.format(h.dtype)
+
+
+def test_hough_memory():
+    # the peak memory of a build, and of resampling it, is of the order
+    # of the accumulator: votes are binned over the rows they touch,
+    # and the cdf is formed block by block, never over the whole grid
+    strain = np.linspace(0, 0.05, 5000)
+    stress = np.where(strain < 0.004, 70000*strain,
+                      280 + 1000*np.sqrt(np.maximum(strain - 0.004, 0)))
+    strain, stress = Normalized(strain), Normalized(stress)
+    for kwds in ({}, {'weights': 'density'}, {'voting': 'linear'},
+                 {'band': (60, 90)}):
+        tracemalloc.start()
+        try:
+            h = HoughSpace(strain, stress, **kwds)
+            built = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        tracemalloc.start()
+        try:
+            resampled = resample(h, num=strain.size, seed=0)
+            drawn = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert built < 2.5*h.nbytes, \
+            'Building a {} MB Hough space ({}) peaked at {} MB'.format(
+                h.nbytes/2**20, kwds, built/2**20)
+        assert drawn < 1.5*resampled.nbytes, \
+            'Resampling to {} MB ({}) peaked at {} MB'.format(
+                resampled.nbytes/2**20, kwds, drawn/2**20)
+
+
+def test_resample():
+    arr = np.random.default_rng(2).integers(0, 5, size=(20, 30))
+    resampled = resample(arr, num=600, seed=7)
+    assert resampled.sum() == 600, \
+        'Resampled {} samples, should be 600'.format(resampled.sum())
+    assert np.array_equal(resampled, resample(arr, num=600, seed=7)), \
+        'Seeded resampling is not reproducible.'
+    # reference: bisect each integer target into the integer cdf
+    cdf = np.cumsum(arr.ravel())
+    targets = np.random.default_rng(7).integers(0, cdf[-1], size=600,
+                                                dtype=np.uint16)
+    expected = np.zeros(arr.size, dtype=int)
+    for target in targets:
+        expected[bisect_right(cdf, target)] += 1
+    resampled = resample(arr.astype(np.uint8), num=600,
+                         rng=np.random.default_rng(7))
+    assert np.array_equal(resampled.ravel(), expected), \
+        'Resampling does not match the bisect reference.'
+    # the block-wise cdf draws the same samples, whatever the blocks
+    for blocksize in (1, 7, 64, 1000):
+        resampled = resample(arr.astype(np.uint8), num=600, seed=7,
+                             blocksize=blocksize)
+        assert np.array_equal(resampled.ravel(), expected), \
+            'Resampling in blocks of {} does not match the bisect ' \
+            'reference.'.format(blocksize)
+    # large accumulators: the cdf is held in an integer type
+    arr = np.full((1801, 1801), 1000, dtype=np.uint16)
+    resampled = resample(arr, num=10000, seed=3, chunksize=4096)
+    assert resampled.sum() == 10000, \
+        'Resampled {} samples, should be 10000'.format(resampled.sum())
+    # weighted (floating point) counts
+    weights = np.zeros(10)
+    weights[3] = 0.25
+    weights[7] = 0.75
+    resampled = resample(weights, num=4000, seed=5)
+    assert resampled.sum() == 4000 and \
+        set(np.flatnonzero(resampled)) == {3, 7}, \
+        'Weighted resampling drew from empty bins.'
+    assert abs(resampled[7]/4000. - 0.75) < 0.05, \
+        'Weighted resampling does not follow the weights.'
+
+
+def test_smooth_and_local_maxima():
+    arr = np.random.default_rng(3).random((120, 80))
+    arr[70, 20] = 50.
+    arr[30, 60] = 40.
+    expected = gaussian_filter(arr, 2.)[40:100]
+    smoothed = smooth(arr, 2., rows=(40, 100), dtype=float)
+    assert np.allclose(smoothed, expected), \
+        'Band-limited smoothing does not match the full gaussian filter.'
+    peaks = local_maxima(arr, k=2, min_separation=3)
+    assert np.array_equal(peaks, [[70, 20], [30, 60]]), \
+        'Local maxima found at {}, should be [[70, 20], [30, 60]]'.format(
+            peaks.tolist())
+    # sub-division position of a sampled parabola
+    rows, cols = np.mgrid[0:9, 0:9]
+    arr = -(rows - 4.3)**2 - 2*(cols - 3.8)**2
+    assert np.allclose(interpolate_peak(arr, (4, 4)), [4.3, 3.8]), \
+        'Interpolated peak at {}, should be [4.3, 3.8]'.format(
+            interpolate_peak(arr, (4, 4)))
+
+
+def test_deterministic_peak_detector(mechanical_properties):
+    mechprop = mechanical_properties
+    first = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic')
+    second = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic', banded=True)
+    assert first['elastic modulus'] == second['elastic modulus'] and \
+           first['elastic onset'] == second['elastic onset'], \
+        'Deterministic peak detection is not reproducible.'
+    # the band margin follows the smoothing width on finer grids
+    first = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic', nq=3601, nr=361)
+    second = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic', nq=3601, nr=361, banded=True)
+    assert np.array_equal(first['resampled'], second['resampled']), \
+        'Banded smoothing does not match the full grid smoothing.'
+    stochastic = approximate_elastic_regime_from_hough(mechprop, seed=0)
+    assert np.isclose(first['elastic modulus'],
+                      stochastic['elastic modulus'], rtol=5.e-2), \
+        'Deterministic elastic modulus ({:.3f}) does not match the ' \
+        'resampled search ({:.3f})'.format(first['elastic modulus'],
+                                           stochastic['elastic modulus'])
+
+
+def toe_curve(toe_strain, toe_modulus, **kwds):
+    """
+    Synthetic stress-strain curve: a toe of slope `toe_modulus` to
+    `toe_strain`, then elastic (slope 70000) to 300 MPa, then power law
+    hardening, `hardening*sqrt(strain - yield strain)`, to `strain`.
+    """
+    npoints = kwds.get('npoints', 5000)
+    hardening = kwds.get('hardening', 1000)
+    rng = np.random.default_rng(kwds.get('seed', 0))
+    strain = np.linspace(0, kwds.get('strain', 0.05), npoints)
+    toe_stress = toe_modulus*toe_strain
+    yield_strain = toe_strain + (300 - toe_stress)/70000
+    stress = np.interp(strain, [0, toe_strain, yield_strain],
+                       [0, toe_stress, 300]) + \
+        hardening*np.sqrt(np.maximum(strain - yield_strain, 0)) + \
+        rng.normal(0, kwds.get('noise', 1.5), npoints)
+    time = np.linspace(0, 100, npoints)
+    return MechanicalProperties(
+        pd.DataFrame({'time': time, 'strain': strain}),
+        pd.DataFrame({'time': time, 'stress': stress}))
+
+
+def test_hough_peaks_and_compliance():
+    # scaled curve: compliance (slope 1) to x = 0.1, elastic (slope 4)
+    # to x = 0.3, then plastic
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 1, 3000)
+    y = np.interp(x, [0, 0.1, 0.3, 1], [0, 0.1, 0.9, 1]) + \
+        rng.normal(0, 0.002, x.size)
+    h = HoughSpace(x, y)
+    found = h.peaks(3, (30, 90), min_separation=10, sigma=3*np.sqrt(3))
+    angles = np.degrees(found['theta'])
+    for expected in (np.degrees(np.arctan(4)), 45):
+        assert np.min(np.abs(angles - expected)) < 1, \
+            'No peak found at {:.1f} degrees ({})'.format(expected, angles)
+    assert np.all(np.diff(found['votes']) <= 0), \
+        'Peaks should be ordered from the strongest.'
+    time = np.linspace(0, 100, x.size)
+    mechprop = MechanicalProperties(
+        pd.DataFrame({'time': time, 'strain': 0.05*x}),
+        pd.DataFrame({'time': time, 'stress': 500*y}))
+    approx = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic', compliance=True)
+    onset = approx['elastic strain'].min()
+    assert np.isclose(onset, 0.005, atol=2.e-4), \
+        'Elastic region should start after the compliance region, ' \
+        'at 0.005 ({:.4g})'.format(onset)
+    # realistic toe: slope 15000 to 0.001 strain
+    mechprop = toe_curve(0.001, 15000, strain=0.012, hardening=300)
+    for detector in ('deterministic', 'resample'):
+        approx = approximate_elastic_regime_from_hough(
+            mechprop, detector=detector, seed=0, compliance=True)
+        onset = approx['elastic strain'].min()
+        assert np.isclose(onset, 0.001, atol=2.e-4), \
+            'Elastic region should start after the toe, at 0.001 ' \
+            '({:.4g})'.format(onset)
+    # no toe: the elastic region is unchanged
+    mechprop = toe_curve(0, 70000, strain=0.012, hardening=300)
+    for detector in ('deterministic', 'resample'):
+        expected = approximate_elastic_regime_from_hough(
+            mechprop, detector=detector, seed=0)
+        approx = approximate_elastic_regime_from_hough(
+            mechprop, detector=detector, seed=0, compliance=True)
+        assert np.array_equal(approx['elastic strain'],
+                              expected['elastic strain']), \
+            'Compliance detection changed the elastic region of a ' \
+            'curve without a toe ({} of {} points kept)'.format(
+                approx['elastic strain'].size,
+                expected['elastic strain'].size)
+    # a sidelobe of the elastic peak is not a compliance line
+    mechprop = toe_curve(0.0015, 30000)
+    expected = approximate_elastic_regime_from_hough(mechprop, seed=0)
+    approx = approximate_elastic_regime_from_hough(
+        mechprop, seed=0, compliance=True)
+    assert approx['elastic strain'].size > 0 and \
+           approx['elastic strain'].min() <= 0.0015 + 2.e-4, \
+        'Compliance detection removed the elastic region ({} of {} ' \
+        'points kept)'.format(approx['elastic strain'].size,
+                              expected['elastic strain'].size)
+
+
+def test_hough_segment(mechanical_properties):
+    mechprop = mechanical_properties
+    # a line, y = x/2, that holds only points [100, 300)
+    x = np.linspace(0, 1, 500)
+    y = np.where((x >= x[100]) & (x < x[300]), 0.5*x, 1 - x)
+    h = HoughSpace(x, y)
+    theta = np.arctan(0.5)
+    found = h.peaks(1, (0, 90), segments=True)
+    assert np.isclose(found['theta'][0], theta, atol=np.radians(0.2)), \
+        'Peak ({:.4f}) should lie on the line ({:.4f})'.format(
+            found['theta'][0], theta)
+    assert (found['start'][0], found['end'][0]) == (100, 300), \
+        'Segment should span points [100, 300), not [{}, {})'.format(
+            found['start'][0], found['end'][0])
+    # the segment region matches the offset region of a real curve
+    offset = approximate_elastic_regime_from_hough(mechprop)
+    segment = approximate_elastic_regime_from_hough(mechprop, region='segment')
+    assert np.isclose(segment['elastic strain'].max(),
+                      offset['elastic strain'].max(), rtol=5.e-2), \
+        'Segment elastic region ends at {:.4g}, not {:.4g}'.format(
+            segment['elastic strain'].max(), offset['elastic strain'].max())
+
+
+def test_region_of_interest(mechanical_properties):
+    mechprop = mechanical_properties
+    full = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic')
+    for roi in ('ultimate', 0.5, (0, mechprop.strain.size//2)):
+        approx = approximate_elastic_regime_from_hough(
+            mechprop, detector='deterministic', roi=roi)
+        assert approx['hough'].x.size < full['hough'].x.size, \
+            'Region of interest {} should limit the voting points.'.format(roi)
+        assert np.allclose(approx['hough'].radius, full['hough'].radius), \
+            'Region of interest {} should keep the radial range.'.format(roi)
+        assert np.isclose(approx['elastic modulus'], full['elastic modulus'],
+                          rtol=2.e-2), \
+            'Region of interest {} elastic modulus ({:.3f}) does not ' \
+            'match the full run ({:.3f})'.format(
+                roi, approx['elastic modulus'], full['elastic modulus'])
+    with pytest.raises(ValueError):
+        approximate_elastic_regime_from_hough(mechprop, roi='plastic')
+
+
+def test_buffer_pool(mechanical_properties):
+    mechprop = mechanical_properties
+    pool = BufferPool()
+    a = pool.acquire((10, 20), np.uint16, zero=True)
+    assert a.shape == (10, 20) and a.dtype == np.uint16 and not a.any(), \
+        'Pooled array has the wrong shape, type or contents.'
+    assert pool.release(a[2:5]) and not pool.release(np.zeros(3)), \
+        'Only (views of) pooled arrays can be released.'
+    b = pool.acquire(100, np.float32)
+    assert (pool.hits, pool.misses, pool.nbytes) == (1, 1, 400), \
+        'A free buffer of the same size should be reused.'
+    pool.release(b)
+    # batch runs keep a flat memory profile and reproduce the results
+    # of unpooled runs
+    expected = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic')
+    peaks = []
+    for _ in range(3):
+        approx = approximate_elastic_regime_from_hough(
+            mechprop, detector='deterministic', pool=pool)
+        assert approx['elastic modulus'] == expected['elastic modulus'], \
+            'Pooled run does not match the unpooled run.'
+        pool.release(approx['hough'])
+        pool.release(approx['resampled'])
+        peaks.append(pool.peak_bytes)
+    assert pool.in_use == 0 and peaks[0] == peaks[-1], \
+        'Pooled memory should not grow across runs ({}).'.format(peaks)
+    # the buffers of the votes, and the cumulative distributions and
+    # bins of the resampling, come from the pool too: once the pool is
+    # warm, a run allocates nothing, and draws more than the
+    # accumulator and the resampled array from it
+    expected = approximate_elastic_regime_from_hough(mechprop, seed=0)
+    for _ in range(2):
+        pool.reset()
+        approx = approximate_elastic_regime_from_hough(
+            mechprop, seed=0, pool=pool)
+        assert approx['elastic modulus'] == expected['elastic modulus'], \
+            'Pooled run does not match the unpooled run.'
+        pool.release(approx['hough'])
+        pool.release(approx['resampled'])
+    assert pool.misses == 0 and pool.hits >= 2 + 3 + 4, \
+        'A warm pool served {} buffers and allocated {}'.format(
+            pool.hits, pool.misses)
+    assert pool.in_use == 0, 'Every pooled buffer should be released.'
+
+
+def test_refined_hough(mechanical_properties):
+    mechprop = mechanical_properties
+    strain = Normalized(np.copy(mechprop.strain))
+    stress = Normalized(np.copy(mechprop.stress))
+    full = HoughSpace(strain, stress)
+    h = refined_hough(strain, stress, 60, 90, 6)
+    q0, r0 = h.qoffset, h.roffset
+    q1, r1 = q0 + h.shape[0], r0 + h.shape[1]
+    assert h.shape[0] < full.shape[0] and h.shape[1] < full.shape[1], \
+        'Refined Hough window {} is not smaller than {}'.format(
+            h.shape, full.shape)
+    assert np.array_equal(h, full[q0:q1, r0:r1]), \
+        'Refined Hough window does not match the full Hough space.'
+    dense = approximate_elastic_regime_from_hough(mechprop)
+    pyramid = approximate_elastic_regime_from_hough(mechprop, pyramid=6)
+    assert np.isclose(pyramid['elastic modulus'], dense['elastic modulus'],
+                      rtol=5.e-2), \
+        'Pyramid elastic modulus ({:.3f}) does not match the dense ' \
+        'search ({:.3f})'.format(pyramid['elastic modulus'],
+                                 dense['elastic modulus'])
+
+
 def test_approximate_elastic_regime_from_hough(generate_output,
                                                expected_output,
                                                mechanical_properties):
@@ -293,9 +1077,9 @@ def test_approximate_elastic_regime_from_hough(generate_output,
         expected_output['elastic modulus'] = float(elastic['elastic modulus'])
         expected_output['elastic onset'] = float(elastic['elastic onset'])
         # report
-        for k,v in elastic.iteritems():
-            print "{}: ({}, {})".format(
-                k, np.asarray(v).min(), np.asarray(v).max())
+        for k,v in elastic.items():
+            print("{}: ({}, {})".format(
+                k, np.asarray(v).min(), np.asarray(v).max()))
         epsilon = elastic['elastic strain']
         sigma = elastic['elastic stress']
         modulus = elastic['elastic modulus']
@@ -333,6 +1117,244 @@ def test_approximate_elastic_regime_from_hough(generate_output,
                     dpi=300, bbox_inches='tight')
 
 
+def lstsq_modulus(strain, stress):
+    """
+    Reference (multi-pass, least squares) implementation of
+    `calculate_modulus`, against which the single pass version is
+    checked.
+    """
+    x, y = np.asarray(strain), np.asarray(stress)
+    N = len(x)
+    xbar, ybar = x.mean(), y.mean()
+    a = np.stack((np.ones_like(strain).astype(float), strain), axis=-1)
+    ((b, m), residuals, rank, SV) = np.linalg.lstsq(a, stress, rcond=None)
+    modulus = ((x*y).sum() - N*xbar*ybar) / \
+              ((x**2).sum() - N*xbar**2)
+    ssx = ((x - xbar)**2).sum()
+    ssy = ((y - ybar)**2).sum()
+    rsq = 1 - residuals[0]/ssy
+    cov = 100*np.sqrt((1/rsq - 1)/(N - 2))
+    ses = np.sqrt(residuals[0]/((N - 2)*ssx))
+    return {
+        'modulus': modulus,
+        'elastic onset': -b/modulus,
+        'coefficient of determination': rsq,
+        'coefficient of variation': cov,
+        'standard error in the slope': ses
+    }
+
+
+def test_calculate_modulus(mechanical_properties):
+    mechprop = mechanical_properties
+    rng = np.random.default_rng(0)
+    strain = 0.3 + 0.01*rng.random(200000)
+    stress = 70000*strain + 5 + rng.normal(0, 2, strain.size)
+    elastic = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic')
+    for x, y in ((strain, stress),
+                 (strain[:10], stress[:10]),
+                 (elastic['elastic strain'], elastic['elastic stress'])):
+        expected = lstsq_modulus(x, y)
+        actual = calculate_modulus(x, y)
+        for key, value in expected.items():
+            assert np.isclose(actual[key], value, rtol=1.e-9, atol=0), \
+                '{} ({}) does not match the least squares value ' \
+                '({})'.format(key, actual[key], value)
+
+
+def test_regression_statistics():
+    rng = np.random.default_rng(0)
+    strain = 0.3 + 0.01*rng.random(1000)
+    # exactly linear data fit perfectly
+    actual = calculate_modulus(strain, 70000*strain + 5)
+    assert np.isclose(actual['coefficient of determination'], 1), \
+        'R^2 of linear data ({}) is not 1.'.format(
+            actual['coefficient of determination'])
+    assert actual['coefficient of variation'] < 1.e-4, \
+        'V1 of linear data ({}) is not 0.'.format(
+            actual['coefficient of variation'])
+    # noisy data agree with the correlation coefficient and the
+    # covariance of the least squares slope
+    stress = 70000*strain + 5 + rng.normal(0, 20, strain.size)
+    actual = calculate_modulus(strain, stress)
+    rsq = np.corrcoef(strain, stress)[0, 1]**2
+    _, cov = np.polyfit(strain, stress, 1, cov='unscaled')
+    residual = stress - np.polyval(np.polyfit(strain, stress, 1), strain)
+    ses = np.sqrt(cov[0, 0]*(residual**2).sum()/(strain.size - 2))
+    assert np.isclose(actual['coefficient of determination'], rsq), \
+        'R^2 ({}) does not match ({}).'.format(
+            actual['coefficient of determination'], rsq)
+    assert np.isclose(actual['standard error in the slope'], ses), \
+        'Standard error ({}) does not match ({}).'.format(
+            actual['standard error in the slope'], ses)
+    assert np.isclose(actual['coefficient of variation'],
+                      100*ses/actual['modulus']), \
+        'V1 is not the relative standard error of the slope.'
+    # integer weights count each point that many times
+    weights = rng.integers(1, 5, strain.size)
+    actual = calculate_modulus(strain, stress, weights=weights)
+    expected = calculate_modulus(np.repeat(strain, weights),
+                                 np.repeat(stress, weights))
+    for key, value in expected.items():
+        assert np.isclose(actual[key], value), \
+            'Weighted {} ({}) does not match ({}).'.format(
+                key, actual[key], value)
+
+
+def test_calculate_moduli():
+    rng = np.random.default_rng(0)
+    counts = rng.integers(3, 200, 50)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    strain = 0.01*rng.random(offsets[-1])
+    stress = 70000*strain + rng.normal(0, 2, strain.size)
+    # ragged data
+    batch = calculate_moduli(strain, stress, offsets=offsets)
+    for i, (lo, hi) in enumerate(zip(offsets[:-1], offsets[1:])):
+        single = calculate_modulus(strain[lo:hi], stress[lo:hi])
+        for key, value in single.items():
+            assert np.isclose(batch[key][i], value, rtol=1.e-9,
+                              equal_nan=True), \
+                'Batched {} ({}) of data set {} does not match ' \
+                '({})'.format(key, batch[key][i], i, value)
+    # masked 2-D data
+    strain = strain[:1000].reshape(10, 100)
+    stress = stress[:1000].reshape(10, 100)
+    mask = rng.random(strain.shape) < 0.7
+    batch = calculate_moduli(strain, stress, mask=mask)
+    expected = [calculate_modulus(x[m], y[m])['modulus']
+                for x, y, m in zip(strain, stress, mask)]
+    assert np.allclose(batch['modulus'], expected, rtol=1.e-9), \
+        'Batched moduli of masked rows do not match.'
+    with pytest.raises(ValueError):
+        calculate_moduli(strain.ravel(), stress.ravel())
+
+
+def test_elastic_window_search():
+    # toe (slope 15000) to 0.003 strain, then elastic (slope 70000)
+    # to 300 MPa, then power law hardening
+    rng = np.random.default_rng(0)
+    strain = np.linspace(0, 0.05, 5000)
+    stress = np.interp(strain, [0, 0.003, 0.00664], [0, 45, 300]) + \
+        1000*np.sqrt(np.maximum(strain - 0.00664, 0)) + \
+        rng.normal(0, 1.5, strain.size)
+    found = elastic_window_search(strain, stress)
+    start, end = found['window']
+    assert abs(strain[start] - 0.003) < 2.e-4 and \
+           abs(strain[end - 1] - 0.00664) < 5.e-4, \
+        'Elastic window [{:.4g}, {:.4g}] should span [0.003, 0.00664]'.format(
+            strain[start], strain[end - 1])
+    # the window statistics are those of a fit to the window, by every
+    # estimator
+    fit = calculate_modulus(strain[start:end], stress[start:end])
+    batch = calculate_moduli(strain[start:end], stress[start:end],
+                             offsets=[0, end - start])
+    for key, value in fit.items():
+        assert np.isclose(found[key], value, rtol=1.e-6, atol=0), \
+            'Window {} ({}) does not match the regression of the ' \
+            'window ({})'.format(key, found[key], value)
+        assert np.isclose(batch[key][0], value, rtol=1.e-9, atol=0), \
+            'Batched {} ({}) does not match the regression of the ' \
+            'window ({})'.format(key, batch[key][0], value)
+    assert np.isclose(found['modulus'], 70000, rtol=1.e-2), \
+        'Elastic modulus ({:.1f}) should be 70000'.format(found['modulus'])
+    # used by set_elastic
+    time = np.linspace(0, 100, strain.size)
+    mechprop = MechanicalProperties(
+        pd.DataFrame({'time': time, 'strain': strain}),
+        pd.DataFrame({'time': time, 'stress': stress}))
+    best = set_elastic(mechprop, interactive=False, search='window')
+    # the window search replaces the Hough approximator
+    assert best['hough'].size == 0 and best['resampled'].size == 0, \
+        'The window search should not run the approximator.'
+    assert np.isclose(mechprop.elastic_modulus, 70000, rtol=1.e-2), \
+        'set_elastic modulus ({:.1f}) should be 70000'.format(
+            mechprop.elastic_modulus)
+    found = elastic_window_search(mechprop.strain, mechprop.stress)
+    assert np.isclose(best['rsq'], found['coefficient of determination'],
+                      rtol=1.e-6) and \
+           np.isclose(best['cov'], found['coefficient of variation'],
+                      rtol=1.e-6) and \
+           np.isclose(best['SE modulus'],
+                      found['standard error in the slope'], rtol=1.e-6), \
+        'set_elastic statistics do not match those of the window search'
+
+    # a long, straight hardening line fits better than the elastic
+    # line, unless the windows are kept short (see `maxpoints`)
+    strain = np.linspace(0, 0.1, 5000)
+    stress = np.where(strain < 0.01, 60000*strain,
+                      600 + 3000*(strain - 0.01)) + \
+        rng.normal(0, 0.5, strain.size)
+    found = elastic_window_search(strain, stress)
+    start, end = found['window']
+    assert np.isclose(found['modulus'], 60000, rtol=1.e-2) and \
+           strain[end - 1] < 0.0105, \
+        'Elastic window [{:.4g}, {:.4g}] (modulus {:.1f}) should lie ' \
+        'below 0.01 strain'.format(strain[start], strain[end - 1],
+                                   found['modulus'])
+    found = elastic_window_search(strain, stress, maxpoints=strain.size)
+    assert np.isclose(found['modulus'], 3000, rtol=1.e-2), \
+        'An unbounded window ({:.1f}) should find the hardening ' \
+        'line'.format(found['modulus'])
+
+
+def test_remove_outliers(mechanical_properties):
+    mechprop = mechanical_properties
+    # residual strain of the approximate elastic region
+    elastic = approximate_elastic_regime_from_hough(
+        mechprop, detector='deterministic')
+    strain, stress = elastic['elastic strain'], elastic['elastic stress']
+    modulus, intercept = np.polyfit(strain, stress, 1)
+    residuals = [strain - (stress - intercept)/modulus]
+    # heavy tailed and tied values
+    rng = np.random.default_rng(0)
+    residuals += [rng.standard_cauchy(500),
+                  np.round(rng.standard_t(2, 500), 1),
+                  rng.integers(0, 5, 50).astype(float)]
+    for residual in residuals:
+        expected = remove_outliers(residual, engine='loop')
+        actual = remove_outliers(residual)
+        assert np.array_equal(actual, expected), \
+            'Sorted outlier removal ({} removed) does not match the ' \
+            'reference ({} removed)'.format((~actual).sum(),
+                                            (~expected).sum())
+
+
+def test_refine_elastic():
+    # elastic (slope 70000) to 300 MPa with a few spikes, then power
+    # law hardening
+    rng = np.random.default_rng(0)
+    strain = np.linspace(0, 0.05, 5000)
+    stress = np.minimum(70000*strain, 300) + \
+        1000*np.sqrt(np.maximum(strain - 300/70000, 0)) + \
+        rng.normal(0, 1.5, strain.size)
+    spikes = [100, 200, 300]
+    stress[spikes] += 30
+    time = np.linspace(0, 100, strain.size)
+    mechprop = MechanicalProperties(
+        pd.DataFrame({'time': time, 'strain': strain}),
+        pd.DataFrame({'time': time, 'stress': stress}))
+    # without refinement, every point of the elastic region is fit
+    best = set_elastic(mechprop, interactive=False, detector='deterministic')
+    assert best['mask'].dtype == bool and best['mask'].all(), \
+        'Unrefined mask ({}) should select every point.'.format(
+            best['mask'].dtype)
+    best = set_elastic(mechprop, interactive=False, detector='deterministic',
+                       refine=True)
+    mask = best['mask']
+    assert mask.dtype == bool, \
+        'Refined mask ({}) should be boolean.'.format(mask.dtype)
+    assert best['iterations'] >= 1 and 0 < mask.sum() < mask.size, \
+        'Refinement should drop points ({} of {} kept in {} ' \
+        'iterations)'.format(mask.sum(), mask.size, best['iterations'])
+    for spike in spikes:
+        index = np.flatnonzero(best['elastic strain'] == strain[spike])
+        assert index.size == 0 or not mask[index].any(), \
+            'Spike at {:.4g} strain should be rejected.'.format(strain[spike])
+    assert np.isclose(mechprop.elastic_modulus, 70000, rtol=1.e-2), \
+        'Refined elastic modulus ({:.1f}) should be 70000'.format(
+            mechprop.elastic_modulus)
+
+
 def test_set_elastic(generate_output,
                      expected_output,
                      mechanical_properties):